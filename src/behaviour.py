@@ -0,0 +1,175 @@
+"""Customer-level purchase behaviour with compact per-customer state.
+
+Each customer is one record of a structured NumPy array (STATE_DTYPE, 25 bytes)
+so 10M customers fit in ~250 MB. The state is built once, vectorized:
+- home_store: an offline store in the customer's city (any offline store otherwise),
+- p_online: probability of ordering online (Beta distributed, mean ~1/3),
+- max_items: basket size grows with the number of children,
+- youngest/oldest child DOB from customer_child, used to pick a preferred
+  product category that follows the children's age month by month,
+- active/tenure: whether the customer bought last month, for retention.
+
+Monthly active sets keep a share of last month's buyers (retention) and top up
+with new customers, always sized within [monthly_active_min, monthly_active_max].
+Only the active set of a month is gathered into Python lists for the order loop.
+"""
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+NO_DATE = np.iinfo(np.int32).min
+
+STATE_DTYPE = np.dtype([
+    ('home_store', np.int32),     # store code (position in store_df), -1 = none
+    ('p_online', np.float32),     # probability an order is placed online
+    ('max_items', np.int8),       # distinct products per order drawn from 1..max_items
+    ('n_children', np.int8),
+    ('youngest_dob', np.int32),   # days since epoch, NO_DATE = no children
+    ('oldest_dob', np.int32),
+    ('pref_u', np.float32),       # fixed uniform draw picking the preferred category within an age bucket
+    ('active', np.bool_),         # bought in the previous month
+    ('tenure', np.int16),         # consecutive active months
+])
+
+# Categories a parent tends to buy by the age (months) of their youngest born child
+AGE_CATEGORY_AFFINITY = [
+    (12, ['Sữa bột', 'Tã/bỉm', 'Bình sữa & núm ti', 'Quần áo sơ sinh']),
+    (36, ['Sữa bột', 'Tã/bỉm', 'Đồ ăn dặm', 'Xe đẩy & ghế ngồi']),
+    (None, ['Sữa bột', 'Đồ vệ sinh', 'Xe đẩy & ghế ngồi']),
+]
+
+
+@dataclass
+class BehaviourModel:
+    # Share of last month's buyers that buy again this month
+    retention: float = 0.65
+    # Offline orders placed at the customer's home store
+    home_store_share: float = 0.85
+    # Chance that an order's first product comes from the preferred category
+    category_affinity: float = 0.5
+    # Beta(a, b) for the per-customer online probability
+    online_beta: tuple = (2.0, 4.0)
+
+
+def _days(values) -> np.ndarray:
+    return pd.to_datetime(pd.Series(values)).to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+
+def init_customer_state(cust_df: pd.DataFrame, child_df: Optional[pd.DataFrame], store_df: pd.DataFrame,
+                        model: BehaviourModel, rng: np.random.Generator) -> np.ndarray:
+    n = len(cust_df)
+    state = np.zeros(n, dtype=STATE_DTYPE)
+    store_types = store_df['store_type'] if 'store_type' in store_df.columns else pd.Series(['Offline'] * len(store_df))
+    offline = np.flatnonzero(store_types.to_numpy() == 'Offline')
+
+    # Home store: a store in the same city when there is one
+    state['home_store'] = rng.choice(offline, size=n) if len(offline) else -1
+    if len(offline) and 'thanh_pho' in cust_df.columns:
+        cust_city = cust_df['thanh_pho'].to_numpy()
+        store_city = store_df['thanh_pho'].to_numpy()
+        for city in pd.unique(store_city[offline]):
+            local = offline[store_city[offline] == city]
+            mask = cust_city == city
+            state['home_store'][mask] = rng.choice(local, size=int(mask.sum()))
+
+    a, b = model.online_beta
+    state['p_online'] = rng.beta(a, b, size=n)
+    state['pref_u'] = rng.random(n)
+    state['youngest_dob'] = NO_DATE
+    state['oldest_dob'] = NO_DATE
+
+    if child_df is not None and not child_df.empty:
+        codes = pd.Categorical(child_df['customer_id'], categories=cust_df['customer_id']).codes
+        dob = _days(child_df['ngay_sinh'])
+        keep = codes >= 0
+        codes, dob = codes[keep], dob[keep]
+        state['n_children'] = np.minimum(np.bincount(codes, minlength=n), 127)
+        youngest = np.full(n, NO_DATE, dtype=np.int64)
+        np.maximum.at(youngest, codes, dob)
+        oldest = np.full(n, np.iinfo(np.int64).max)
+        np.minimum.at(oldest, codes, dob)
+        has = state['n_children'] > 0
+        state['youngest_dob'][has] = youngest[has]
+        state['oldest_dob'][has] = oldest[has]
+
+    # Bigger families buy bigger baskets: max items 3..5 (mean items/order stays close to the 1-5 default)
+    state['max_items'] = np.clip(3 + (state['n_children'] + rng.integers(0, 2, size=n)) // 2, 3, 5)
+    return state
+
+
+class CustomerBehaviour:
+    """Per-customer state plus month-to-month active-set selection."""
+
+    def __init__(self, state: np.ndarray, model: BehaviourModel, rng: np.random.Generator,
+                 categories: List[str]):
+        self.state = state
+        self.model = model
+        self.rng = rng
+        self.prev_active = np.zeros(0, dtype=np.int64)
+        # Age buckets -> category codes present in this product catalogue
+        cat_code = {c: i for i, c in enumerate(categories)}
+        self.bucket_limits = np.array([lim for lim, _ in AGE_CATEGORY_AFFINITY if lim is not None])
+        self.bucket_cats = [[cat_code[c] for c in cats if c in cat_code] for _, cats in AGE_CATEGORY_AFFINITY]
+
+    @classmethod
+    def build(cls, cust_df: pd.DataFrame, child_df: Optional[pd.DataFrame], store_df: pd.DataFrame,
+              categories: List[str], model: BehaviourModel, rng: np.random.Generator) -> 'CustomerBehaviour':
+        return cls(init_customer_state(cust_df, child_df, store_df, model, rng), model, rng, categories)
+
+    def next_month(self, k: int) -> np.ndarray:
+        """Active customer codes for the next month: retained buyers topped up with new ones (shuffled)."""
+        n = len(self.state)
+        k = min(k, n)
+        prev = self.prev_active
+        retained = prev[self.rng.random(len(prev)) < self.model.retention]
+        if len(retained) > k:
+            retained = self.rng.choice(retained, size=k, replace=False)
+        need = k - len(retained)
+        taken = np.zeros(n, dtype=bool)
+        taken[retained] = True
+        new = np.zeros(0, dtype=np.int64)
+        if need and need * 2 < n - len(retained):
+            # Rejection sampling is O(k) and stays cheap when k << n
+            while len(new) < need:
+                cand = np.unique(self.rng.integers(0, n, size=2 * (need - len(new)) + 16))
+                cand = cand[~taken[cand]]
+                cand = self.rng.permutation(cand)[:need - len(new)]
+                taken[cand] = True
+                new = np.concatenate([new, cand])
+        elif need:
+            new = self.rng.choice(np.flatnonzero(~taken), size=need, replace=False)
+            taken[new] = True
+        active = self.rng.permutation(np.concatenate([retained, new]).astype(np.int64))
+
+        self.state['tenure'][self.state['active'] & ~taken] = 0
+        self.state['active'] = taken
+        self.state['tenure'][active] += 1
+        self.prev_active = active
+        return active
+
+    def month_traits(self, active: np.ndarray, month_start: date) -> Dict[str, list]:
+        """Gather the state of this month's active customers into plain lists for the order loop."""
+        s = self.state[active]
+        today = (month_start - date(1970, 1, 1)).days
+        born = s['youngest_dob'] <= today
+        # Age of the youngest child already born (the oldest if the youngest isn't yet)
+        dob = np.where(born, s['youngest_dob'], s['oldest_dob'])
+        has_child = (s['n_children'] > 0) & (dob <= today)
+        age_months = (today - dob.astype(np.int64)) // 30
+        bucket = np.searchsorted(self.bucket_limits, age_months, side='right')
+        pref = np.full(len(s), -1, dtype=np.int64)
+        for b, cats in enumerate(self.bucket_cats):
+            m = has_child & (bucket == b)
+            if cats and m.any():
+                pick = (s['pref_u'][m] * len(cats)).astype(np.int64)
+                pref[m] = np.asarray(cats)[pick]
+        return {
+            'customer': active.tolist(),
+            'home_store': s['home_store'].tolist(),
+            'p_online': s['p_online'].tolist(),
+            'max_items': s['max_items'].tolist(),
+            'pref_category': pref.tolist(),
+        }
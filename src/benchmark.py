@@ -0,0 +1,451 @@
+"""Throughput benchmarks for the generator builders and the Postgres loaders.
+
+Builders are measured in isolation (in memory, one fresh process per builder so
+the peak RSS reflects that builder only). Loaders are measured by running the
+full generate_and_load pipeline against a throw-away Postgres cluster started
+in a temp dir with `initdb`/`pg_ctl` (or against an existing server given via
+--pg-* flags). Results can be saved as JSON and compared against a baseline.
+
+--import-time checks CLI startup instead: each entry point is imported in a
+fresh interpreter with `-X importtime`, and the run fails if it exceeds the
+budget or pulls in the generator stack (pandas, numpy, Faker). A regular run
+performs the same check and, with --fail-on-regression, fails on it too.
+
+Example:
+    python src/benchmark.py --scale small --out bench/small.json
+    python src/benchmark.py --scale small --baseline bench/small.json --fail-on-regression
+    python src/benchmark.py --import-time --import-budget-ms 250
+    python src/benchmark.py --monthly-active 1000000 10000000
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from instrumentation import StageRecorder, peak_rss_mb
+
+
+@dataclass
+class BenchScale:
+    name: str
+    orders: int
+    customers: int
+    products: int
+    employees: int
+    stores: int
+    promotions: int
+    years: int
+
+
+SCALES = {
+    'small': BenchScale('small', orders=10_000, customers=1_000, products=180, employees=40, stores=10, promotions=15, years=3),
+    'medium': BenchScale('medium', orders=1_000_000, customers=100_000, products=500, employees=400, stores=40, promotions=50, years=5),
+    'large': BenchScale('large', orders=10_000_000, customers=1_000_000, products=2_000, employees=2_000, stores=200, promotions=200, years=20),
+}
+
+DEFAULT_SEED = 20240101
+
+# Entry points that must start without the generator stack, and the modules they must not import
+IMPORT_CHECKS = {
+    'main': ('pandas', 'numpy', 'faker'),
+    'db': ('pandas', 'numpy', 'faker'),
+}
+IMPORT_BUDGET_MS = 250
+
+
+def scale_config(scale: BenchScale, seed: int):
+    from generate_data import Config
+    return Config(
+        customers=scale.customers,
+        products=scale.products,
+        employees=scale.employees,
+        stores=scale.stores,
+        promotions=scale.promotions,
+        years=scale.years,
+        min_rows=scale.orders,
+        max_rows=scale.orders,
+        monthly_active_min=max(1, scale.customers // 10),
+        monthly_active_max=max(1, scale.customers // 8),
+        seed=seed,
+    )
+
+
+def builder_cases(cfg) -> Dict[str, Tuple[List[str], Callable[[Dict[str, Any]], Any]]]:
+    """Map builder name -> (prerequisite builders, call taking the results so far)."""
+    import numpy as np
+    import generate_data as g
+    from costs import build_cost_matrix
+    from demand import load_demand_model
+    return {
+        'build_date_dim': ([], lambda ctx: g.build_date_dim(cfg.years)),
+        'build_store_dim': ([], lambda ctx: g.build_store_dim(cfg.stores)),
+        'build_employee_dim': (['build_store_dim'], lambda ctx: g.build_employee_dim(
+            cfg.employees, ctx['build_store_dim'].query("store_type == 'Offline'")['store_id'].tolist())),
+        'build_customer_dim': ([], lambda ctx: g.build_customer_dim(cfg.customers)),
+        'build_customer_children': (['build_customer_dim'], lambda ctx: g.build_customer_children(ctx['build_customer_dim'])),
+        'build_product_dim': ([], lambda ctx: g.build_product_dim(cfg.products)),
+        'build_promotion_dim': (['build_date_dim'], lambda ctx: g.build_promotion_dim(cfg.promotions, ctx['build_date_dim'])),
+        'build_product_daily_costs': (['build_date_dim', 'build_product_dim'], lambda ctx: build_cost_matrix(
+            ctx['build_date_dim'], ctx['build_product_dim'], np.random.default_rng(cfg.seed))),
+        'build_orders': (
+            ['build_date_dim', 'build_customer_dim', 'build_product_dim', 'build_store_dim', 'build_employee_dim', 'build_promotion_dim'],
+            lambda ctx: g.build_orders(
+                cfg.min_rows, cfg.max_rows,
+                ctx['build_date_dim'], ctx['build_customer_dim'], ctx['build_product_dim'],
+                ctx['build_employee_dim'], ctx['build_store_dim'], ctx['build_promotion_dim'],
+                monthly_active_min=cfg.monthly_active_min, monthly_active_max=cfg.monthly_active_max,
+            )),
+        # Same orders drawn from the seasonal/Zipf demand model (should match build_orders throughput)
+        'build_orders_seasonal': (
+            ['build_date_dim', 'build_customer_dim', 'build_product_dim', 'build_store_dim', 'build_employee_dim', 'build_promotion_dim'],
+            lambda ctx: g.build_orders(
+                cfg.min_rows, cfg.max_rows,
+                ctx['build_date_dim'], ctx['build_customer_dim'], ctx['build_product_dim'],
+                ctx['build_employee_dim'], ctx['build_store_dim'], ctx['build_promotion_dim'],
+                monthly_active_min=cfg.monthly_active_min, monthly_active_max=cfg.monthly_active_max,
+                demand=load_demand_model('seasonal'),
+            )),
+        'build_kpi_targets': (['build_orders'], lambda ctx: g.build_kpi_targets(*ctx['build_orders'])),
+    }
+
+
+def count_rows(result: Any) -> int:
+    if isinstance(result, tuple):
+        return sum(len(r) for r in result)
+    return len(result)
+
+
+def run_builder_case(scale_name: str, seed: int, case: str) -> Dict[str, Any]:
+    """Build the prerequisites of `case` (not measured), then measure `case` alone."""
+    import generate_data as g
+    cfg = scale_config(SCALES[scale_name], seed)
+    cases = builder_cases(cfg)
+    g.seed_everything(seed)
+    ctx: Dict[str, Any] = {}
+
+    def prepare(name: str):
+        for dep in cases[name][0]:
+            if dep not in ctx:
+                prepare(dep)
+                ctx[dep] = cases[dep][1](ctx)
+
+    prepare(case)
+    rec = StageRecorder()
+    with rec.stage(case) as st:
+        st.rows = count_rows(cases[case][1](ctx))
+    m = rec.stages[0]
+    return {'kind': 'builder', 'rows': m.rows, 'wall_s': m.wall_s, 'cpu_s': m.cpu_s,
+            'rows_per_s': m.rows_per_s, 'peak_rss_delta_mb': m.peak_rss_delta_mb}
+
+
+def run_builders(scale_name: str, seed: int, only: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    from generate_data import Config
+    names = list(builder_cases(Config()).keys())
+    if only:
+        names = [n for n in names if n in only]
+    results: Dict[str, Dict[str, Any]] = {}
+    ctx = mp.get_context('spawn')
+    for name in names:
+        print(f"Đo {name} ({scale_name})…", flush=True)
+        # Fresh process per builder so the peak RSS is not masked by earlier stages
+        with ctx.Pool(1) as pool:
+            results[name] = pool.apply(run_builder_case, (scale_name, seed, name))
+    return results
+
+
+def id_memory_report(scale_name: str, seed: int, sample_orders: int = 200_000) -> Dict[str, Any]:
+    """Bytes per million orders for orders+items with categorical IDs vs. object-string IDs."""
+    import pandas as pd
+    import generate_data as g
+    cfg = scale_config(SCALES[scale_name], seed)
+    n = min(cfg.min_rows, sample_orders)
+    cfg.min_rows = cfg.max_rows = n
+    g.seed_everything(seed)
+    dims = g.build_dimensions(cfg, StageRecorder())
+    args, kwargs = g.order_builder_args(cfg, dims)
+    orders_df, items_df = g.build_orders(*args, **kwargs)
+
+    def as_strings(df):
+        return df.astype({c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+
+    coded = orders_df.memory_usage(deep=True).sum() + items_df.memory_usage(deep=True).sum()
+    strings = as_strings(orders_df).memory_usage(deep=True).sum() + as_strings(items_df).memory_usage(deep=True).sum()
+    per_million = 1_000_000 / max(1, len(orders_df))
+    report = {
+        'orders': len(orders_df),
+        'items': len(items_df),
+        'coded_mb_per_million_orders': coded * per_million / 2**20,
+        'string_mb_per_million_orders': strings * per_million / 2**20,
+    }
+    print(f"Bộ nhớ orders+order_items / 1 triệu đơn: mã số nguyên {report['coded_mb_per_million_orders']:.1f} MB, "
+          f"chuỗi {report['string_mb_per_million_orders']:.1f} MB "
+          f"(giảm {1 - coded / strings:.0%})")
+    return report
+
+
+def legacy_monthly_active(n_cust: int, months: int, lo: int, hi: int, order_months: List[int]) -> List[int]:
+    """Previous sampler, for comparison: one shuffled Python list per month and a
+    per-order round-robin over dicts."""
+    import random
+    active: Dict[int, List[int]] = {}
+    cycle: Dict[int, int] = {}
+    for m in range(months):
+        act = random.sample(range(n_cust), min(random.randint(lo, hi), n_cust))
+        random.shuffle(act)
+        active[m], cycle[m] = act, 0
+    out = []
+    for m in order_months:
+        idx = cycle[m]
+        out.append(active[m][idx])
+        cycle[m] = (idx + 1) % len(active[m])
+    return out
+
+
+def monthly_active_report(customer_counts: List[int], seed: int, months: int = 240,
+                          orders: int = 1_000_000, shares: Tuple[float, ...] = (0.0, 0.01)) -> Dict[str, Any]:
+    """Time to draw the monthly active sets and assign customers to `orders` orders over
+    `months` months: previous list/dict sampler vs MonthlyActive. Share 0 uses the default
+    700-900 active customers per month, otherwise that fraction of all customers."""
+    import random
+    import time
+    import numpy as np
+    from generate_data import MonthlyActive
+    rng = np.random.default_rng(seed)
+    order_months = np.sort(rng.integers(0, months, size=orders))
+    report: Dict[str, Any] = {}
+    print(f"{'customers':>11} {'active/tháng':>13} {'cũ_s':>8} {'mới_s':>8} {'nhanh hơn':>10} {'mới_MB':>8}")
+    for n_cust in customer_counts:
+        for share in shares:
+            lo, hi = (700, 900) if not share else (int(n_cust * share * 0.9), int(n_cust * share * 1.1))
+            random.seed(seed)
+            t0 = time.perf_counter()
+            legacy_monthly_active(n_cust, months, lo, hi, order_months.tolist())
+            legacy_s = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            sizes = np.minimum(rng.integers(lo, hi, size=months, endpoint=True), n_cust)
+            active = MonthlyActive.sample(n_cust, sizes, rng)
+            active.assign(order_months)
+            new_s = time.perf_counter() - t0
+            key = f"{n_cust}:{lo}-{hi}"
+            report[key] = {'customers': n_cust, 'active_min': lo, 'active_max': hi, 'months': months, 'orders': orders,
+                           'legacy_s': legacy_s, 'new_s': new_s, 'new_mb': active.customers.nbytes / 2**20}
+            print(f"{n_cust:>11} {f'{lo}-{hi}':>13} {legacy_s:8.2f} {new_s:8.2f} {legacy_s / new_s:9.1f}x "
+                  f"{active.customers.nbytes / 2**20:8.1f}")
+    return report
+
+
+def import_time_report(budget_ms: float, runs: int = 3) -> Tuple[Dict[str, Any], List[str]]:
+    """Cumulative import time (best of `runs`) of each IMPORT_CHECKS module; returns (report, failures)."""
+    src = os.path.dirname(os.path.abspath(__file__))
+    report: Dict[str, Any] = {}
+    failures: List[str] = []
+    for module, forbidden in IMPORT_CHECKS.items():
+        best = None
+        loaded = set()
+        for _ in range(runs):
+            proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                  cwd=src, capture_output=True, text=True, check=True)
+            for line in proc.stderr.splitlines():
+                # "import time: <self us> | <cumulative us> | <indented module name>"
+                parts = line.split('|')
+                if len(parts) != 3 or not parts[1].strip().isdigit():
+                    continue
+                name = parts[2].strip()
+                if name == module:
+                    ms = int(parts[1]) / 1000
+                    best = ms if best is None else min(best, ms)
+                if name.split('.')[0] in forbidden:
+                    loaded.add(name.split('.')[0])
+        report[module] = {'import_ms': best, 'budget_ms': budget_ms, 'forbidden_loaded': sorted(loaded)}
+        status = 'OK'
+        if best is None or best > budget_ms:
+            failures.append(f"{module}: {best or 0:.0f} ms > {budget_ms:.0f} ms")
+            status = 'VƯỢT NGÂN SÁCH'
+        if loaded:
+            failures.append(f"{module} nạp {', '.join(sorted(loaded))}")
+            status = 'NẠP MODULE NẶNG'
+        print(f"import {module:<14} {best or 0:8.1f} ms (ngân sách {budget_ms:.0f} ms) {status}")
+    return report, failures
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class TempPostgres:
+    """Start a disposable Postgres cluster in a temp dir (needs initdb/pg_ctl; not as root)."""
+
+    def __init__(self, pg_bin: Optional[str] = None):
+        initdb = os.path.join(pg_bin, 'initdb') if pg_bin else shutil.which('initdb')
+        if not initdb:
+            raise FileNotFoundError("initdb not found; pass --pg-bin or use --pg-host to target an existing server")
+        self.bin_dir = os.path.dirname(initdb)
+        self.tmp = tempfile.mkdtemp(prefix='bench_pg_')
+        self.data_dir = os.path.join(self.tmp, 'data')
+        self.port = free_port()
+
+    def __enter__(self):
+        from config import DbConfig
+        subprocess.run([os.path.join(self.bin_dir, 'initdb'), '-D', self.data_dir, '-U', 'postgres',
+                        '-A', 'trust', '-E', 'UTF8', '--locale=C'], check=True, stdout=subprocess.DEVNULL)
+        opts = f"-p {self.port} -k {self.tmp} -c listen_addresses=127.0.0.1 -c fsync=on"
+        subprocess.run([os.path.join(self.bin_dir, 'pg_ctl'), '-D', self.data_dir, '-o', opts,
+                        '-l', os.path.join(self.tmp, 'pg.log'), '-w', 'start'], check=True, stdout=subprocess.DEVNULL)
+        return DbConfig(host='127.0.0.1', port=self.port, db='bench', user='postgres', password='')
+
+    def __exit__(self, *exc):
+        subprocess.run([os.path.join(self.bin_dir, 'pg_ctl'), '-D', self.data_dir, '-m', 'fast', 'stop'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+LOADER_PREFIXES = ('create_schema', 'truncate_tables', 'insert_', 'export_')
+
+
+def run_loaders(scale_name: str, seed: int, dbc) -> Dict[str, Dict[str, Any]]:
+    """Run the full pipeline against `dbc` and keep the loader/export stages."""
+    from generate_data import generate_and_load
+    cfg = scale_config(SCALES[scale_name], seed)
+    export_dir = tempfile.mkdtemp(prefix='bench_export_')
+    cfg.db_export_dir = export_dir
+    rec = StageRecorder()
+    try:
+        generate_and_load(cfg, dbc, rec=rec)
+    finally:
+        shutil.rmtree(export_dir, ignore_errors=True)
+    return {
+        m.name: {'kind': 'loader', 'rows': m.rows, 'wall_s': m.wall_s, 'cpu_s': m.cpu_s,
+                 'rows_per_s': m.rows_per_s, 'peak_rss_delta_mb': m.peak_rss_delta_mb}
+        for m in rec.stages if m.name.startswith(LOADER_PREFIXES)
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print current vs baseline throughput; return the names of regressed cases."""
+    regressions = []
+    base_cases = baseline.get('cases', {})
+    print(f"{'case':<34} {'base rows/s':>12} {'now rows/s':>12} {'ratio':>7}")
+    for name, cur in current['cases'].items():
+        base = base_cases.get(name)
+        if not base or not base.get('rows_per_s') or not cur.get('rows_per_s'):
+            continue
+        ratio = cur['rows_per_s'] / base['rows_per_s']
+        flag = ''
+        if ratio < 1.0 - tolerance:
+            regressions.append(name)
+            flag = '  <-- chậm hơn'
+        print(f"{name:<34} {base['rows_per_s']:12.0f} {cur['rows_per_s']:12.0f} {ratio:7.2f}{flag}")
+    return regressions
+
+
+def print_results(results: Dict[str, Any]):
+    print(f"{'case':<34} {'rows':>11} {'wall_s':>9} {'rows/s':>12} {'rss_mb':>8}")
+    for name, r in results['cases'].items():
+        rps = f"{r['rows_per_s']:12.0f}" if r.get('rows_per_s') else f"{'-':>12}"
+        rows = f"{r['rows']:11d}" if r.get('rows') is not None else f"{'-':>11}"
+        rss = f"{r['peak_rss_delta_mb']:8.1f}" if r.get('peak_rss_delta_mb') is not None else f"{'-':>8}"
+        print(f"{name:<34} {rows} {r['wall_s']:9.3f} {rps} {rss}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Benchmark generator builders and Postgres loaders at fixed seeds')
+    p.add_argument('--scale', choices=sorted(SCALES), default='small')
+    p.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    p.add_argument('--only', type=str, nargs='*', help='Only run these cases (builder or loader stage names)')
+    p.add_argument('--skip-builders', action='store_true')
+    p.add_argument('--skip-loaders', action='store_true')
+    p.add_argument('--pg-bin', type=str, help='Directory containing initdb/pg_ctl for the temp cluster')
+    p.add_argument('--pg-host', type=str, help='Use an existing server instead of a temp cluster')
+    p.add_argument('--pg-port', type=int, default=5432)
+    p.add_argument('--pg-db', type=str, default='bi_bench')
+    p.add_argument('--pg-user', type=str, default='postgres')
+    p.add_argument('--pg-password', type=str, default='')
+    p.add_argument('--monthly-active', type=int, nargs='+', metavar='CUSTOMERS',
+                   help='Only benchmark the monthly active-customer sampler at these customer counts and exit')
+    p.add_argument('--id-memory', action='store_true', help='Report memory of orders/items per million orders (coded vs string IDs)')
+    p.add_argument('--out', type=str, help='Write results JSON here')
+    p.add_argument('--baseline', type=str, help='Compare against a previously saved results JSON')
+    p.add_argument('--tolerance', type=float, default=0.10, help='Allowed throughput drop vs baseline (fraction)')
+    p.add_argument('--fail-on-regression', action='store_true')
+    p.add_argument('--import-time', action='store_true', help='Only check CLI import time against --import-budget-ms and exit')
+    p.add_argument('--import-budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.import_time:
+        report, failures = import_time_report(args.import_budget_ms)
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as f:
+                json.dump({'import_time': report}, f, ensure_ascii=False, indent=2)
+        if failures:
+            print(f"Khởi động quá chậm: {'; '.join(failures)}")
+            sys.exit(1)
+        return
+    if args.monthly_active:
+        report = monthly_active_report(args.monthly_active, args.seed)
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as f:
+                json.dump({'monthly_active': report}, f, ensure_ascii=False, indent=2)
+        return
+    scale = SCALES[args.scale]
+    results: Dict[str, Any] = {'scale': asdict(scale), 'seed': args.seed, 'cases': {}}
+
+    if not args.skip_builders:
+        results['cases'].update(run_builders(scale.name, args.seed, args.only))
+
+    if not args.skip_loaders:
+        if args.pg_host:
+            from config import DbConfig
+            dbc = DbConfig(host=args.pg_host, port=args.pg_port, db=args.pg_db, user=args.pg_user, password=args.pg_password)
+            loaders = run_loaders(scale.name, args.seed, dbc)
+        else:
+            try:
+                with TempPostgres(args.pg_bin) as dbc:
+                    loaders = run_loaders(scale.name, args.seed, dbc)
+            except (FileNotFoundError, subprocess.CalledProcessError) as e:
+                print(f"Bỏ qua benchmark loader: {e}")
+                loaders = {}
+        if args.only:
+            loaders = {k: v for k, v in loaders.items() if k in args.only}
+        results['cases'].update(loaders)
+
+    if args.id_memory:
+        results['id_memory'] = id_memory_report(scale.name, args.seed)
+
+    results['peak_rss_mb'] = peak_rss_mb()
+    print_results(results)
+    results['import_time'], import_failures = import_time_report(args.import_budget_ms)
+
+    if args.out:
+        folder = os.path.dirname(args.out)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Đã ghi kết quả -> {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions and args.fail_on_regression:
+            print(f"Chậm hơn baseline: {', '.join(regressions)}")
+            sys.exit(1)
+    if import_failures and args.fail_on_regression:
+        print(f"Khởi động quá chậm: {'; '.join(import_failures)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""Checkpointed, resumable loads (--resume).
+
+Every DB load records its progress in two small tables that schema.sql never
+drops:
+- load_run: the seed, the dataset end date (as_of) and a hash of the settings
+  that shape the data (GENERATION_FIELDS) of the current run,
+- load_checkpoints: one row per committed table (first_order_id = 0), and one
+  row per committed chunk of a fact table (the chunk's order_id range, written
+  in the same transaction as its rows). --pipeline commits a chunk of orders
+  and its order_items together; the other load paths commit each fact in
+  slices of about SLICE_ROWS rows that never split an order (order_slices).
+
+A fresh run clears the state before touching the schema. With --resume the
+schema is kept; the run takes seed/as_of from load_run, refuses to continue if
+the generation settings changed, rebuilds the dimensions and orders with the
+same RNG sequence and only loads what is missing: rows of unfinished tables
+are deleted first (facts keep their committed chunks), finished tables and
+committed order_id ranges are skipped. Skipped orders are still generated,
+because every order advances the RNGs, but they are never sent to Postgres.
+
+--fast-load keeps facts UNLOGGED until the run ends, and a server crash empties
+unlogged tables while the (logged) checkpoint rows survive. A resumed run
+therefore trusts no checkpoint of a table that is still unlogged: such tables
+(and, for facts, all their committed chunks) are loaded again from scratch.
+"""
+import hashlib
+import json
+import secrets
+from dataclasses import asdict, dataclass, field
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+
+STATE_SQL = """
+CREATE TABLE IF NOT EXISTS load_run (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    seed BIGINT NOT NULL,
+    config_hash CHAR(64) NOT NULL,
+    config JSONB NOT NULL,
+    started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    resumed_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ
+);
+CREATE TABLE IF NOT EXISTS load_checkpoints (
+    table_name VARCHAR(64) NOT NULL,
+    first_order_id BIGINT NOT NULL DEFAULT 0, -- 0 = whole table; else a chunk of orders + order_items
+    last_order_id BIGINT NOT NULL DEFAULT 0,
+    rows BIGINT NOT NULL DEFAULT 0,
+    committed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    CONSTRAINT pk_load_checkpoints PRIMARY KEY (table_name, first_order_id)
+);
+"""
+
+# Config fields that change the generated rows; a resumed run must match them all
+GENERATION_FIELDS = [
+    'customers', 'products', 'employees', 'stores', 'promotions', 'years', 'min_rows', 'max_rows',
+    'monthly_active_min', 'monthly_active_max', 'seed', 'as_of', 'demand_model', 'cogs',
+    'customer_behaviour', 'cost_dtype', 'partition_by',
+]
+FACT_TABLES = ('orders', 'order_items')
+SLICE_ROWS = 200_000  # rows per checkpointed slice of a fact table outside --pipeline
+
+
+def unlogged_tables(cur) -> Set[str]:
+    """Tables that are UNLOGGED or have an UNLOGGED partition; their rows do not survive a crash."""
+    cur.execute("""
+        SELECT DISTINCT COALESCE(p.relname, c.relname) FROM pg_class c
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+        LEFT JOIN pg_class p ON p.oid = i.inhparent
+        WHERE c.relpersistence = 'u' AND c.relkind = 'r' AND pg_table_is_visible(c.oid)
+    """)
+    return {r[0] for r in cur.fetchall()}
+
+
+def order_slices(df: pd.DataFrame, rows: int = SLICE_ROWS) -> Iterator[pd.DataFrame]:
+    """Consecutive slices of about `rows` rows of a frame sorted by order_id; an order's
+    rows are never split, so each slice covers its order_id range completely."""
+    ids = df['order_id'].to_numpy()
+    start = 0
+    while start < len(df):
+        end = min(start + rows, len(df))
+        if end < len(df):
+            end = int(np.searchsorted(ids, ids[end - 1], side='right'))
+        yield df.iloc[start:end]
+        start = end
+
+
+def config_hash(cfg: Config) -> str:
+    values = {name: getattr(cfg, name) for name in GENERATION_FIELDS}
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@dataclass
+class LoadCheckpoint:
+    resumed: bool = False
+    done: Set[str] = field(default_factory=set)
+    # Committed order_id ranges per fact table, sorted
+    ranges: Dict[str, List[Tuple[int, int]]] = field(default_factory=dict)
+    # Rows dropped by pending_rows() because an earlier run committed them
+    skipped_rows: Dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def start(cls, conn, cfg: Config) -> 'LoadCheckpoint':
+        """Forget any previous run and record this one; picks the seed/as_of when unset
+        so the run can be resumed."""
+        if cfg.seed is None:
+            cfg.seed = secrets.randbelow(2**31)
+        if cfg.as_of is None:
+            cfg.as_of = date.today().isoformat()
+        with conn.cursor() as cur:
+            cur.execute(STATE_SQL)
+            cur.execute("DELETE FROM load_checkpoints")
+            cur.execute("DELETE FROM load_run")
+            cur.execute("INSERT INTO load_run (seed, config_hash, config) VALUES (%s, %s, %s)",
+                        (cfg.seed, config_hash(cfg), json.dumps(asdict(cfg), default=str)))
+        conn.commit()
+        return cls()
+
+    @classmethod
+    def resume(cls, conn, cfg: Config) -> 'LoadCheckpoint':
+        """Load the state of the interrupted run; seed/as_of default to the recorded ones."""
+        with conn.cursor() as cur:
+            cur.execute(STATE_SQL)
+            cur.execute("SELECT config, finished_at FROM load_run")
+            row = cur.fetchone()
+            if row is None:
+                raise ValueError("Không có lần nạp nào để tiếp tục (--resume): chạy lại không kèm --resume")
+            stored, finished_at = row
+            for name in ('seed', 'as_of'):
+                if getattr(cfg, name) is None:
+                    setattr(cfg, name, stored.get(name))
+            changed = [name for name in GENERATION_FIELDS if stored.get(name) != getattr(cfg, name)]
+            if changed:
+                diff = ', '.join(f"{n}: {stored.get(n)} -> {getattr(cfg, n)}" for n in changed)
+                raise ValueError(f"Cấu hình khác lần nạp đang dở, không thể tiếp tục: {diff}")
+            lost = unlogged_tables(cur)
+            if 'orders' in lost:
+                lost.add('order_items')  # items of lost orders are gone too (FK)
+            cur.execute("DELETE FROM load_checkpoints WHERE table_name = ANY(%s) RETURNING table_name",
+                        (sorted(lost),))
+            forgotten = sorted({r[0] for r in cur.fetchall()})
+            if forgotten:
+                print(f"Bảng còn UNLOGGED (--fast-load chưa xong) sẽ được nạp lại từ đầu: {', '.join(forgotten)}")
+            cur.execute("SELECT table_name, first_order_id, last_order_id FROM load_checkpoints "
+                        "ORDER BY first_order_id")
+            rows = cur.fetchall()
+            cur.execute("UPDATE load_run SET resumed_at = now()")
+        conn.commit()
+        state = cls(resumed=True, done={t for t, first, _ in rows if first == 0})
+        for t, first, last in rows:
+            if first > 0:
+                state.ranges.setdefault(t, []).append((first, last))
+        if finished_at is not None:
+            print(f"Lần nạp trước đã hoàn tất lúc {finished_at:%Y-%m-%d %H:%M}; chỉ tính lại KPI.")
+        return state
+
+    def summary(self) -> str:
+        chunks = ''.join(f", {len(r)} chunk {t} đã commit" for t, r in sorted(self.ranges.items())
+                         if t not in self.done)
+        return f"{len(self.done)} bảng đã nạp xong ({', '.join(sorted(self.done)) or '-'}){chunks}"
+
+    def discard_partial(self, conn, tables: Iterable[str]):
+        """Delete rows of unfinished `tables` (dependents first) left by the interrupted run;
+        facts keep the rows of committed chunks."""
+        with conn.cursor() as cur:
+            for table in reversed(list(tables)):
+                if table in self.done:
+                    continue
+                if table in FACT_TABLES:
+                    cur.execute(f"""
+                        DELETE FROM {table} x WHERE NOT EXISTS (
+                            SELECT 1 FROM load_checkpoints c WHERE c.table_name = %s AND c.first_order_id > 0
+                              AND x.order_id BETWEEN c.first_order_id AND c.last_order_id)
+                    """, (table,))
+                else:
+                    cur.execute(f"DELETE FROM {table}")
+                if cur.rowcount:
+                    print(f"  Xoá {cur.rowcount} dòng dở dang của {table}")
+        conn.commit()
+
+    def committed(self, table: str, order_ids: np.ndarray) -> np.ndarray:
+        """Mask of order_ids inside committed chunk ranges of `table`."""
+        ranges = self.ranges.get(table)
+        if not ranges:
+            return np.zeros(len(order_ids), dtype=bool)
+        firsts = np.array([r[0] for r in ranges])
+        # Ranges may overlap (chunk size changed between runs): compare with the furthest end so far
+        lasts = np.maximum.accumulate(np.array([r[1] for r in ranges]))
+        k = np.searchsorted(firsts, order_ids, side='right') - 1
+        return (k >= 0) & (order_ids <= lasts[np.maximum(k, 0)])
+
+    def pending_rows(self, table: str, df: pd.DataFrame) -> pd.DataFrame:
+        """Rows of `table` still to load."""
+        if table in self.done:
+            pending = df.iloc[:0]
+        elif table in FACT_TABLES and self.ranges.get(table) and len(df):
+            pending = df[~self.committed(table, df['order_id'].to_numpy())]
+        else:
+            return df
+        self.skipped_rows[table] = self.skipped_rows.get(table, 0) + len(df) - len(pending)
+        return pending
+
+    def pending_frames(self, frames: Dict[str, Any]) -> Dict[str, Any]:
+        """Tables (dimension frames / CostMatrix / facts) with what is left to load."""
+        out = {}
+        for table, df in frames.items():
+            if table in self.done:
+                continue
+            out[table] = self.pending_rows(table, df) if table in FACT_TABLES else df
+        return out
+
+    def table_done(self, conn, table: str, rows: int):
+        """Record `table` as finished; `rows` counts what this run loaded, rows skipped
+        as already committed are added so the checkpoint holds the table total."""
+        rows += self.skipped_rows.get(table, 0)
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO load_checkpoints (table_name, rows) VALUES (%s, %s)
+                ON CONFLICT (table_name, first_order_id) DO UPDATE SET rows = EXCLUDED.rows, committed_at = now()
+            """, (table, rows))
+        conn.commit()
+        self.done.add(table)
+
+    @staticmethod
+    def chunk_done(conn, table: str, first_order_id: int, last_order_id: int, rows: int):
+        """Record a loaded chunk of fact `table`; call inside the chunk's transaction (before its
+        commit). A chunk may overlap earlier ones when the chunk size changed between runs."""
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO load_checkpoints (table_name, first_order_id, last_order_id, rows) VALUES (%s, %s, %s, %s)
+                ON CONFLICT (table_name, first_order_id) DO UPDATE
+                SET last_order_id = GREATEST(load_checkpoints.last_order_id, EXCLUDED.last_order_id),
+                    rows = load_checkpoints.rows + EXCLUDED.rows, committed_at = now()
+            """, (table, first_order_id, last_order_id, rows))
+
+    @staticmethod
+    def finish(conn):
+        with conn.cursor() as cur:
+            cur.execute("UPDATE load_run SET finished_at = now()")
+        conn.commit()
@@ -0,0 +1,171 @@
+"""Compressed export streams (gzip / zstd).
+
+ExportFile yields a text handle that COPY (copy_expert) or
+DataFrame.to_csv write into; bytes are compressed on the fly:
+- gzip: input is cut into 1 MiB blocks compressed in parallel by a thread pool
+  (zlib releases the GIL) and written in order as consecutive gzip members.
+  Multi-member .gz files are standard and read by gzip/zcat/pandas.
+- zstd: the zstandard package with its native worker threads (optional
+  dependency: pip install zstandard).
+Appending (chunked exports) starts a new gzip member / zstd frame, which is
+also valid.
+"""
+import io
+import os
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, only needed for --compress zstd
+    zstandard = None
+
+COMPRESSIONS = ('gzip', 'zstd')
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+GZIP_BLOCK = 1 << 20
+
+
+def compressed_path(path: str, codec: Optional[str]) -> str:
+    return path + EXTENSIONS[codec] if codec else path
+
+
+def human_size(n: float) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == 'B' else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.2f} GB"
+
+
+def _gzip_member(data: bytes, level: int) -> bytes:
+    # wbits=31: zlib stream with gzip header and trailer
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """Binary writer compressing fixed-size blocks on a thread pool into gzip members."""
+
+    def __init__(self, raw, threads: int, level: int = 6):
+        self.raw = raw
+        self.level = level
+        self.pool = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix='gzip')
+        self.max_pending = 2 * max(1, threads)
+        self.pending = deque()
+        self.buf = bytearray()
+        self.bytes_in = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        n = len(b)
+        self.bytes_in += n
+        self.buf += b
+        while len(self.buf) >= GZIP_BLOCK:
+            self._submit(bytes(self.buf[:GZIP_BLOCK]))
+            del self.buf[:GZIP_BLOCK]
+        return n
+
+    def _submit(self, block: bytes):
+        self.pending.append(self.pool.submit(_gzip_member, block, self.level))
+        while len(self.pending) > self.max_pending:
+            self.raw.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        if self.buf or not self.bytes_in:
+            self._submit(bytes(self.buf))
+            self.buf.clear()
+        while self.pending:
+            self.raw.write(self.pending.popleft().result())
+        self.pool.shutdown()
+        self.raw.close()
+        super().close()
+
+
+class ZstdWriter(io.RawIOBase):
+    """Binary writer over zstandard's multithreaded stream compressor."""
+
+    def __init__(self, raw, threads: int, level: int = 3):
+        if zstandard is None:
+            raise ImportError("Cần cài zstandard để nén zstd: pip install zstandard")
+        self.raw = raw
+        self.stream = zstandard.ZstdCompressor(level=level, threads=threads).stream_writer(raw, closefd=False)
+        self.bytes_in = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.bytes_in += len(b)
+        self.stream.write(b)
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        self.stream.close()  # FLUSH_FRAME
+        self.raw.close()
+        super().close()
+
+
+@dataclass
+class ExportStats:
+    path: str
+    bytes_in: int = 0
+    bytes_out: int = 0
+    seconds: float = 0.0
+
+    def report(self, label: str) -> str:
+        ratio = self.bytes_in / self.bytes_out if self.bytes_out else 0.0
+        speed = self.bytes_in / self.seconds if self.seconds > 0 else 0.0
+        return (f"{label}: {human_size(self.bytes_in)} -> {human_size(self.bytes_out)} "
+                f"(x{ratio:.1f}, {human_size(speed)}/s) -> {self.path}")
+
+
+class ExportFile:
+    """Context manager yielding a text handle to `path` (+ .gz/.zst when compressed).
+    After exit, `stats` holds uncompressed/compressed sizes and elapsed time."""
+
+    def __init__(self, path: str, codec: Optional[str] = None, encoding: str = 'utf-8',
+                 append: bool = False, threads: Optional[int] = None):
+        if codec is not None and codec not in COMPRESSIONS:
+            raise ValueError(f"Kiểu nén không hỗ trợ: {codec} (chọn {', '.join(COMPRESSIONS)})")
+        self.codec = codec
+        self.encoding = encoding
+        self.append = append
+        self.threads = threads or os.cpu_count() or 1
+        self.stats = ExportStats(compressed_path(path, codec))
+        self.handle = None
+
+    def open(self):
+        self.t0 = time.perf_counter()
+        self.start_size = os.path.getsize(self.stats.path) if self.append and os.path.exists(self.stats.path) else 0
+        raw = open(self.stats.path, 'ab' if self.append else 'wb')
+        if self.codec == 'gzip':
+            self.binary = ParallelGzipWriter(raw, self.threads)
+        elif self.codec == 'zstd':
+            self.binary = ZstdWriter(raw, self.threads)
+        else:
+            self.binary = raw
+        self.handle = io.TextIOWrapper(self.binary, encoding=self.encoding, newline='')
+        return self.handle
+
+    def close(self):
+        self.handle.close()
+        self.stats.seconds = time.perf_counter() - self.t0
+        self.stats.bytes_out = os.path.getsize(self.stats.path) - self.start_size
+        self.stats.bytes_in = getattr(self.binary, 'bytes_in', self.stats.bytes_out)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,131 @@
+"""Run configuration (Config) and Postgres connection settings (DbConfig).
+
+Kept free of pandas/numpy/Faker so that commands which never generate data
+(DB export, refresh dispatch, --help) start quickly; see main.py.
+"""
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+
+@dataclass
+class Config:
+    customers: int = 100
+    products: int = 180
+    employees: int = 40
+    stores: int = 10
+    promotions: int = 15
+    years: int = 3
+    min_rows: int = 1000
+    max_rows: int = 5000
+    export_csv_dir: Optional[str] = None
+    db_export_dir: Optional[str] = None  # export tables from DB to CSV with UTF-8 BOM
+    # Delta DB export: fact rows with date_id >= export_since and/or past the watermarks in export_state_file
+    export_since: Optional[int] = None
+    export_state_file: Optional[str] = None
+    # Compress CSV exports on the fly: None, 'gzip' or 'zstd' (threads default: all CPUs)
+    compress: Optional[str] = None
+    compress_threads: Optional[int] = None
+    # Monthly active customers range per month
+    monthly_active_min: int = 700
+    monthly_active_max: int = 900
+    # Optional path to write per-stage timing/memory metrics as JSON
+    metrics_json: Optional[str] = None
+    # Folder for per-stage cProfile .pstats files and collapsed stacks (None = no profiling)
+    profile_dir: Optional[str] = None
+    # Fixed RNG seed for reproducible datasets (None = random each run)
+    seed: Optional[int] = None
+    # Last day of the date dimension (YYYY-MM-DD); None = today
+    as_of: Optional[str] = None
+    # Continue an interrupted DB load from its checkpoints (see checkpoint.py)
+    resume: bool = False
+    # Bulk-load tuning: async commit, UNLOGGED fact tables, larger batches, ANALYZE at the end
+    fast_load: bool = False
+    keep_unlogged: bool = False
+    maintenance_work_mem: str = '512MB'
+    # Metrics JSON of a normal run, used to report time saved per table in fast-load mode
+    fast_load_baseline: Optional[str] = None
+    # >1 loads independent tables concurrently over a connection pool (COPY)
+    load_workers: int = 1
+    # Overlap order generation and loading (bounded producer/consumer queue)
+    pipeline: bool = False
+    chunk_size: int = 50_000
+    queue_size: int = 4
+    # e.g. '2GB': size generation/load chunks from this budget instead of fixed sizes (see memory.py)
+    memory_budget: Optional[str] = None
+    # --no-db: write generated tables without Postgres (csv | parquet files, sqlite | duckdb database)
+    no_db: bool = False
+    output_dir: Optional[str] = None
+    output_format: str = 'csv'
+    # Order demand model: 'uniform', 'seasonal' or a JSON file of DemandModel overrides
+    demand_model: str = 'uniform'
+    # Fill order_items.gia_von (unit cost on the order date) from product_daily_costs
+    cogs: bool = False
+    # Stateful customers: retention, home store, channel/basket/category preferences
+    customer_behaviour: bool = False
+    # Optional .npy file to memory-map the products x days cost matrix (long histories, many products)
+    cost_matrix_path: Optional[str] = None
+    cost_dtype: str = 'float64'
+    # Range-partition orders/order_items/product_daily_costs by date_id: None, 'month' or 'year'
+    partition_by: Optional[str] = None
+    # Sharded generation (see shards.py): plan folder shared by the nodes and this node's 'i/N'
+    plan_dir: Optional[str] = None
+    shard: Optional[str] = None
+
+@dataclass
+class DbConfig:
+    host: str
+    port: int
+    db: str
+    user: str
+    password: str
+
+
+def load_config_from_env() -> Tuple[Config, DbConfig]:
+    load_dotenv()
+    cfg = Config(
+        customers=int(os.getenv('CUSTOMERS', 100)),
+        products=int(os.getenv('PRODUCTS', 180)),
+        employees=int(os.getenv('EMPLOYEES', 40)),
+        stores=int(os.getenv('STORES', 10)),
+        promotions=int(os.getenv('PROMOTIONS', 15)),
+        years=int(os.getenv('YEARS', 3)),
+        min_rows=int(os.getenv('MIN_ROWS', 1000)),
+        max_rows=int(os.getenv('MAX_ROWS', 5000)),
+        # New env vars with backward compatibility
+        monthly_active_min=int(os.getenv('MONTHLY_ACTIVE_MIN', 700)),
+        monthly_active_max=int(os.getenv('MONTHLY_ACTIVE_MAX', 900)),
+        export_csv_dir=os.getenv('EXPORT_CSV_DIR'),
+        db_export_dir=os.getenv('DB_EXPORT_DIR'),
+        export_state_file=os.getenv('EXPORT_STATE_FILE'),
+        compress=os.getenv('EXPORT_COMPRESS') or None,
+        metrics_json=os.getenv('METRICS_JSON'),
+        seed=int(os.getenv('SEED')) if os.getenv('SEED') else None,
+        load_workers=int(os.getenv('LOAD_WORKERS', 1)),
+        demand_model=os.getenv('DEMAND_MODEL', 'uniform'),
+        partition_by=os.getenv('PARTITION_BY') or None,
+        plan_dir=os.getenv('PLAN_DIR') or None,
+        memory_budget=os.getenv('MEMORY_BUDGET') or None,
+    )
+    # Backward compatibility: if MONTHLY_ACTIVE_CUSTOMERS provided, pin min=max=value
+    legacy_mac = os.getenv('MONTHLY_ACTIVE_CUSTOMERS')
+    if legacy_mac is not None and legacy_mac != "":
+        try:
+            v = int(legacy_mac)
+            cfg.monthly_active_min = v
+            cfg.monthly_active_max = v
+        except ValueError:
+            pass
+    # Ensure min <= max
+    if cfg.monthly_active_min > cfg.monthly_active_max:
+        cfg.monthly_active_min, cfg.monthly_active_max = cfg.monthly_active_max, cfg.monthly_active_min
+    dbc = DbConfig(
+        host=os.getenv('PG_HOST', 'localhost'),
+        port=int(os.getenv('PG_PORT', 5432)),
+        db=os.getenv('PG_DB', 'bi_courses'),
+        user=os.getenv('PG_USER', 'postgres'),
+        password=os.getenv('PG_PASSWORD', '1')
+    )
+    return cfg, dbc
@@ -0,0 +1,117 @@
+"""product_daily_costs as a products x days matrix, optionally memory-mapped.
+
+The cost series are generated day by day for all products at once (vectorized
+random walk around a slow-moving anchor) and written in column blocks of
+`block_days` days. With a path, the matrix lives in a `.npy` file opened with
+np.lib.format.open_memmap, so peak memory is one block however long the
+history is. Loaders and file exporters stream the table block by block via
+CostMatrix.iter_frames(); order generation indexes the matrix directly.
+
+Smoothness rules (mirroring the DB trigger in schema.sql):
+- day-to-day change within ~±1.5% (trigger limit 3%),
+- the anchor drifts at most ±2% every 30-60 days and daily costs stay within
+  ±15% of it (trigger limit: 20% range over any 365-day window).
+"""
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+COST_BLOCK_DAYS = 366
+COST_DTYPES = ('float64', 'float32')
+
+
+@dataclass
+class CostMatrix:
+    product_ids: List[str]  # row order (= prod_df order, i.e. product codes)
+    date_ids: np.ndarray  # int64 sorted date_id, column order
+    values: np.ndarray  # [n_products, n_days]; ndarray or np.memmap
+    path: Optional[str] = None
+    block_days: int = COST_BLOCK_DAYS
+
+    def __len__(self) -> int:
+        """Number of product_daily_costs rows."""
+        return self.values.shape[0] * self.values.shape[1]
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    def iter_frames(self, block_days: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """Yield the table (product_id, date_id, cost) one block of days at a time."""
+        n_prod, n_days = self.values.shape
+        step = block_days or self.block_days
+        products = pd.Categorical.from_codes(np.arange(n_prod), categories=pd.Index(self.product_ids, dtype=object))
+        for lo in range(0, n_days, step):
+            hi = min(lo + step, n_days)
+            block = np.asarray(self.values[:, lo:hi], dtype=np.float64)
+            width = hi - lo
+            yield pd.DataFrame({
+                'product_id': products.take(np.repeat(np.arange(n_prod), width)),
+                'date_id': np.tile(self.date_ids[lo:hi], n_prod),
+                'cost': np.round(block.ravel(), 2),
+            })
+
+    def to_frame(self) -> pd.DataFrame:
+        frames = list(self.iter_frames())
+        if not frames:
+            return pd.DataFrame(columns=['product_id', 'date_id', 'cost'])
+        return pd.concat(frames, ignore_index=True)
+
+    def split(self, parts: int) -> List['CostMatrix']:
+        """Split by contiguous product ranges (views over the same matrix/file)."""
+        n_prod = self.values.shape[0]
+        if parts <= 1 or n_prod == 0:
+            return [self]
+        bounds = np.linspace(0, n_prod, parts + 1).astype(int)
+        return [CostMatrix(self.product_ids[lo:hi], self.date_ids, self.values[lo:hi], self.path, self.block_days)
+                for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def build_cost_matrix(date_df: pd.DataFrame, prod_df: pd.DataFrame, rng: np.random.Generator,
+                      path: Optional[str] = None, dtype: str = 'float64',
+                      block_days: int = COST_BLOCK_DAYS) -> CostMatrix:
+    """Generate daily input cost per product, block by block, into memory or a memory-mapped .npy file."""
+    if dtype not in COST_DTYPES:
+        raise ValueError(f"Kiểu dữ liệu giá vốn không hỗ trợ: {dtype} (chọn {', '.join(COST_DTYPES)})")
+    product_ids = prod_df['product_id'].tolist() if len(prod_df) else []
+    dates = date_df[['date_id', 'full_date']].sort_values('date_id')
+    date_ids = dates['date_id'].to_numpy(dtype=np.int64)
+    days = pd.to_datetime(dates['full_date']).to_numpy(dtype='datetime64[D]').astype(np.int64)
+    shape = (len(product_ids), len(date_ids))
+    if path:
+        values = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    else:
+        values = np.empty(shape, dtype=dtype)
+    if 0 in shape:
+        return CostMatrix(product_ids, date_ids, values, path, block_days)
+
+    n_prod = shape[0]
+    base = prod_df['gia_niem_yet'].to_numpy(dtype=np.float64)
+    # Start baseline cost a bit below list price (70%-90% of list)
+    anchor = base * rng.uniform(0.7, 0.9, n_prod)
+    anchor_reset = np.full(n_prod, days[0])
+    prev = None
+    for lo in range(0, len(days), block_days):
+        hi = min(lo + block_days, len(days))
+        block = np.empty((n_prod, hi - lo), dtype=np.float64)
+        for j in range(lo, hi):
+            # Every ~30-60 days the anchor drifts slightly (±2%)
+            drift = (days[j] - anchor_reset) >= rng.integers(30, 61, n_prod)
+            anchor[drift] *= rng.uniform(0.98, 1.02, int(drift.sum()))
+            anchor_reset[drift] = days[j]
+            if prev is None:
+                c = anchor.copy()
+            else:
+                # Small day-to-day walk within ±1.5%, pulled back toward the anchor
+                c = prev * (1 + rng.uniform(-0.015, 0.015, n_prod))
+                c = 0.8 * c + 0.2 * anchor
+            c = np.maximum(np.clip(c, anchor * 0.85, anchor * 1.15), 1000.0)
+            block[:, j - lo] = np.round(c, 2)
+            prev = c
+        values[:, lo:hi] = block
+    if path:
+        values.flush()
+    return CostMatrix(product_ids, date_ids, values, path, block_days)
+
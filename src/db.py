@@ -0,0 +1,106 @@
+"""Postgres connection helpers and the COPY-based CSV export.
+
+Only psycopg2 and the standard library are imported here: `main.py export`
+streams COPY output straight to (optionally compressed) files without loading
+pandas.
+"""
+import os
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from compress import ExportFile
+from config import DbConfig
+
+
+def ensure_database(db: DbConfig):
+    """Create database if not exists."""
+    conn = psycopg2.connect(host=db.host, port=db.port, dbname='postgres', user=db.user, password=db.password)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM pg_database WHERE datname=%s", (db.db,))
+    exists = cur.fetchone() is not None
+    if not exists:
+        cur.execute(f'CREATE DATABASE "{db.db}"')
+    cur.close()
+    conn.close()
+
+
+def get_conn(db: DbConfig):
+    return psycopg2.connect(host=db.host, port=db.port, dbname=db.db, user=db.user, password=db.password)
+
+
+def run_sql(conn, sql: str):
+    with conn.cursor() as cur:
+        cur.execute(sql)
+    conn.commit()
+
+
+def export_tables_to_csv(dbc: DbConfig, out_dir: str, tables: Optional[List[str]] = None,
+                         since: Optional[int] = None, state_file: Optional[str] = None,
+                         compress: Optional[str] = None, compress_threads: Optional[int] = None,
+                         rec=None) -> Dict[str, int]:
+    """Export selected DB tables to CSV using PostgreSQL COPY.
+    Files are written with UTF-8 BOM (utf-8-sig) to support Vietnamese in Excel.
+    With `compress` ('gzip'/'zstd') the COPY stream is compressed on the fly into <table>.csv.gz/.zst.
+    With `since` (date_id) and/or `state_file` (watermark JSON) only new fact rows and
+    changed tables are written (see delta.py); the state file is updated after a successful export.
+    With a StageRecorder (`rec`), each table is recorded as an `export_db:<table>` stage.
+    Returns the number of rows exported per table.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if tables is None:
+        tables = [
+            'dates', 'customers', 'customer_child', 'products',
+            'employees', 'stores', 'promotions', 'product_daily_costs', 'orders',
+            'order_items', 'KPI_Target_Monthly'
+        ]
+    delta = since is not None or bool(state_file)
+    counts: Dict[str, int] = {}
+    with get_conn(dbc) as conn:
+        if delta:
+            from delta import commit_plans, load_state, plan_delta, save_state
+            state = load_state(state_file)
+            plans = plan_delta(conn, tables, state, since=since)
+        else:
+            plans = None
+        with conn.cursor() as cur:
+            for i, t in enumerate(tables):
+                # SELECT * so generated columns (order_items.id) are exported too
+                query = f"SELECT * FROM {t}"
+                if plans is not None:
+                    plan = plans[i]
+                    if plan.query is None:
+                        print(f"Bỏ qua {t}: {plan.reason}")
+                        continue
+                    query = cur.mogrify(plan.query, plan.params).decode() if plan.params else plan.query
+                out = ExportFile(os.path.join(out_dir, f"{t}.csv"), compress, encoding='utf-8-sig',
+                                 threads=compress_threads)
+                target = out.stats.path
+                # Encode with utf-8-sig to emit BOM; COPY writes text rows to this handle
+                with (rec.stage(f'export_db:{t}') if rec is not None else nullcontext()) as st, out as f:
+                    sql = f"COPY ({query}) TO STDOUT WITH (FORMAT CSV, HEADER TRUE)"
+                    try:
+                        cur.copy_expert(sql, f)
+                        counts[t] = max(cur.rowcount, 0)
+                        if st is not None:
+                            st.rows = counts[t]
+                    except Exception as e:
+                        # Skip tables that might not exist or other copy errors
+                        print(f"Bỏ qua bảng {t}: {e}")
+                        conn.rollback()
+                        if plans is not None:
+                            plans[i].state = {}  # not exported: keep the previous watermark
+                        continue
+                if plans is not None:
+                    print(f"Đã xuất {t} [{plans[i].reason}]: {counts[t]} dòng -> {target}")
+                else:
+                    print(f"Đã xuất {t} -> {target}")
+                if compress:
+                    print('  ' + out.stats.report(f"{t} ({compress})"))
+    if delta and state_file:
+        save_state(state_file, commit_plans(state, plans))
+        print(f"Đã lưu mốc xuất (watermark) -> {state_file}")
+    return counts
@@ -0,0 +1,87 @@
+"""Streaming reads from Postgres.
+
+Queries run on psycopg2 named (server-side) cursors, so the server keeps the
+result and the client only holds one batch of `itersize` rows at a time.
+Batches come out as pandas DataFrames, dicts of NumPy arrays or pyarrow
+RecordBatches (if pyarrow is installed). Row counts for progress reporting are
+taken from the planner statistics (pg_class.reltuples, falling back to
+pg_stat_user_tables.n_live_tup for tables never analyzed) instead of COUNT(*);
+a partitioned table has neither, so its leaf partitions are summed.
+"""
+import itertools
+from typing import Any, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional dependency, only needed for fmt='arrow'
+    pa = None
+
+DEFAULT_ITERSIZE = 50_000
+BATCH_FORMATS = ('pandas', 'numpy', 'arrow')
+
+_cursor_ids = itertools.count(1)
+
+
+def _to_batch(rows: List[tuple], columns: List[str], fmt: str) -> Any:
+    if fmt == 'pandas':
+        return pd.DataFrame.from_records(rows, columns=columns)
+    cols = list(zip(*rows)) if rows else [() for _ in columns]
+    if fmt == 'numpy':
+        return {c: np.asarray(v) for c, v in zip(columns, cols)}
+    return pa.RecordBatch.from_arrays([pa.array(list(v)) for v in cols], names=columns)
+
+
+def iter_query_batches(conn, sql: str, params: Optional[Sequence[Any]] = None,
+                       itersize: int = DEFAULT_ITERSIZE, fmt: str = 'pandas') -> Iterator[Any]:
+    """Run `sql` on a server-side cursor and yield batches of at most `itersize` rows.
+    An empty result yields a single empty batch so callers still see the columns."""
+    if fmt not in BATCH_FORMATS:
+        raise ValueError(f"Định dạng batch không hỗ trợ: {fmt} (chọn {', '.join(BATCH_FORMATS)})")
+    if fmt == 'arrow' and pa is None:
+        raise ImportError("Cần cài pyarrow để đọc theo batch Arrow: pip install pyarrow")
+    with conn.cursor(name=f'stream_{next(_cursor_ids)}') as cur:
+        cur.itersize = itersize
+        cur.execute(sql, params)
+        first = True
+        while True:
+            rows = cur.fetchmany(itersize)
+            if not rows and not first:
+                return
+            columns = [d[0] for d in cur.description]
+            yield _to_batch(rows, columns, fmt)
+            if len(rows) < itersize:
+                return
+            first = False
+
+
+def read_query_frame(conn, sql: str, params: Optional[Sequence[Any]] = None,
+                     itersize: int = DEFAULT_ITERSIZE) -> pd.DataFrame:
+    """Whole result as one DataFrame, fetched in batches (for small results such as id lists)."""
+    return pd.concat(list(iter_query_batches(conn, sql, params, itersize=itersize)), ignore_index=True)
+
+
+def estimate_row_count(conn, table: str) -> int:
+    """Approximate row count from catalog statistics (no table scan); 0 if unknown.
+    `table` is matched exactly first, then case-folded like an unquoted identifier.
+    For a partitioned table the estimates of its leaf partitions are summed."""
+    with conn.cursor() as cur:
+        # pg_partition_tree has no rows for a plain table; a partitioned parent is never
+        # analyzed by autovacuum and has no pg_stat_user_tables row, so only leaves count
+        cur.execute(
+            """
+            SELECT c.reltuples::bigint, s.n_live_tup
+            FROM pg_class r
+            LEFT JOIN LATERAL pg_partition_tree(r.oid) t ON true
+            JOIN pg_class c ON c.oid = COALESCE(t.relid, r.oid)
+            LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+            WHERE r.oid = COALESCE(to_regclass(quote_ident(%s)), to_regclass(%s)) AND (t.relid IS NULL OR t.isleaf)
+            """,
+            (table, table),
+        )
+        rows = cur.fetchall()
+    # reltuples is -1 until the first VACUUM/ANALYZE; n_live_tup tracks inserts since then
+    return sum(int(reltuples) if reltuples is not None and reltuples > 0 else int(live or 0)
+               for reltuples, live in rows)
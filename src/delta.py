@@ -0,0 +1,139 @@
+"""Incremental (delta) exports driven by date_id watermarks.
+
+Fact tables are exported by date: only rows with date_id above the table's
+last exported watermark (or >= --since), order_items through its order's
+date. Other tables (dimensions, KPI_Target_Monthly) are exported whole, but
+only when they changed since the previous export. Change detection uses a
+cheap catalog signature instead of scanning the table:
+- relfilenode, which changes on TRUNCATE (every regeneration) and SET LOGGED,
+- n_tup_ins/upd/del from pg_stat_user_tables (refresh commands, manual edits),
+- the relation size.
+If a fact table's relfilenode changed, its data was regenerated and it is
+exported in full again. A partitioned table (--partition-by) has no storage of
+its own: its oid stands in for relfilenode (the parent is recreated on every
+regeneration) and changes/size are summed over its partitions.
+
+Watermarks assume fact rows only arrive with a date_id above everything
+already exported, which holds for generated data (loads are regenerations,
+caught by the relfilenode check). A back-dated row inserted after an export
+(date_id <= the watermark) is never picked up by the state file; re-export
+from its date with --since, or drop the table's entry from the state file to
+export it in full.
+
+State is a small JSON file: {"tables": {table: {"watermark": date_id,
+"signature": {...}, "exported_at": ...}}}.
+"""
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Fact tables: (query with the date filter placeholder, column carrying the date)
+FACT_QUERIES: Dict[str, Tuple[str, str]] = {
+    'orders': ("SELECT * FROM orders WHERE {cond}", 'date_id'),
+    'order_items': (
+        "SELECT i.* FROM order_items i JOIN orders o ON o.order_id = i.order_id WHERE {cond}",
+        'o.date_id',
+    ),
+    'product_daily_costs': ("SELECT * FROM product_daily_costs WHERE {cond}", 'date_id'),
+}
+# Source of each fact table's watermark (order_items follows its orders)
+FACT_DATE_SOURCE = {'orders': 'orders', 'order_items': 'orders', 'product_daily_costs': 'product_daily_costs'}
+
+
+@dataclass
+class TablePlan:
+    table: str
+    query: Optional[str]  # None = nothing to export
+    params: Tuple[Any, ...] = ()
+    reason: str = ''
+    state: Dict[str, Any] = field(default_factory=dict)  # state entry to save once exported
+
+
+def load_state(path: str) -> Dict[str, Any]:
+    if not path or not os.path.exists(path):
+        return {'tables': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(path: str, state: Dict[str, Any]):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def table_signature(conn, table: str) -> Dict[str, int]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT CASE WHEN c.relkind = 'p' THEN c.oid::bigint ELSE c.relfilenode::bigint END,
+                   COALESCE(sum(s.n_tup_ins + s.n_tup_upd + s.n_tup_del), 0),
+                   COALESCE(sum(pg_relation_size(COALESCE(t.relid, c.oid))), 0)
+            FROM pg_class c
+            LEFT JOIN LATERAL pg_partition_tree(c.oid) t ON true  -- no rows for a plain table
+            LEFT JOIN pg_stat_user_tables s ON s.relid = COALESCE(t.relid, c.oid)
+            WHERE c.oid = COALESCE(to_regclass(quote_ident(%s)), to_regclass(%s)) AND (t.relid IS NULL OR t.isleaf)
+            GROUP BY c.oid, c.relkind, c.relfilenode
+            """,
+            (table, table),
+        )
+        row = cur.fetchone()
+    if not row:
+        return {}
+    return {'relfilenode': int(row[0]), 'changes': int(row[1]), 'size': int(row[2])}
+
+
+def plan_delta(conn, tables: List[str], state: Dict[str, Any], since: Optional[int] = None) -> List[TablePlan]:
+    """Decide per table what to export: new fact rows, changed tables whole, or nothing."""
+    plans: List[TablePlan] = []
+    now = datetime.now().isoformat(timespec='seconds')
+    for table in tables:
+        sig = table_signature(conn, table)
+        if not sig:
+            plans.append(TablePlan(table, None, reason='không tồn tại'))
+            continue
+        prev = state.get('tables', {}).get(table, {})
+        entry: Dict[str, Any] = {'signature': sig, 'exported_at': now}
+        if table in FACT_QUERIES:
+            template, col = FACT_QUERIES[table]
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT max(date_id) FROM {FACT_DATE_SOURCE[table]}")
+                high = cur.fetchone()[0]
+            entry['watermark'] = high
+            if high is None:
+                # Empty table: export the header only
+                plans.append(TablePlan(table, template.format(cond='false'), (), 'trống', entry))
+                continue
+            # Upper bound = the planned watermark, so rows inserted during the export wait for the next run
+            regenerated = prev.get('signature', {}).get('relfilenode') not in (None, sig['relfilenode'])
+            if since is not None:
+                plans.append(TablePlan(table, template.format(cond=f"{col} >= %s AND {col} <= %s"),
+                                       (since, high), f'date_id >= {since}', entry))
+            elif prev.get('watermark') is not None and not regenerated:
+                if high <= prev['watermark']:
+                    plans.append(TablePlan(table, None, reason='không có dòng mới', state=entry))
+                else:
+                    plans.append(TablePlan(table, template.format(cond=f"{col} > %s AND {col} <= %s"),
+                                           (prev['watermark'], high), f"date_id > {prev['watermark']}", entry))
+            else:
+                reason = 'dữ liệu đã được sinh lại' if regenerated else 'lần xuất đầu tiên'
+                plans.append(TablePlan(table, template.format(cond=f"{col} <= %s"), (high,),
+                                       f'toàn bộ ({reason})', entry))
+        elif prev.get('signature') == sig:
+            plans.append(TablePlan(table, None, reason='không thay đổi', state=entry))
+        else:
+            reason = 'đã thay đổi' if prev else 'lần xuất đầu tiên'
+            plans.append(TablePlan(table, f"SELECT * FROM {table}", (), f'toàn bộ ({reason})', entry))
+    return plans
+
+
+def commit_plans(state: Dict[str, Any], plans: List[TablePlan]) -> Dict[str, Any]:
+    """Record exported tables in the state (call only after the files were written)."""
+    tables = state.setdefault('tables', {})
+    for plan in plans:
+        if plan.state:
+            tables[plan.table] = plan.state
+    return state
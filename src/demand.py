@@ -0,0 +1,154 @@
+"""Skewed, time-varying demand model for order generation.
+
+Order dates are drawn with weights combining day-of-week and monthly
+seasonality, holiday spikes (pre-Tết shopping, 1/6 Children's Day, 11/11 and
+12/12 online sales, ...) and compound yearly growth. Products follow a Zipf
+popularity curve within each category. Both distributions are turned into
+cumulative arrays once and sampled in batches with `np.searchsorted`, so the
+per-order cost is a list lookup, the same as uniform `random.choice`.
+
+A model is selected with --demand-model: `uniform` (default, no model),
+`seasonal` (built-in profile) or a path to a JSON file overriding any
+DemandModel field, e.g. {"yearly_growth": 0.2, "zipf_s": 1.3}.
+"""
+import json
+import os
+import copy
+from dataclasses import dataclass, field, fields
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Lunar New Year (Tết Nguyên Đán) in Vietnam
+TET_DATES = {
+    2000: date(2000, 2, 5), 2001: date(2001, 1, 24), 2002: date(2002, 2, 12), 2003: date(2003, 2, 1),
+    2004: date(2004, 1, 22), 2005: date(2005, 2, 9), 2006: date(2006, 1, 29), 2007: date(2007, 2, 17),
+    2008: date(2008, 2, 7), 2009: date(2009, 1, 26), 2010: date(2010, 2, 14), 2011: date(2011, 2, 3),
+    2012: date(2012, 1, 23), 2013: date(2013, 2, 10), 2014: date(2014, 1, 31), 2015: date(2015, 2, 19),
+    2016: date(2016, 2, 8), 2017: date(2017, 1, 28), 2018: date(2018, 2, 16), 2019: date(2019, 2, 5),
+    2020: date(2020, 1, 25), 2021: date(2021, 2, 12), 2022: date(2022, 2, 1), 2023: date(2023, 1, 22),
+    2024: date(2024, 2, 10), 2025: date(2025, 1, 29), 2026: date(2026, 2, 17), 2027: date(2027, 2, 6),
+    2028: date(2028, 1, 26), 2029: date(2029, 2, 13), 2030: date(2030, 2, 3), 2031: date(2031, 1, 23),
+    2032: date(2032, 2, 11), 2033: date(2033, 1, 31), 2034: date(2034, 2, 19), 2035: date(2035, 2, 8),
+}
+
+
+@dataclass
+class DemandModel:
+    # Monday..Sunday
+    dow_weights: List[float] = field(default_factory=lambda: [0.95, 0.9, 0.9, 0.95, 1.05, 1.3, 1.4])
+    # January..December
+    month_weights: List[float] = field(default_factory=lambda: [
+        1.15, 1.05, 0.95, 0.9, 0.95, 1.1, 0.95, 0.95, 1.0, 1.0, 1.1, 1.2,
+    ])
+    # Fixed-date spikes as "MM-DD": multiplier
+    holidays: Dict[str, float] = field(default_factory=lambda: {
+        '03-08': 1.3, '06-01': 1.8, '10-20': 1.3, '11-11': 1.8, '12-12': 1.6, '12-24': 1.3,
+    })
+    # Tết: shopping rush in the days before, stores mostly closed for the first days
+    tet_before_days: int = 14
+    tet_before_multiplier: float = 1.8
+    tet_holiday_days: int = 4
+    tet_holiday_multiplier: float = 0.4
+    # Compound growth of order volume per year
+    yearly_growth: float = 0.12
+    # Zipf exponent of product popularity within a category (0 = uniform)
+    zipf_s: float = 1.1
+
+
+DEMAND_PROFILES = {
+    'uniform': None,
+    'seasonal': DemandModel,
+}
+
+
+def load_demand_model(spec: Optional[str]) -> Optional[DemandModel]:
+    """Resolve --demand-model: a profile name or a JSON file of DemandModel overrides."""
+    if not spec or spec == 'uniform':
+        return None
+    if spec in DEMAND_PROFILES:
+        return DEMAND_PROFILES[spec]()
+    if os.path.exists(spec):
+        with open(spec, encoding='utf-8-sig') as f:
+            overrides = json.load(f)
+        known = {f.name for f in fields(DemandModel)}
+        unknown = set(overrides) - known
+        if unknown:
+            raise ValueError(f"Tham số demand model không hợp lệ: {sorted(unknown)}")
+        return DemandModel(**overrides)
+    raise ValueError(f"Không tìm thấy demand model '{spec}' (chọn {', '.join(DEMAND_PROFILES)} hoặc đường dẫn JSON)")
+
+
+def date_weights(date_df: pd.DataFrame, model: DemandModel) -> np.ndarray:
+    """Relative order volume for every row of date_df."""
+    full = pd.to_datetime(date_df['full_date'])
+    w = np.asarray(model.dow_weights, dtype=float)[full.dt.weekday.to_numpy()]
+    w = w * np.asarray(model.month_weights, dtype=float)[full.dt.month.to_numpy() - 1]
+    mmdd = full.dt.strftime('%m-%d').to_numpy()
+    for day, mult in model.holidays.items():
+        w[mmdd == day] *= mult
+    days = full.dt.date.to_numpy()
+    for tet in TET_DATES.values():
+        rush_start = tet - timedelta(days=model.tet_before_days)
+        closed_end = tet + timedelta(days=model.tet_holiday_days)
+        w[(days >= rush_start) & (days < tet)] *= model.tet_before_multiplier
+        w[(days >= tet) & (days < closed_end)] *= model.tet_holiday_multiplier
+    years = (full - full.min()).dt.days.to_numpy() / 365.25
+    return w * (1.0 + model.yearly_growth) ** years
+
+
+def product_weights(prod_df: pd.DataFrame, model: DemandModel, rng: np.random.Generator) -> np.ndarray:
+    """Zipf popularity within each category; categories keep a share proportional to their size."""
+    w = np.zeros(len(prod_df), dtype=float)
+    for _, idx in prod_df.groupby('danh_muc').indices.items():
+        ranks = rng.permutation(len(idx)) + 1
+        zipf = 1.0 / ranks ** model.zipf_s
+        w[idx] = zipf / zipf.sum() * len(idx)
+    return w
+
+
+class BatchSampler:
+    """Draw indices with given weights: cumulative array + searchsorted, refilled in batches."""
+
+    def __init__(self, weights: np.ndarray, rng: np.random.Generator, batch: int = 65_536):
+        w = np.asarray(weights, dtype=float)
+        self.cdf = np.cumsum(w / w.sum())
+        self.cdf[-1] = 1.0
+        self.rng = rng
+        self.batch = batch
+        self.buf: List[int] = []
+        self.pos = 0
+
+    def sample(self, n: int) -> np.ndarray:
+        return np.searchsorted(self.cdf, self.rng.random(n), side='right')
+
+    def next(self) -> int:
+        if self.pos >= len(self.buf):
+            self.buf = self.sample(self.batch).tolist()
+            self.pos = 0
+        i = self.buf[self.pos]
+        self.pos += 1
+        return i
+
+    def with_rng(self, rng: np.random.Generator) -> 'BatchSampler':
+        """Same weights, drawing from another generator (sharded generation)."""
+        other = copy.copy(self)
+        other.rng, other.buf, other.pos = rng, [], 0
+        return other
+
+    def distinct(self, k: int) -> List[int]:
+        """k distinct indices (k must not exceed the number of non-zero weights)."""
+        picks: List[int] = []
+        while len(picks) < k:
+            i = self.next()
+            if i not in picks:
+                picks.append(i)
+        return picks
+
+
+def demand_samplers(model: DemandModel, date_df: pd.DataFrame, prod_df: pd.DataFrame,
+                    rng: np.random.Generator) -> Tuple[BatchSampler, BatchSampler]:
+    return (BatchSampler(date_weights(date_df, model), rng),
+            BatchSampler(product_weights(prod_df, model, rng), rng))
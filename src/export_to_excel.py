@@ -1,12 +1,14 @@
 import argparse
-import math
 import os
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Any, Iterator, List, Optional
 
 import pandas as pd
 import psycopg2
 from dotenv import load_dotenv
+from openpyxl import Workbook
+
+from db_read import DEFAULT_ITERSIZE, estimate_row_count, iter_query_batches
 
 
 @dataclass
@@ -59,58 +61,99 @@ def table_exists(conn, table: str) -> bool:
     return canonical_table_name(conn, table) is not None
 
 
-def get_row_count(conn, table: str) -> int:
-    with conn.cursor() as cur:
-        cur.execute(f'SELECT COUNT(*) FROM "{table}"')
-        return int(cur.fetchone()[0])
+def excel_rows(batch: pd.DataFrame) -> Iterator[tuple]:
+    """Rows of `batch` as plain Python values; NULL/NaN become empty cells."""
+    return batch.astype(object).where(batch.notna(), None).itertuples(index=False, name=None)
 
 
-def export_table_to_excel(conn, table: str, out_dir: str, max_rows_per_file: int = 1_000_000):
+def export_table_to_excel(conn, table: str, out_dir: str, max_rows_per_file: int = 1_000_000,
+                          itersize: int = DEFAULT_ITERSIZE, query: Optional[str] = None,
+                          params: Optional[tuple] = None) -> int:
     """Export a single table to one or more Excel files, splitting to respect Excel's ~1,048,576 row limit per sheet.
     Files are named <table>.xlsx or <table>_partN.xlsx if split is needed.
+    Rows are streamed from a server-side cursor in batches of `itersize` into a write-only openpyxl
+    workbook, which flushes rows to a temp file as they are appended, so memory holds one batch at a time.
+    `query`/`params` replace the default SELECT * (used by delta exports). Returns the rows written.
     """
     canon = canonical_table_name(conn, table)
     if not canon:
         print(f"Bỏ qua bảng {table}: không tồn tại.")
-        return
-
-    total = get_row_count(conn, canon)
-    if total == 0:
-        # Create an empty file with header for consistency
-        df_empty = pd.read_sql_query(f'SELECT * FROM "{canon}" LIMIT 0', conn)
+        return 0
+
+    # Planner estimate for progress only; the split is decided while streaming
+    estimate = 0 if query else estimate_row_count(conn, canon)
+    sheet = table[:31] or 'Sheet1'
+    parts: List[List[Any]] = []  # [path, first row, last row]
+    book = None
+    rows_in_file = 0
+    written = 0
+    try:
+        for batch in iter_query_batches(conn, query or f'SELECT * FROM "{canon}"', params or None,
+                                        itersize=itersize):
+            start = 0
+            while start < len(batch) or book is None:
+                if book is None or rows_in_file >= max_rows_per_file:
+                    if book is not None:
+                        book.save(parts[-1][0])
+                    parts.append([os.path.join(out_dir, f"{table}_part{len(parts) + 1}.xlsx"), written + 1, written])
+                    book = Workbook(write_only=True)
+                    ws = book.create_sheet(sheet)
+                    ws.append(list(batch.columns))  # header once per file
+                    rows_in_file = 0
+                chunk = batch.iloc[start:start + max_rows_per_file - rows_in_file]
+                for row in excel_rows(chunk):
+                    ws.append(row)
+                rows_in_file += len(chunk)
+                written += len(chunk)
+                start += len(chunk)
+                parts[-1][2] = written
+    finally:
+        if book is not None:
+            book.save(parts[-1][0])
+
+    if len(parts) == 1:
         target = os.path.join(out_dir, f"{table}.xlsx")
-        with pd.ExcelWriter(target, engine='openpyxl') as writer:
-            df_empty.to_excel(writer, index=False, sheet_name=(table or canon)[:31] or 'Sheet1')
-        print(f"Đã xuất {table} (trống) -> {target}")
-        return
-
-    parts = max(1, math.ceil(total / max_rows_per_file))
-    for i in range(parts):
-        offset = i * max_rows_per_file
-        limit = min(max_rows_per_file, total - offset)
-        # Always quote the canonical table name
-        query = f'SELECT * FROM "{canon}" OFFSET {offset} LIMIT {limit}'
-        df = pd.read_sql_query(query, conn)
-        if parts == 1:
-            filename = f"{table}.xlsx"
-        else:
-            filename = f"{table}_part{i+1}.xlsx"
-        target = os.path.join(out_dir, filename)
-        # Write a single sheet named after the table (trim to 31 chars)
-        with pd.ExcelWriter(target, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name=table[:31] or 'Sheet1')
-        print(f"Đã xuất {table} ({offset+1}-{offset+len(df)}/{total}) -> {target}")
-
-
-def export_tables_to_excel(dbc: DbConfig, out_dir: str, tables: Optional[List[str]] = None, max_rows_per_file: int = 1_000_000):
+        os.replace(parts[0][0], target)
+        parts[0][0] = target
+        if written == 0:
+            print(f"Đã xuất {table} (trống) -> {target}")
+            return 0
+    for path, first, last in parts:
+        print(f"Đã xuất {table} ({first}-{last}/~{max(estimate, written)}) -> {path}")
+    return written
+
+
+def export_tables_to_excel(dbc: DbConfig, out_dir: str, tables: Optional[List[str]] = None, max_rows_per_file: int = 1_000_000,
+                           itersize: int = DEFAULT_ITERSIZE, since: Optional[int] = None,
+                           state_file: Optional[str] = None):
+    """Export tables to Excel; with `since`/`state_file` only new fact rows and changed tables (see delta.py)."""
     os.makedirs(out_dir, exist_ok=True)
     tables = tables or DEFAULT_TABLES
+    delta = since is not None or bool(state_file)
     with get_conn(dbc) as conn:
-        for t in tables:
+        plans = None
+        if delta:
+            from delta import commit_plans, load_state, plan_delta, save_state
+            state = load_state(state_file)
+            plans = plan_delta(conn, tables, state, since=since)
+        for i, t in enumerate(tables):
+            plan = plans[i] if plans is not None else None
+            if plan is not None and plan.query is None:
+                print(f"Bỏ qua {t}: {plan.reason}")
+                continue
             try:
-                export_table_to_excel(conn, t, out_dir, max_rows_per_file=max_rows_per_file)
+                if plan is not None:
+                    print(f"Xuất {t} [{plan.reason}]")
+                export_table_to_excel(conn, t, out_dir, max_rows_per_file=max_rows_per_file, itersize=itersize,
+                                      query=plan.query if plan else None, params=plan.params if plan else None)
             except Exception as e:
                 print(f"Lỗi khi xuất {t}: {e}")
+                conn.rollback()
+                if plan is not None:
+                    plan.state = {}  # not exported: keep the previous watermark
+    if delta and state_file:
+        save_state(state_file, commit_plans(state, plans))
+        print(f"Đã lưu mốc xuất (watermark) -> {state_file}")
 
 
 def parse_args():
@@ -118,6 +161,9 @@ def parse_args():
     p.add_argument('--out-dir', type=str, default=os.path.join('.', 'exports', 'xlsx'), help='Output directory for .xlsx files')
     p.add_argument('--tables', type=str, nargs='*', help='Specific tables to export (default: all supported)')
     p.add_argument('--max-rows-per-file', type=int, default=1_000_000, help='Max rows per Excel file before splitting')
+    p.add_argument('--itersize', type=int, default=DEFAULT_ITERSIZE, help='Rows fetched per round-trip from the server-side cursor')
+    p.add_argument('--since', type=int, help='Only fact rows with date_id >= this (YYYYMMDD); dimensions only if changed')
+    p.add_argument('--state-file', type=str, help='Watermark JSON: export only rows/tables new since the last run and update it')
     p.add_argument('--pg-host', type=str)
     p.add_argument('--pg-port', type=int)
     p.add_argument('--pg-db', type=str)
@@ -135,7 +181,8 @@ def main():
     if args.pg_user: dbc.user = args.pg_user
     if args.pg_password: dbc.password = args.pg_password
 
-    export_tables_to_excel(dbc, args.out_dir, tables=args.tables, max_rows_per_file=args.max_rows_per_file)
+    export_tables_to_excel(dbc, args.out_dir, tables=args.tables, max_rows_per_file=args.max_rows_per_file,
+                           itersize=args.itersize, since=args.since, state_file=args.state_file)
 
 
 if __name__ == '__main__':
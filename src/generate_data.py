@@ -1,25 +1,44 @@
 import os
+import io
+import json
 import random
 import math
+import time
 from datetime import date, datetime, timedelta
-from dataclasses import dataclass
-from typing import List, Optional, Tuple, Any
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterator, List, Optional, Tuple, Any
 
 import numpy as np
 import pandas as pd
 from dateutil.relativedelta import relativedelta
-from faker import Faker
-from faker.providers import person, phone_number, address, internet
-import psycopg2
 from psycopg2.extras import execute_values
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from dotenv import load_dotenv
 
-fake = Faker('vi_VN')
-fake.add_provider(person)
-fake.add_provider(phone_number)
-fake.add_provider(address)
-fake.add_provider(internet)
+from behaviour import BehaviourModel, CustomerBehaviour
+from compress import ExportFile
+from checkpoint import LoadCheckpoint, order_slices
+from config import Config, DbConfig, load_config_from_env
+from costs import CostMatrix, build_cost_matrix
+from db import ensure_database, export_tables_to_csv, get_conn, run_sql
+from demand import BatchSampler, DemandModel, date_weights, demand_samplers, load_demand_model
+from instrumentation import StageRecorder
+from memory import SAMPLE_ROWS, MemoryBudget, frame_bytes, insert_batches, list_bytes, sized_slices, tuple_row_bytes
+
+_fake = None
+
+
+def get_faker():
+    """Faker('vi_VN') with the providers used here, built on first use (importing Faker is slow
+    and most commands never generate people or addresses)."""
+    global _fake
+    if _fake is None:
+        from faker import Faker
+        from faker.providers import person, phone_number, address, internet
+        _fake = Faker('vi_VN')
+        _fake.add_provider(person)
+        _fake.add_provider(phone_number)
+        _fake.add_provider(address)
+        _fake.add_provider(internet)
+    return _fake
 
 VN_CITIES = [
     ("Hà Nội", "Hà Nội"), ("Hồ Chí Minh", "Hồ Chí Minh"), ("Đà Nẵng", "Đà Nẵng"),
@@ -118,95 +137,16 @@ ONLINE_PLATFORM_STORES = [
     ("ONL-WEBAPP", "Web-App"),
 ]
 
-@dataclass
-class Config:
-    customers: int = 100
-    products: int = 180
-    employees: int = 40
-    stores: int = 10
-    promotions: int = 15
-    years: int = 3
-    min_rows: int = 1000
-    max_rows: int = 5000
-    export_csv_dir: Optional[str] = None
-    db_export_dir: Optional[str] = None  # export tables from DB to CSV with UTF-8 BOM
-    # Monthly active customers range per month
-    monthly_active_min: int = 700
-    monthly_active_max: int = 900
-
-@dataclass
-class DbConfig:
-    host: str
-    port: int
-    db: str
-    user: str
-    password: str
-
-
-def load_config_from_env() -> Tuple[Config, DbConfig]:
-    load_dotenv()
-    cfg = Config(
-        customers=int(os.getenv('CUSTOMERS', 100)),
-        products=int(os.getenv('PRODUCTS', 180)),
-        employees=int(os.getenv('EMPLOYEES', 40)),
-        stores=int(os.getenv('STORES', 10)),
-        promotions=int(os.getenv('PROMOTIONS', 15)),
-        years=int(os.getenv('YEARS', 3)),
-        min_rows=int(os.getenv('MIN_ROWS', 1000)),
-        max_rows=int(os.getenv('MAX_ROWS', 5000)),
-        # New env vars with backward compatibility
-        monthly_active_min=int(os.getenv('MONTHLY_ACTIVE_MIN', 700)),
-        monthly_active_max=int(os.getenv('MONTHLY_ACTIVE_MAX', 900)),
-        export_csv_dir=os.getenv('EXPORT_CSV_DIR'),
-        db_export_dir=os.getenv('DB_EXPORT_DIR')
-    )
-    # Backward compatibility: if MONTHLY_ACTIVE_CUSTOMERS provided, pin min=max=value
-    legacy_mac = os.getenv('MONTHLY_ACTIVE_CUSTOMERS')
-    if legacy_mac is not None and legacy_mac != "":
-        try:
-            v = int(legacy_mac)
-            cfg.monthly_active_min = v
-            cfg.monthly_active_max = v
-        except ValueError:
-            pass
-    # Ensure min <= max
-    if cfg.monthly_active_min > cfg.monthly_active_max:
-        cfg.monthly_active_min, cfg.monthly_active_max = cfg.monthly_active_max, cfg.monthly_active_min
-    dbc = DbConfig(
-        host=os.getenv('PG_HOST', 'localhost'),
-        port=int(os.getenv('PG_PORT', 5432)),
-        db=os.getenv('PG_DB', 'bi_courses'),
-        user=os.getenv('PG_USER', 'postgres'),
-        password=os.getenv('PG_PASSWORD', '1')
-    )
-    return cfg, dbc
-
-
-def ensure_database(db: DbConfig):
-    """Create database if not exists."""
-    conn = psycopg2.connect(host=db.host, port=db.port, dbname='postgres', user=db.user, password=db.password)
-    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM pg_database WHERE datname=%s", (db.db,))
-    exists = cur.fetchone() is not None
-    if not exists:
-        cur.execute(f'CREATE DATABASE "{db.db}"')
-    cur.close()
-    conn.close()
+def seed_everything(seed: int):
+    """Seed every RNG used by the builders (random, NumPy/pandas, Faker) for reproducible runs."""
+    random.seed(seed)
+    np.random.seed(seed % (2**32))
+    get_faker().seed_instance(seed)
 
 
-def get_conn(db: DbConfig):
-    return psycopg2.connect(host=db.host, port=db.port, dbname=db.db, user=db.user, password=db.password)
-
-
-def run_sql(conn, sql: str):
-    with conn.cursor() as cur:
-        cur.execute(sql)
-    conn.commit()
-
-
-def build_date_dim(years: int) -> pd.DataFrame:
-    end = date.today()
+def build_date_dim(years: int, end: Optional[date] = None) -> pd.DataFrame:
+    """One row per day over the `years` years up to `end` (default today)."""
+    end = end or date.today()
     start = end - relativedelta(years=years)
     days = (end - start).days
     rows = []
@@ -234,6 +174,7 @@ def build_date_dim(years: int) -> pd.DataFrame:
 
 
 def build_customer_dim(n: int) -> pd.DataFrame:
+    fake = get_faker()
     rows = []
     for i in range(n):
         city, province = random.choice(VN_CITIES)
@@ -265,8 +206,10 @@ def build_customer_dim(n: int) -> pd.DataFrame:
     return pd.DataFrame(rows)
 
 
-def build_customer_children(cust_df: pd.DataFrame) -> pd.DataFrame:
-    """For each customer, create 0-5 product users (children) with name, gender and DOB."""
+def build_customer_children(cust_df: pd.DataFrame, today: Optional[date] = None) -> pd.DataFrame:
+    """For each customer, create 0-5 product users (children) with name, gender and DOB (relative to `today`)."""
+    fake = get_faker()
+    today = today or date.today()
     rows = []
     for _, row in cust_df.iterrows():
         customer_id = row['customer_id']
@@ -276,7 +219,7 @@ def build_customer_children(cust_df: pd.DataFrame) -> pd.DataFrame:
             # Child age: 0-10 years old
             years = random.randint(0, 10)
             # ensure valid date within last 'years'
-            start = date.today() - relativedelta(years=years, days=random.randint(0, 364))
+            start = today - relativedelta(years=years, days=random.randint(0, 364))
             dob = start
             rows.append({
                 'customer_id': customer_id,
@@ -318,99 +261,47 @@ def build_product_dim(n: int) -> pd.DataFrame:
     return pd.DataFrame(rows)
 
 
-def build_product_daily_costs(date_df: pd.DataFrame, prod_df: pd.DataFrame) -> pd.DataFrame:
-    """Generate daily input cost per product with smooth constraints approximated:
-    - Day-to-day change within ~±2% (<=3% hard limit enforced by DB trigger)
-    - Over any year, cost stays within roughly ±15% band (~<=20% enforced by trigger)
-    """
-    if prod_df.empty or date_df.empty:
-        return pd.DataFrame(columns=['product_id','date_id','cost'])
-    # Use only business days or all days? We'll use all days for simplicity
-    dates = date_df[['date_id','full_date']].sort_values('full_date').reset_index(drop=True)
-    out_rows: list[dict[str, Any]] = []
-    for prod in prod_df.itertuples(index=False):
-        base = float(prod.gia_niem_yet)
-        # Start baseline cost a bit below list price (e.g., 70%–90% of list)
-        cost0 = base * random.uniform(0.7, 0.9)
-        # Keep a slow-moving anchor to avoid exceeding 20% annually
-        anchor = cost0
-        anchor_reset_date = dates.loc[0, 'full_date']
-        prev_cost = None
-        for i, row in dates.iterrows():
-            dkey = int(row['date_id'])
-            cur_date = row['full_date']
-            # Every ~30-60 days, allow anchor to drift slightly (±3%)
-            if (cur_date - anchor_reset_date).days >= random.randint(30, 60):
-                anchor *= random.uniform(0.98, 1.02)
-                anchor_reset_date = cur_date
-            if prev_cost is None:
-                c = anchor
-            else:
-                # Small day-to-day walk within ±1.5% around anchor pull
-                step = random.uniform(-0.015, 0.015)
-                c = prev_cost * (1 + step)
-                # Pull back toward anchor a bit
-                c = (0.8 * c) + (0.2 * anchor)
-            # Soft bounds relative to anchor: keep within ~±15%
-            lo = anchor * 0.85
-            hi = anchor * 1.15
-            c = max(lo, min(hi, c))
-            # Ensure non-zero and reasonable minimum
-            c = max(1000.0, c)
-            out_rows.append({'product_id': prod.product_id, 'date_id': dkey, 'cost': round(float(c), 2)})
-            prev_cost = c
-    return pd.DataFrame(out_rows)
+def apply_dimension_refresh(conn, table: str, df: pd.DataFrame, columns: List[str],
+                            key: str = 'id', upsert: bool = False) -> int:
+    """Apply regenerated attributes set-based: COPY `df` into a temp table, then one
+    UPDATE ... FROM (or INSERT ... ON CONFLICT when `upsert`). Returns rows affected; does not commit."""
+    tmp = f"refresh_{table.lower()}"
+    cols = [key] + columns
+    with conn.cursor() as cur:
+        # Same column types as the target, no constraints; dropped at commit
+        cur.execute(f"CREATE TEMP TABLE {tmp} ON COMMIT DROP AS SELECT {','.join(cols)} FROM {table} WITH NO DATA")
+    copy_frame(conn, tmp, df[cols], commit=False)
+    assignments = ', '.join(f"{c}=s.{c}" for c in columns)
+    with conn.cursor() as cur:
+        if upsert:
+            excluded = ', '.join(f"{c}=EXCLUDED.{c}" for c in columns)
+            cur.execute(f"INSERT INTO {table} ({','.join(cols)}) SELECT {','.join(cols)} FROM {tmp} "
+                        f"ON CONFLICT ({key}) DO UPDATE SET {excluded}")
+        else:
+            cur.execute(f"UPDATE {table} t SET {assignments} FROM {tmp} s WHERE t.{key} = s.{key}")
+        affected = cur.rowcount
+        cur.execute(f"DROP TABLE {tmp}")
+    return affected
+
+
+def read_ids(conn, table: str, where: str = '') -> List[str]:
+    from db_read import read_query_frame
+    return read_query_frame(conn, f"SELECT id FROM {table} {where} ORDER BY id")['id'].tolist()
 
 
 def refresh_products_only(dbc: DbConfig):
     """Regenerate products attributes in place (update only) to keep FKs intact."""
     with get_conn(dbc) as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id FROM products ORDER BY id")
-            ids = [r[0] for r in cur.fetchall()]
+        ids = read_ids(conn, 'products')
         if not ids:
             print("Không có sản phẩm nào để cập nhật.")
             return
         new_df = build_product_dim(len(ids))
         # Preserve existing product_id order
-        new_df['product_id'] = ids
-        # Normalize numpy types
-        def pyify(x: Any) -> Any:
-            if pd.isna(x):
-                return None
-            if isinstance(x, (np.integer,)):
-                return int(x)
-            if isinstance(x, (np.floating,)):
-                return float(x)
-            if isinstance(x, (np.bool_,)):
-                return bool(x)
-            return x
-        updates = [
-            (
-                pyify(row.ten_san_pham),
-                pyify(row.danh_muc),
-                pyify(row.thuong_hieu),
-                pyify(row.don_vi),
-                pyify(row.gia_niem_yet),
-                pyify(row.product_id),
-            )
-            for row in new_df.itertuples(index=False)
-        ]
-        with conn.cursor() as cur:
-            cur.executemany(
-                """
-                UPDATE products
-                SET ten_san_pham=%s,
-                    danh_muc=%s,
-                    thuong_hieu=%s,
-                    don_vi=%s,
-                    gia_niem_yet=%s
-                WHERE id=%s
-                """,
-                updates,
-            )
+        new_df['id'] = ids
+        n = apply_dimension_refresh(conn, 'products', new_df, TABLE_COLUMNS['products'][1:])
         conn.commit()
-        print(f"Đã cập nhật lại {len(ids)} sản phẩm trong products (chỉ update).")
+        print(f"Đã cập nhật lại {n} sản phẩm trong products (chỉ update).")
 
 
 def refresh_stores_only(dbc: DbConfig):
@@ -419,93 +310,74 @@ def refresh_stores_only(dbc: DbConfig):
     - Ensures online platform stores exist and are set to mien='Online'.
     - Does not touch other tables.
     """
-    online_id_set = {sid for sid, _ in ONLINE_PLATFORM_STORES}
     with get_conn(dbc) as conn:
         with conn.cursor() as cur:
             # Ensure column exists
             cur.execute("ALTER TABLE IF EXISTS stores ADD COLUMN IF NOT EXISTS mien VARCHAR(20)")
-            # Load current store ids
-            cur.execute("SELECT id FROM stores ORDER BY id")
-            all_ids = [r[0] for r in cur.fetchall()]
-        # Partition
-        offline_ids = sorted([sid for sid in all_ids if sid and sid.startswith('STO-')])
-        # Build fresh offline rows
-        new_df = build_store_dim(len(offline_ids))
-        new_offline = new_df[new_df['store_type'] == 'Offline'].copy()
-        # Map generated rows to existing ids in order
-        new_offline.sort_index(inplace=True)
-        # If counts mismatch, trim or pad (pad from generator)
-        if len(new_offline) > len(offline_ids):
-            new_offline = new_offline.iloc[:len(offline_ids)].copy()
-        elif len(new_offline) < len(offline_ids):
-            # generate extra to match
-            extra_needed = len(offline_ids) - len(new_offline)
-            extra_df = build_store_dim(extra_needed)
-            extra_off = extra_df[extra_df['store_type'] == 'Offline'].copy()
-            new_offline = pd.concat([new_offline, extra_off.iloc[:extra_needed]], ignore_index=True)
-        new_offline['store_id'] = offline_ids
-        # Prepare updates
-        up_rows = [
-            (
-                row.ten_cua_hang,
-                row.dia_chi,
-                row.thanh_pho,
-                row.tinh_thanh,
-                row.mien,
-                row.store_id,
-            )
-            for row in new_offline.itertuples(index=False)
-        ]
-        with conn.cursor() as cur:
-            # Update offline stores
-            cur.executemany(
-                """
-                UPDATE stores
-                SET ten_cua_hang=%s,
-                    dia_chi=%s,
-                    thanh_pho=%s,
-                    tinh_thanh=%s,
-                    mien=%s
-                WHERE id=%s
-                """,
-                up_rows,
-            )
-            # Upsert online platform stores
-            platform_rows = [
-                (sid, name, None, None, None, 'Online')
-                for sid, name in ONLINE_PLATFORM_STORES
-            ]
-            cur.executemany(
-                """
-                INSERT INTO stores (id, ten_cua_hang, dia_chi, thanh_pho, tinh_thanh, mien)
-                VALUES (%s,%s,%s,%s,%s,%s)
-                ON CONFLICT (id) DO UPDATE SET
-                    ten_cua_hang=EXCLUDED.ten_cua_hang,
-                    dia_chi=EXCLUDED.dia_chi,
-                    thanh_pho=EXCLUDED.thanh_pho,
-                    tinh_thanh=EXCLUDED.tinh_thanh,
-                    mien=EXCLUDED.mien
-                """,
-                platform_rows,
-            )
+        offline_ids = read_ids(conn, 'stores', "WHERE id LIKE 'STO-%'")
+        # Build fresh offline rows, mapped to existing ids in order
+        new_offline = build_store_dim(len(offline_ids))
+        new_offline = new_offline[new_offline['store_type'] == 'Offline'].iloc[:len(offline_ids)].copy()
+        new_offline['id'] = offline_ids
+        columns = TABLE_COLUMNS['stores'][1:]
+        n = apply_dimension_refresh(conn, 'stores', new_offline, columns)
+        # Upsert online platform stores
+        platforms = pd.DataFrame([
+            {'id': sid, 'ten_cua_hang': name, 'dia_chi': None, 'thanh_pho': None, 'tinh_thanh': None, 'mien': 'Online'}
+            for sid, name in ONLINE_PLATFORM_STORES
+        ])
+        apply_dimension_refresh(conn, 'stores', platforms, columns, upsert=True)
         conn.commit()
-    print(f"Đã cập nhật {len(offline_ids)} cửa hàng offline và đồng bộ cửa hàng online (chỉ update stores).")
+    print(f"Đã cập nhật {n} cửa hàng offline và đồng bộ cửa hàng online (chỉ update stores).")
+
+
+def refresh_customers_only(dbc: DbConfig):
+    """Regenerate customer attributes (name, contact, address, points/tier) in place, keeping ids."""
+    with get_conn(dbc) as conn:
+        ids = read_ids(conn, 'customers')
+        if not ids:
+            print("Không có khách hàng nào để cập nhật.")
+            return
+        new_df = build_customer_dim(len(ids))
+        new_df['id'] = ids
+        n = apply_dimension_refresh(conn, 'customers', new_df, TABLE_COLUMNS['customers'][1:])
+        conn.commit()
+    print(f"Đã cập nhật lại {n} khách hàng trong customers (chỉ update).")
+
+
+def refresh_employees_only(dbc: DbConfig):
+    """Regenerate employee attributes in place; home stores are drawn from the current offline stores."""
+    from db_read import read_query_frame
+    with get_conn(dbc) as conn:
+        ids = read_ids(conn, 'employees')
+        if not ids:
+            print("Không có nhân viên nào để cập nhật.")
+            return
+        store_ids = read_query_frame(conn, "SELECT id FROM stores WHERE id LIKE 'STO-%' ORDER BY id")['id'].tolist()
+        new_df = build_employee_dim(len(ids), store_ids)
+        new_df['id'] = ids
+        n = apply_dimension_refresh(conn, 'employees', new_df, TABLE_COLUMNS['employees'][1:])
+        conn.commit()
+    print(f"Đã cập nhật lại {n} nhân viên trong employees (chỉ update).")
 
 
 def build_employee_dim(n: int, stores: List[str]) -> pd.DataFrame:
+    """Employees with a home store (cua_hang_mac_dinh = store id) drawn from `stores`."""
+    fake = get_faker()
     rows = []
     for i in range(n):
         rows.append({
             'employee_id': f'EMP-{i+1:04d}',
             'ho_ten': fake.name(),
             'chuc_danh': random.choice(EMP_ROLES),
-            # If no stores provided, leave default store empty
+            # If no stores provided, leave the home store empty
             'cua_hang_mac_dinh': (random.choice(stores) if stores else None)
         })
     return pd.DataFrame(rows)
 
 
 def build_store_dim(n: int) -> pd.DataFrame:
+    fake = get_faker()
     rows = []
     # Offline physical stores
     for i in range(n):
@@ -561,6 +433,128 @@ def build_promotion_dim(n: int, date_df: pd.DataFrame) -> pd.DataFrame:
     return pd.DataFrame(rows)
 
 
+# Channel is stored as a 2-value categorical (code 1 = Online)
+CHANNEL_DTYPE = pd.CategoricalDtype(['Offline', 'Online'])
+
+
+def id_dtype(df: pd.DataFrame, col: str) -> pd.CategoricalDtype:
+    """Categorical dtype over a dimension's business IDs; codes are row positions in df."""
+    ids = df[col].tolist() if col in df.columns else []
+    return pd.CategoricalDtype(pd.Index(ids, dtype=object))
+
+
+def codes_to_ids(codes: List[int], dtype: pd.CategoricalDtype) -> pd.Categorical:
+    """Integer codes (-1 = NULL) as a Categorical of business IDs (no per-row strings)."""
+    return pd.Categorical.from_codes(np.asarray(codes, dtype=np.int32), dtype=dtype)
+
+
+@dataclass
+class ProductLookup:
+    """Product attributes as contiguous arrays indexed by product code (row position in prod_df)."""
+    list_price: np.ndarray  # float64 [n_prod]
+    date_ids: np.ndarray  # sorted date_id; column order of daily_cost
+    daily_cost: Optional[np.ndarray] = None  # [n_prod, n_days] CostMatrix values (possibly memory-mapped)
+
+    def cost_of(self, prod_codes: np.ndarray, date_ids: np.ndarray) -> np.ndarray:
+        """Vectorized cost lookup for (product code, date_id) pairs, as float64 so callers round
+        exactly like CostMatrix.iter_frames() does for product_daily_costs."""
+        cols = np.searchsorted(self.date_ids, date_ids)
+        return self.daily_cost[prod_codes, cols].astype(np.float64)
+
+
+def build_product_lookup(prod_df: pd.DataFrame, date_df: pd.DataFrame,
+                         costs: Optional[CostMatrix] = None) -> ProductLookup:
+    """Arrays for O(1) price/cost lookup; daily costs come from the cost matrix when given."""
+    list_price = prod_df['gia_niem_yet'].to_numpy(dtype=np.float64) if len(prod_df) else np.zeros(0)
+    if costs is not None:
+        return ProductLookup(list_price, costs.date_ids, costs.values)
+    return ProductLookup(list_price, np.sort(date_df['date_id'].to_numpy(dtype=np.int64)))
+
+
+@dataclass
+class StoreStaff:
+    """Store -> employees index in CSR form: the employee codes of store code s are
+    emp_codes[offsets[s]:offsets[s + 1]] (codes are row positions in store_df / emp_df)."""
+    offsets: List[int]  # [n_store + 1]
+    emp_codes: List[int]  # employees grouped by home store
+    n_emp: int
+
+    def pick(self, store: int) -> int:
+        """Random employee of `store`; any employee when the store has no staff (or store < 0),
+        -1 when there are no employees at all."""
+        if store >= 0:
+            lo, hi = self.offsets[store], self.offsets[store + 1]
+            if hi > lo:
+                return self.emp_codes[lo + random.randrange(hi - lo)]
+        return random.randrange(self.n_emp) if self.n_emp else -1
+
+
+def build_store_staff(emp_df: pd.DataFrame, store_df: pd.DataFrame) -> StoreStaff:
+    """Group employees by home store (cua_hang_mac_dinh); unknown or empty stores are skipped."""
+    n_store = len(store_df)
+    store_codes = np.zeros(0, dtype=np.int64)
+    if len(emp_df) and 'cua_hang_mac_dinh' in emp_df.columns and 'store_id' in store_df.columns:
+        store_codes = pd.Categorical(emp_df['cua_hang_mac_dinh'], categories=store_df['store_id']).codes.astype(np.int64)
+    staffed = np.flatnonzero(store_codes >= 0)
+    # Stable sort keeps employees of a store in emp_df order
+    emp_codes = staffed[np.argsort(store_codes[staffed], kind='stable')]
+    offsets = np.zeros(n_store + 1, dtype=np.int64)
+    np.cumsum(np.bincount(store_codes[staffed], minlength=n_store), out=offsets[1:])
+    # Python ints index faster than numpy scalars inside the per-order loop
+    return StoreStaff(offsets.tolist(), emp_codes.tolist(), len(emp_df))
+
+
+@dataclass
+class MonthlyActive:
+    """Monthly active customer sets as one flat array of customer codes with per-month
+    offsets: the set of month position i is customers[offsets[i]:offsets[i + 1]], in the
+    order that month's orders cycle through it."""
+    offsets: np.ndarray  # int64 [n_months + 1]
+    customers: np.ndarray  # int64 customer codes (row positions in cust_df)
+    cursor: np.ndarray  # int64 [n_months]: orders of each month assigned so far
+
+    @classmethod
+    def from_sets(cls, sets: List[np.ndarray]) -> 'MonthlyActive':
+        offsets = np.zeros(len(sets) + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in sets], out=offsets[1:])
+        customers = np.concatenate(sets).astype(np.int64) if sets else np.zeros(0, dtype=np.int64)
+        return cls(offsets, customers, np.zeros(len(sets), dtype=np.int64))
+
+    @classmethod
+    def sample(cls, n_cust: int, sizes: np.ndarray, rng: np.random.Generator) -> 'MonthlyActive':
+        """One set of sizes[i] distinct customers per month, in random order. Generator.choice
+        without replacement is O(k) for k << n_cust, so 10M customers cost no more than 10k."""
+        return cls.from_sets([rng.choice(n_cust, size=int(k), replace=False) for k in sizes])
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def assign(self, month_pos: np.ndarray) -> np.ndarray:
+        """Customer codes for a run of orders given their month positions: each month's
+        orders take its set round-robin, continuing where the previous call stopped.
+        -1 for orders outside the known months or in a month with an empty set."""
+        month_pos = np.asarray(month_pos, dtype=np.int64)
+        out = np.full(len(month_pos), -1, dtype=np.int64)
+        known = month_pos >= 0
+        m = month_pos[known]
+        if not len(m):
+            return out
+        # Rank of every order among the orders of its month (stable: order_id order)
+        order = np.argsort(m, kind='stable')
+        sorted_m = m[order]
+        rank = np.empty(len(m), dtype=np.int64)
+        rank[order] = np.arange(len(m)) - np.searchsorted(sorted_m, sorted_m, side='left')
+        rank += self.cursor[m]
+        self.cursor += np.bincount(m, minlength=len(self.cursor))
+        sizes = self.sizes[m]
+        filled = sizes > 0
+        codes = np.full(len(m), -1, dtype=np.int64)
+        codes[filled] = self.customers[self.offsets[m[filled]] + rank[filled] % sizes[filled]]
+        out[known] = codes
+        return out
+
+
 def weighted_price(base: float) -> float:
     # Giá bán thực tế dao động nhẹ quanh giá niêm yết (ưu đãi nhẹ)
     price = base * random.uniform(0.95, 1.02)
@@ -600,42 +594,109 @@ def build_orders(
     promo_df: pd.DataFrame,
     monthly_active_min: int = 700,
     monthly_active_max: int = 900,
+    demand: Optional[DemandModel] = None,
+    costs: Optional[CostMatrix] = None,
+    behaviour: Optional[BehaviourModel] = None,
+    child_df: Optional[pd.DataFrame] = None,
+    item_dates: bool = False,
 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    chunks = list(iter_order_chunks(
+        min_rows, max_rows, date_df, cust_df, prod_df, emp_df, store_df, promo_df,
+        monthly_active_min=monthly_active_min, monthly_active_max=monthly_active_max, demand=demand,
+        costs=costs, behaviour=behaviour, child_df=child_df, item_dates=item_dates,
+    ))
+    if not chunks:
+        return pd.DataFrame(), pd.DataFrame()
+    orders = pd.concat([o for o, _ in chunks], ignore_index=True)
+    items = pd.concat([i for _, i in chunks], ignore_index=True)
+    return orders, items
+
+
+def iter_order_chunks(
+    min_rows: int,
+    max_rows: int,
+    date_df: pd.DataFrame,
+    cust_df: pd.DataFrame,
+    prod_df: pd.DataFrame,
+    emp_df: pd.DataFrame,
+    store_df: pd.DataFrame,
+    promo_df: pd.DataFrame,
+    monthly_active_min: int = 700,
+    monthly_active_max: int = 900,
+    chunk_size: int = 50_000,
+    demand: Optional[DemandModel] = None,
+    costs: Optional[CostMatrix] = None,
+    behaviour: Optional[BehaviourModel] = None,
+    child_df: Optional[pd.DataFrame] = None,
+    item_dates: bool = False,
+    budget: Optional[MemoryBudget] = None,
+    chunk_copies: int = 1,
+    shard: Optional[Any] = None,
+) -> Iterator[Tuple[pd.DataFrame, pd.DataFrame]]:
+    """Generate orders and their items in chunks of up to `chunk_size` orders.
+    Chunks cover consecutive order_id ranges; concatenated they equal build_orders().
+    With a DemandModel, order dates and products are drawn from its seasonal/Zipf
+    weights instead of uniformly. With a cost matrix, order_items.gia_von is filled
+    with the product's cost on the order date (otherwise it stays NULL). With a
+    BehaviourModel, customers carry state across months (see behaviour.py):
+    retention, home store, preferred channel, basket size and a category
+    preference following their children's age. With item_dates, items also carry
+    their order's date_id (partitioned schema, see schema_partitioned.sql).
+    With a MemoryBudget, `chunk_size` is replaced by a ChunkSizer: a first sample
+    chunk of SAMPLE_ROWS orders measures the bytes per order (Python lists +
+    frames), `chunk_copies` is how many chunks the consumer keeps alive, and the
+    time until the consumer asks for the next chunk feeds the runtime adjustment.
+    With a shard (shards.ShardSpec), the setup (monthly active sets, store weights,
+    customer state, product popularity) is drawn as usual, so it is identical on
+    every node seeded with the plan's setup seed; then the RNGs are reseeded with
+    the shard's seed and only the shard's orders are drawn: its months, its
+    order count and its order_id range."""
     n_orders = random.randint(min_rows, max_rows)
     date_keys = date_df['date_id'].tolist()
     # Map date_id -> year_month
     date_df = date_df.copy()
     date_df['year_month'] = date_df['date_id'].astype(str).str.slice(0, 6).astype(int)
-    dkey_to_month = dict(zip(date_df['date_id'], date_df['year_month']))
     months = sorted(date_df['year_month'].unique().tolist())
-    # Build monthly active customer sets and cycling indices
-    all_cust_ids = cust_df['customer_id'].tolist() if not cust_df.empty else []
-    month_active_map: dict[int, list[str]] = {}
-    month_cycle_idx: dict[int, int] = {}
-    for m in months:
-        if all_cust_ids:
-            # choose active set size in [min, max]
-            try:
-                lo = int(monthly_active_min)
-                hi = int(monthly_active_max)
-            except Exception:
-                lo, hi = 700, 900
-            if lo > hi:
-                lo, hi = hi, lo
-            k = random.randint(lo, hi)
-            k = min(k, len(all_cust_ids))
-            act = random.sample(all_cust_ids, k)
-            random.shuffle(act)
-            month_active_map[m] = act
-            month_cycle_idx[m] = 0
-        else:
-            month_active_map[m] = []
-            month_cycle_idx[m] = 0
-    # Partition stores
-    offline_df = store_df[store_df.get('store_type', 'Offline') == 'Offline'] if not store_df.empty else store_df
-    online_df = store_df[store_df.get('store_type', '') == 'Online'] if not store_df.empty else store_df
-    offline_ids = offline_df['store_id'].tolist() if not offline_df.empty else []
-    online_ids = online_df['store_id'].tolist() if not online_df.empty else []
+    # date_id -> month position (index into `months` and the MonthlyActive sets)
+    month_pos = {m: i for i, m in enumerate(months)}
+    dkey_to_mpos = {d: month_pos[m] for d, m in zip(date_df['date_id'], date_df['year_month'])}
+    # IDs are carried as integer codes into each dimension; strings only appear on serialization
+    cust_dtype = id_dtype(cust_df, 'customer_id')
+    prod_dtype = id_dtype(prod_df, 'product_id')
+    emp_dtype = id_dtype(emp_df, 'employee_id')
+    store_dtype = id_dtype(store_df, 'store_id')
+    promo_dtype = id_dtype(promo_df, 'promotion_id')
+    # Monthly active customer sets (customer codes), flat with per-month offsets
+    n_cust = len(cust_dtype.categories)
+    # With a behaviour model, per-month traits (channel, home store, basket, category) of the active set;
+    # the loop then needs each order's position in its set, so customers are picked there
+    month_traits: list[dict[str, list]] = []
+    cust_beh = None
+    categories = sorted(prod_df['danh_muc'].unique().tolist()) if 'danh_muc' in prod_df.columns else []
+    if behaviour is not None and n_cust:
+        cust_beh = CustomerBehaviour.build(cust_df, child_df, store_df, categories, behaviour,
+                                           np.random.default_rng(random.getrandbits(64)))
+    # choose active set sizes in [min, max]
+    try:
+        lo = int(monthly_active_min)
+        hi = int(monthly_active_max)
+    except Exception:
+        lo, hi = 700, 900
+    if lo > hi:
+        lo, hi = hi, lo
+    active_rng = np.random.default_rng(random.getrandbits(64))
+    sizes = np.minimum(active_rng.integers(lo, hi, size=len(months), endpoint=True), n_cust)
+    if cust_beh is not None:
+        for m, k in zip(months, sizes.tolist()):
+            month_traits.append(cust_beh.month_traits(cust_beh.next_month(k), date(m // 100, m % 100, 1)))
+        active = MonthlyActive.from_sets([np.asarray(t['customer'], dtype=np.int64) for t in month_traits])
+    else:
+        active = MonthlyActive.sample(n_cust, sizes, active_rng)
+    active_sizes = active.sizes.tolist()
+    # Partition stores (codes are positions in store_df)
+    store_types = store_df['store_type'].tolist() if 'store_type' in store_df.columns else ['Offline'] * len(store_df)
+    offline_ids = [i for i, t in enumerate(store_types) if t == 'Offline']
+    online_ids = [i for i, t in enumerate(store_types) if t == 'Online']
     # Build Pareto-like weights: top 30% stores take 70% of offline traffic
     offline_probs = None
     if len(offline_ids) > 0:
@@ -647,78 +708,184 @@ def build_orders(
         w_top = 0.7 / k
         w_rest = (0.3 / rest) if rest > 0 else 0.0
         offline_probs = [w_top if i in top_set else w_rest for i in range(len(offline_ids))]
-    # index promotions by date for simple matching
-    promo_by_date: dict[int, list[pd.Series]] = {}
-    for _, r in promo_df.iterrows():
-        d = r['start_date']
-        while d <= r['end_date']:
-            promo_by_date.setdefault(int(d.strftime('%Y%m%d')), []).append(r)
+    staff = build_store_staff(emp_df, store_df)
+    n_prod = len(prod_dtype.categories)
+    lookup = build_product_lookup(prod_df, date_df, costs)
+    # Product codes per category (same order as `categories`) for category-affine picks
+    cat_products: list[list[int]] = []
+    if cust_beh is not None:
+        cat_of = prod_df['danh_muc'].tolist()
+        cat_products = [[i for i, cat in enumerate(cat_of) if cat == name] for name in categories]
+    # Python floats index faster than numpy scalars inside the per-item loop
+    list_prices = lookup.list_price.tolist()
+    # index promotions by date for simple matching: date_id -> [(promo code, {'loai','gia_tri'})]
+    promo_by_date: dict[int, list[tuple[int, dict[str, Any]]]] = {}
+    for code, r in enumerate(promo_df.itertuples(index=False)):
+        promo = (code, {'loai': r.loai, 'gia_tri': r.gia_tri})
+        d = r.start_date
+        while d <= r.end_date:
+            promo_by_date.setdefault(int(d.strftime('%Y%m%d')), []).append(promo)
             d += timedelta(days=1)
-    headers = []
-    items = []
-    for oid in range(1, n_orders + 1):
-        dkey = random.choice(date_keys)
-        # Pick channel first
-        channel = 'Online' if random.random() < 0.35 else 'Offline'
+    date_sampler = prod_sampler = None
+    if demand is not None and date_keys and n_prod:
+        # numpy stream derived from the global RNG so --seed still pins the dataset
+        rng = np.random.default_rng(random.getrandbits(64))
+        date_sampler, prod_sampler = demand_samplers(demand, date_df, prod_df, rng)
+    first_oid = 1
+    if shard is not None:
+        random.seed(shard.seed)
+        in_shard = ((date_df['year_month'] >= shard.month_lo) & (date_df['year_month'] <= shard.month_hi)).to_numpy()
+        date_keys = date_df.loc[in_shard, 'date_id'].tolist()
+        n_orders, first_oid = shard.orders, shard.first_order_id
+        if date_sampler is not None:
+            # Weights come from the full calendar (yearly growth is relative to its first day)
+            rng = np.random.default_rng(shard.seed)
+            date_sampler = BatchSampler(date_weights(date_df, demand)[in_shard], rng)
+            prod_sampler = prod_sampler.with_rng(rng)
+
+    def new_chunk() -> Dict[str, list]:
+        return {c: [] for c in ['order_id', 'date_id', 'month', 'customer', 'employee', 'store', 'online',
+                                'i_order_id', 'i_product', 'i_promotion', 'so_luong', 'don_gia',
+                                'khuyen_mai', 'chiet_khau', 'doanh_thu']}
+
+    def to_frames(c: Dict[str, list]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        i_order_id = np.asarray(c['i_order_id'], dtype=np.int64)
+        i_product = np.asarray(c['i_product'], dtype=np.int32)
+        # order_ids within a chunk are consecutive, so each item's order date is a positional lookup
+        i_date = np.asarray(c['date_id'], dtype=np.int64)[i_order_id - c['order_id'][0]] if len(i_order_id) else i_order_id
+        if lookup.daily_cost is not None and len(i_order_id):
+            gia_von = np.round(lookup.cost_of(i_product, i_date), 2)
+        else:
+            gia_von = np.full(len(i_order_id), np.nan)
+        # Round-robin over each month's active set, for the whole chunk at once
+        customer = c['customer'] if month_traits else active.assign(np.asarray(c['month'], dtype=np.int64))
+        orders = pd.DataFrame({
+            'order_id': np.asarray(c['order_id'], dtype=np.int64),
+            'date_id': np.asarray(c['date_id'], dtype=np.int64),
+            'customer_id': codes_to_ids(customer, cust_dtype),
+            'employee_id': codes_to_ids(c['employee'], emp_dtype),
+            'store_id': codes_to_ids(c['store'], store_dtype),
+            'channel': pd.Categorical.from_codes(np.asarray(c['online'], dtype=np.int8), dtype=CHANNEL_DTYPE),
+        })
+        items = pd.DataFrame({
+            'order_id': i_order_id,
+            'product_id': pd.Categorical.from_codes(i_product, dtype=prod_dtype),
+            'promotion_id': codes_to_ids(c['i_promotion'], promo_dtype),
+            'so_luong': np.asarray(c['so_luong'], dtype=np.int64),
+            'don_gia': np.asarray(c['don_gia'], dtype=np.int64),
+            'khuyen_mai': np.asarray(c['khuyen_mai'], dtype=np.float64),
+            'chiet_khau': np.asarray(c['chiet_khau'], dtype=np.float64),
+            'doanh_thu': np.asarray(c['doanh_thu'], dtype=np.float64),
+            'gia_von': gia_von,
+        })
+        if item_dates:
+            items.insert(1, 'date_id', i_date)
+        return orders, items
+
+    cycle = [0] * len(months)  # behaviour path: orders of each month so far
+    sizer = None
+    t_chunk = time.perf_counter()
+    c = new_chunk()
+    for oid in range(first_oid, first_oid + n_orders):
+        dkey = date_keys[date_sampler.next()] if date_sampler else random.choice(date_keys)
+        # Customers come from the month's active set (assigned per chunk in to_frames)
+        mi = dkey_to_mpos.get(dkey, -1)
+        traits = None
+        if month_traits and mi >= 0 and active_sizes[mi]:
+            # Modelled customers: the order's traits depend on its position in the set
+            traits = month_traits[mi]
+            idx = cycle[mi] % active_sizes[mi]
+            cycle[mi] += 1
+            c['customer'].append(traits['customer'][idx])
+        elif month_traits:
+            c['customer'].append(-1)
+        # Pick channel (the customer's own preference when modelled)
+        online = random.random() < (traits['p_online'][idx] if traits else 0.35)
         # Select store per channel
-        if channel == 'Online' and online_ids:
-            store_id = random.choice(online_ids)
-            emp = None  # marketplace orders typically no in-store employee
+        if online and online_ids:
+            store = random.choice(online_ids)
+            emp = -1  # marketplace orders typically no in-store employee
         else:
             if offline_ids:
-                if offline_probs is not None:
+                home = traits['home_store'][idx] if traits else -1
+                if home >= 0 and random.random() < behaviour.home_store_share:
+                    store = home
+                elif offline_probs is not None:
                     # weighted choice
-                    store_id = random.choices(offline_ids, weights=offline_probs, k=1)[0]
+                    store = random.choices(offline_ids, weights=offline_probs, k=1)[0]
                 else:
-                    store_id = random.choice(offline_ids)
+                    store = random.choice(offline_ids)
             else:
-                store_id = None
-            emp = emp_df.sample(1).iloc[0] if not emp_df.empty else None
-        # Choose customer based on month activity
-        month = dkey_to_month.get(dkey)
-        cust = None
-        if month is not None and month_active_map.get(month):
-            idx = month_cycle_idx[month]
-            cust_id = month_active_map[month][idx]
-            month_cycle_idx[month] = (idx + 1) % len(month_active_map[month])
-            # Construct a minimal Series-like for consistency
-            cust = pd.Series({'customer_id': cust_id})
-        headers.append({
-            'order_id': oid,
-            'date_id': dkey,
-            'customer_id': (cust['customer_id'] if cust is not None else None),
-            'employee_id': (emp['employee_id'] if emp is not None else None),
-            'store_id': store_id,
-            'channel': channel,
-        })
-        # Items 1-5 unique products
-        item_count = random.randint(1, 5)
-        prods = prod_df.sample(item_count, replace=False).itertuples(index=False)
+                store = -1
+            # An employee of the serving store (any employee when it has no staff)
+            emp = staff.pick(store)
+        c['order_id'].append(oid)
+        c['date_id'].append(dkey)
+        c['month'].append(mi)
+        c['employee'].append(emp)
+        c['store'].append(store)
+        c['online'].append(1 if online else 0)
+        # Items 1-5 unique products (1..max_items for modelled customers)
+        item_count = min(random.randint(1, traits['max_items'][idx] if traits else 5), n_prod)
+        prods = prod_sampler.distinct(item_count) if prod_sampler else random.sample(range(n_prod), item_count)
+        if traits:
+            pref = traits['pref_category'][idx]
+            if pref >= 0 and cat_products[pref] and random.random() < behaviour.category_affinity:
+                p = random.choice(cat_products[pref])
+                if p not in prods:
+                    prods[0] = p
         p_opts = promo_by_date.get(dkey, [])
-        promo_row = random.choice(p_opts) if p_opts and random.random() < 0.35 else None
+        promo = random.choice(p_opts) if p_opts and random.random() < 0.35 else None
+        promo_row = promo[1] if promo is not None else None
         for prod in prods:
-            price = weighted_price(float(prod.gia_niem_yet))
+            price = weighted_price(list_prices[prod])
             qty = random.choices([1,2,3,4,5,6], weights=[45,25,15,8,5,2])[0]
             km_unit, ck_unit = compute_item_discounts(price, qty, promo_row)
             line_rev = max((price - km_unit - ck_unit) * qty, 0.0)
-            items.append({
-                'order_id': oid,
-                'product_id': prod.product_id,
-                'promotion_id': (promo_row['promotion_id'] if promo_row is not None else None),
-                'so_luong': qty,
-                'don_gia': price,
-                'khuyen_mai': km_unit,
-                'chiet_khau': ck_unit,
-                'doanh_thu': round(line_rev, 0)
-            })
-    return pd.DataFrame(headers), pd.DataFrame(items)
-
-
-def create_schema(conn):
+            c['i_order_id'].append(oid)
+            c['i_product'].append(prod)
+            c['i_promotion'].append(promo[0] if promo is not None else -1)
+            c['so_luong'].append(qty)
+            c['don_gia'].append(price)
+            c['khuyen_mai'].append(km_unit)
+            c['chiet_khau'].append(ck_unit)
+            c['doanh_thu'].append(round(line_rev, 0))
+        limit = sizer.rows if sizer is not None else (SAMPLE_ROWS if budget is not None else chunk_size)
+        if len(c['order_id']) >= limit:
+            orders_chunk, items_chunk = to_frames(c)
+            if budget is not None and sizer is None:
+                chunk_bytes = list_bytes(c.values()) + frame_bytes(orders_chunk) + frame_bytes(items_chunk)
+                sizer = budget.sizer('generate:orders', chunk_bytes / len(c['order_id']), copies=chunk_copies)
+            yield orders_chunk, items_chunk
+            if sizer is not None:
+                sizer.observe(len(c['order_id']), time.perf_counter() - t_chunk)
+                t_chunk = time.perf_counter()
+            c = new_chunk()
+    if c['order_id']:
+        yield to_frames(c)
+
+
+def create_schema(conn, partition_by: Optional[str] = None):
+    """Apply schema.sql; with partition_by ('month'/'year') the fact tables are then
+    recreated as partitioned parents (partitions come from create_fact_partitions)."""
     from pathlib import Path
+    from partitions import create_partitioned_tables, drop_detached
+    dropped = drop_detached(conn)
+    if dropped:
+        print(f"Xoá {len(dropped)} phân vùng đã tách (detached) còn sót: {', '.join(dropped)}")
     schema_path = Path(__file__).with_name('schema.sql')
     sql = schema_path.read_text(encoding='utf-8')
     run_sql(conn, sql)
+    if partition_by:
+        create_partitioned_tables(conn)
+
+
+def create_fact_partitions(conn, date_df: pd.DataFrame, partition_by: str) -> List[Any]:
+    """One partition per month/year of the date dimension for every fact table."""
+    from partitions import create_partitions, partition_ranges
+    ranges = partition_ranges(date_df['date_id'].tolist(), partition_by)
+    create_partitions(conn, ranges)
+    return ranges
 
 
 def truncate_tables(conn):
@@ -735,7 +902,95 @@ def truncate_tables(conn):
     run_sql(conn, "TRUNCATE TABLE dates RESTART IDENTITY CASCADE;")
 
 
-def insert_dim(conn, table: str, df: pd.DataFrame, add_serial_key: bool = False):
+# Insert column lists per table (generated/serial columns excluded)
+TABLE_COLUMNS = {
+    'dates': ['date_id','full_date','day','week','month','month_name_vi','quarter','year','is_weekend'],
+    'stores': ['id','ten_cua_hang','dia_chi','thanh_pho','tinh_thanh','mien'],
+    'employees': ['id','ho_ten','chuc_danh','cua_hang_mac_dinh'],
+    'customers': ['id','ho_ten','gioi_tinh','ngay_sinh','so_dien_thoai','email','dia_chi','thanh_pho','tinh_thanh','point','tier'],
+    'customer_child': ['customer_id','ho_ten','gioi_tinh','ngay_sinh'],
+    'products': ['id','ten_san_pham','danh_muc','thuong_hieu','don_vi','gia_niem_yet'],
+    'product_daily_costs': ['product_id','date_id','cost'],
+    'promotions': ['id','ten_chuong_trinh','loai','gia_tri','start_date','end_date'],
+    'orders': ['order_id','date_id','customer_id','employee_id','store_id','channel'],
+    'order_items': ['order_id','product_id','promotion_id','so_luong','don_gia','khuyen_mai','chiet_khau','doanh_thu','gia_von'],
+    'KPI_Target_Monthly': ['store_id','year_month','doanh_thu','so_luong_don_hang','so_luong_san_pham'],
+}
+
+
+
+def insert_columns(table: str, partitioned: bool = False) -> List[str]:
+    """TABLE_COLUMNS[table]; in the partitioned schema order_items also carries date_id."""
+    cols = TABLE_COLUMNS[table]
+    if partitioned and table == 'order_items':
+        return cols[:1] + ['date_id'] + cols[1:]
+    return cols
+
+
+# FK-safe order for single-connection loading
+LOAD_ORDER = [
+    'dates', 'stores', 'employees', 'customers', 'customer_child', 'products',
+    'product_daily_costs', 'promotions', 'orders', 'order_items',
+]
+
+
+# Fact tables switched to UNLOGGED during --fast-load. Order matters for FKs:
+# order_items must be unlogged before orders, and orders logged before order_items.
+FAST_LOAD_FACT_TABLES = ['order_items', 'product_daily_costs', 'orders']
+FAST_LOAD_PAGE_SIZE = 50_000
+
+
+def fast_load_tables(conn, partitioned: bool = False) -> List[str]:
+    """Relations to switch to UNLOGGED. A partitioned parent has no storage, so its
+    partitions are switched instead; orders partitions stay logged because Postgres
+    refuses to unlog a table referenced by a logged (partitioned) table."""
+    if not partitioned:
+        return FAST_LOAD_FACT_TABLES
+    from partitions import leaf_partitions
+    return [p for t in FAST_LOAD_FACT_TABLES if t != 'orders' for p in leaf_partitions(conn, t)]
+
+
+def begin_fast_load(conn, cfg: Config):
+    """Session/table settings for bulk loading regenerable data (no WAL for facts, async commit)."""
+    run_sql(conn, "SET synchronous_commit = off")
+    run_sql(conn, f"SET maintenance_work_mem = '{cfg.maintenance_work_mem}'")
+    for t in fast_load_tables(conn, cfg.partition_by is not None):
+        run_sql(conn, f"ALTER TABLE {t} SET UNLOGGED")
+
+
+def finish_fast_load(conn, cfg: Config, rec: StageRecorder):
+    """Switch fact tables back to LOGGED (unless keep_unlogged) and refresh planner stats."""
+    if not cfg.keep_unlogged:
+        for t in reversed(fast_load_tables(conn, cfg.partition_by is not None)):
+            with rec.stage(f'set_logged:{t}'):
+                run_sql(conn, f"ALTER TABLE {t} SET LOGGED")
+    with rec.stage('analyze'):
+        run_sql(conn, "ANALYZE")
+
+
+def report_fast_load_savings(rec: StageRecorder, baseline_path: str):
+    """Compare per-table insert times against the metrics JSON of a normal (non fast-load) run."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    base_wall = {m['name']: m['wall_s'] for m in baseline.get('stages', [])}
+    overhead = sum(m.wall_s for m in rec.stages if m.name.startswith('set_logged:') or m.name == 'analyze')
+    print("Thời gian tiết kiệm khi dùng --fast-load (so với baseline):")
+    print(f"{'stage':<32} {'baseline_s':>11} {'fast_s':>9} {'saved_s':>9}")
+    total_saved = 0.0
+    for m in rec.stages:
+        if not m.name.startswith('insert') or m.name not in base_wall:
+            continue
+        saved = base_wall[m.name] - m.wall_s
+        total_saved += saved
+        print(f"{m.name:<32} {base_wall[m.name]:11.3f} {m.wall_s:9.3f} {saved:9.3f}")
+    print(f"{'set_logged + analyze':<32} {'':>11} {overhead:9.3f} {-overhead:9.3f}")
+    print(f"{'total':<32} {'':>11} {'':>9} {total_saved - overhead:9.3f}")
+
+
+def insert_dim(conn, table: str, df: pd.DataFrame, add_serial_key: bool = False, page_size: Optional[int] = None,
+               budget: Optional[MemoryBudget] = None):
+    """Insert a dimension-style table. With page_size, rows are sent in multi-row batches;
+    with a budget, in budget-sized slices (see memory.insert_batches)."""
     def pyify(x: Any) -> Any:
         if pd.isna(x):
             return None
@@ -750,13 +1005,30 @@ def insert_dim(conn, table: str, df: pd.DataFrame, add_serial_key: bool = False)
     cols = list(df.columns)
     placeholders = ','.join(['%s']*len(cols))
     colnames = ','.join(cols)
-    values = [tuple(pyify(x) for x in row) for row in df.itertuples(index=False, name=None)]
     with conn.cursor() as cur:
-        cur.executemany(f"INSERT INTO {table} ({colnames}) VALUES ({placeholders})", values)
+        for part, page in insert_batches(df, f'insert:{table}', budget, page_size):
+            values = [tuple(pyify(x) for x in row) for row in part.itertuples(index=False, name=None)]
+            if page:
+                execute_values(cur, f"INSERT INTO {table} ({colnames}) VALUES %s", values, page_size=page)
+            else:
+                cur.executemany(f"INSERT INTO {table} ({colnames}) VALUES ({placeholders})", values)
     conn.commit()
 
 
-def insert_orders(conn, df: pd.DataFrame):
+def copy_frame(conn, table: str, df: pd.DataFrame, commit: bool = True):
+    """COPY a DataFrame into `table` (CSV; empty unquoted fields load as NULL), committing by default."""
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    cols = ','.join(df.columns)
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY {table} ({cols}) FROM STDIN WITH (FORMAT CSV)", buf)
+    if commit:
+        conn.commit()
+
+
+def insert_orders(conn, df: pd.DataFrame, page_size: int = 5000, budget: Optional[MemoryBudget] = None,
+                  commit: bool = True):
     def pyify(x: Any) -> Any:
         if x is None:
             return None
@@ -776,16 +1048,19 @@ def insert_orders(conn, df: pd.DataFrame):
 
     cols = list(df.columns)
     colnames = ','.join(cols)
-    values = [tuple(pyify(x) for x in row) for row in df.itertuples(index=False, name=None)]
     with conn.cursor() as cur:
-        execute_values(cur,
-                       f"INSERT INTO orders ({colnames}) VALUES %s",
-                       values,
-                       page_size=5000)
-    conn.commit()
+        for part, page in insert_batches(df, 'insert:orders', budget, page_size):
+            values = [tuple(pyify(x) for x in row) for row in part.itertuples(index=False, name=None)]
+            execute_values(cur,
+                           f"INSERT INTO orders ({colnames}) VALUES %s",
+                           values,
+                           page_size=page)
+    if commit:
+        conn.commit()
 
 
-def insert_order_items(conn, df: pd.DataFrame):
+def insert_order_items(conn, df: pd.DataFrame, page_size: int = 5000, budget: Optional[MemoryBudget] = None,
+                       commit: bool = True):
     def pyify(x: Any) -> Any:
         if x is None:
             return None
@@ -804,16 +1079,179 @@ def insert_order_items(conn, df: pd.DataFrame):
 
     cols = list(df.columns)
     colnames = ','.join(cols)
-    values = [tuple(pyify(x) for x in row) for row in df.itertuples(index=False, name=None)]
     with conn.cursor() as cur:
-        execute_values(cur,
-                       f"INSERT INTO order_items ({colnames}) VALUES %s",
-                       values,
-                       page_size=5000)
-    conn.commit()
+        for part, page in insert_batches(df, 'insert:order_items', budget, page_size):
+            values = [tuple(pyify(x) for x in row) for row in part.itertuples(index=False, name=None)]
+            execute_values(cur,
+                           f"INSERT INTO order_items ({colnames}) VALUES %s",
+                           values,
+                           page_size=page)
+    if commit:
+        conn.commit()
+
+
+def load_tables_sequential(conn, frames: Dict[str, Any], rec: StageRecorder, fast_load: bool = False,
+                           budget: Optional[MemoryBudget] = None, checkpoint: Optional[LoadCheckpoint] = None):
+    """Insert table frames one after another on a single connection (FK-safe LOAD_ORDER).
+    With a checkpoint, every finished table is recorded, and facts are committed in
+    order_id slices recorded as chunks (see checkpoint.py)."""
+    dim_page_size = FAST_LOAD_PAGE_SIZE if fast_load else None
+    fact_page_size = FAST_LOAD_PAGE_SIZE if fast_load else 5000
+    for table in LOAD_ORDER:
+        df = frames.get(table)
+        if df is None or df.empty:
+            continue
+        print(f"Chèn {table}…")
+        if table in ('orders', 'order_items'):
+            insert = insert_orders if table == 'orders' else insert_order_items
+            with rec.stage(f'insert_{table}', rows=len(df)):
+                if checkpoint is None:
+                    insert(conn, df, page_size=fact_page_size, budget=budget)
+                else:
+                    for part in order_slices(df):
+                        insert(conn, part, page_size=fact_page_size, budget=budget, commit=False)
+                        checkpoint.chunk_done(conn, table, int(part['order_id'].iloc[0]),
+                                              int(part['order_id'].iloc[-1]), len(part))
+                        conn.commit()
+        elif isinstance(df, CostMatrix):
+            # Streamed one block of days at a time
+            with rec.stage(f'insert_dim:{table}', rows=len(df)):
+                for block in df.iter_frames():
+                    insert_dim(conn, table, block, page_size=dim_page_size, budget=budget)
+        else:
+            with rec.stage(f'insert_dim:{table}', rows=len(df)):
+                insert_dim(conn, table, df, page_size=dim_page_size, budget=budget)
+        if checkpoint is not None:
+            checkpoint.table_done(conn, table, len(df))
+
+
+def monthly_store_aggregates(orders_df: pd.DataFrame, items_df: pd.DataFrame) -> pd.DataFrame:
+    """Revenue, order count and quantity per (store_id, year_month).
+    Aggregates of disjoint order chunks can be combined with combine_monthly_aggregates()."""
+    # Join items with orders to get date_id and store_id
+    items_join = items_df.drop(columns=['date_id'], errors='ignore').merge(
+        orders_df[['order_id','date_id','store_id']], on='order_id', how='left')
+    items_join['year_month'] = items_join['date_id'].astype(str).str.slice(0, 6).astype(int)
+    return items_join.groupby(['store_id','year_month'], observed=True).agg(
+        doanh_thu=('doanh_thu','sum'),
+        so_luong_don_hang=('order_id','nunique'),
+        so_luong_san_pham=('so_luong','sum')
+    ).reset_index()
+
+
+def combine_monthly_aggregates(parts: List[pd.DataFrame]) -> pd.DataFrame:
+    """Sum partial monthly aggregates (each order belongs to exactly one part)."""
+    if not parts:
+        return pd.DataFrame(columns=['store_id','year_month','doanh_thu','so_luong_don_hang','so_luong_san_pham'])
+    return pd.concat(parts, ignore_index=True).groupby(['store_id','year_month'], as_index=False, observed=True).sum()
+
+
+def build_kpi_targets(orders_df: pd.DataFrame, items_df: pd.DataFrame) -> pd.DataFrame:
+    """Build monthly KPI targets per store (non-decreasing month over month)."""
+    return kpi_targets_from_monthly(monthly_store_aggregates(orders_df, items_df))
+
+
+def kpi_targets_from_monthly(monthly: pd.DataFrame) -> pd.DataFrame:
+    """Turn per-store monthly aggregates into non-decreasing KPI targets."""
+    # Enforce non-decreasing targets month-over-month per store (running max)
+    monthly = monthly.sort_values(['store_id','year_month']).reset_index(drop=True)
+    by_store = monthly.groupby('store_id', observed=True)
+    return pd.DataFrame({
+        'store_id': monthly['store_id'],
+        'year_month': monthly['year_month'].astype(int),
+        'doanh_thu': by_store['doanh_thu'].cummax().astype(float).round(2),
+        'so_luong_don_hang': by_store['so_luong_don_hang'].cummax().astype(np.int64),
+        'so_luong_san_pham': by_store['so_luong_san_pham'].cummax().astype(np.int64),
+    })
+
+
+@dataclass
+class Dimensions:
+    date_df: pd.DataFrame
+    store_df: pd.DataFrame
+    emp_df: pd.DataFrame
+    cust_df: pd.DataFrame
+    prod_df: pd.DataFrame
+    promo_df: pd.DataFrame
+    child_df: pd.DataFrame
+    costs: CostMatrix  # product_daily_costs
+
+
+def build_dimensions(cfg: Config, rec: StageRecorder) -> Dimensions:
+    """Run every dimension builder (plus product daily costs), recording one stage per builder."""
+    as_of = date.fromisoformat(cfg.as_of) if cfg.as_of else None
+    with rec.stage('build_date_dim') as st:
+        date_df = build_date_dim(cfg.years, as_of)
+        st.rows = len(date_df)
+    with rec.stage('build_store_dim') as st:
+        store_df = build_store_dim(cfg.stores)
+        st.rows = len(store_df)
+    offline_ids = store_df.loc[store_df.get('store_type', 'Offline') == 'Offline', 'store_id'].dropna().tolist()
+    with rec.stage('build_employee_dim') as st:
+        emp_df = build_employee_dim(cfg.employees, offline_ids)
+        st.rows = len(emp_df)
+    with rec.stage('build_customer_dim') as st:
+        cust_df = build_customer_dim(cfg.customers)
+        st.rows = len(cust_df)
+    with rec.stage('build_product_dim') as st:
+        prod_df = build_product_dim(cfg.products)
+        st.rows = len(prod_df)
+    with rec.stage('build_promotion_dim') as st:
+        promo_df = build_promotion_dim(cfg.promotions, date_df)
+        st.rows = len(promo_df)
+    with rec.stage('build_customer_children') as st:
+        child_df = build_customer_children(cust_df, as_of)
+        st.rows = len(child_df)
+    with rec.stage('build_product_daily_costs') as st:
+        costs = build_cost_matrix(date_df, prod_df, np.random.default_rng(random.getrandbits(64)),
+                                  path=cfg.cost_matrix_path, dtype=cfg.cost_dtype)
+        st.rows = len(costs)
+    return Dimensions(date_df, store_df, emp_df, cust_df, prod_df, promo_df, child_df, costs)
+
+
+def size_cost_blocks(costs: CostMatrix, budget: MemoryBudget):
+    """Set the days per product_daily_costs block so a block fits the budget (sized on
+    the Python-tuple footprint, the largest form a loader or exporter holds)."""
+    sample = next(costs.iter_frames(block_days=1), None)
+    if sample is None:
+        return
+    sizer = budget.sizer('product_daily_costs', tuple_row_bytes(sample))
+    costs.block_days = max(1, sizer.rows // len(sample))
+
+
+def order_builder_args(cfg: Config, dims: Dimensions) -> Tuple[tuple, Dict[str, Any]]:
+    """Positional/keyword arguments shared by build_orders() and iter_order_chunks()."""
+    args = (cfg.min_rows, cfg.max_rows, dims.date_df, dims.cust_df, dims.prod_df,
+            dims.emp_df, dims.store_df, dims.promo_df)
+    return args, dict(monthly_active_min=cfg.monthly_active_min, monthly_active_max=cfg.monthly_active_max,
+                      demand=load_demand_model(cfg.demand_model),
+                      costs=dims.costs if cfg.cogs else None,
+                      behaviour=BehaviourModel() if cfg.customer_behaviour else None,
+                      child_df=dims.child_df if cfg.customer_behaviour else None,
+                      item_dates=cfg.partition_by is not None)
+
+
+def dimension_frames(dims: Dimensions) -> Dict[str, Any]:
+    """Dimension tables renamed/projected to their DB insert columns (TABLE_COLUMNS).
+    product_daily_costs stays a CostMatrix; consumers stream it with iter_frames()."""
+    def project(df: pd.DataFrame, table: str, rename: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        if df.empty:
+            return pd.DataFrame(columns=TABLE_COLUMNS[table])
+        return df.rename(columns=rename or {})[TABLE_COLUMNS[table]]
+    # stores table doesn't have store_type column; insert supported columns including 'mien'
+    return {
+        'dates': project(dims.date_df, 'dates'),
+        'stores': project(dims.store_df, 'stores', {'store_id': 'id'}),
+        'employees': project(dims.emp_df, 'employees', {'employee_id': 'id'}),
+        'customers': project(dims.cust_df, 'customers', {'customer_id': 'id'}),
+        'customer_child': project(dims.child_df, 'customer_child'),
+        'products': project(dims.prod_df, 'products', {'product_id': 'id'}),
+        'product_daily_costs': dims.costs,
+        'promotions': project(dims.promo_df, 'promotions', {'promotion_id': 'id'}),
+    }
 
 
-def generate_and_load(cfg: Config, dbc: DbConfig):
+def generate_and_load(cfg: Config, dbc: DbConfig, rec: Optional[StageRecorder] = None):
     # Detect export-only intent: all sizes/years/rows set to 0 and export folder specified
     export_only = (
         (cfg.customers == 0 and cfg.products == 0 and cfg.employees == 0 and cfg.stores == 0 and cfg.promotions == 0)
@@ -821,6 +1259,8 @@ def generate_and_load(cfg: Config, dbc: DbConfig):
         and (cfg.min_rows == 0 and cfg.max_rows == 0)
         and (cfg.db_export_dir is not None)
     )
+    rec = rec if rec is not None else StageRecorder(profile_dir=cfg.profile_dir)
+    budget = MemoryBudget.parse(cfg.memory_budget)
 
     print("[1/6] Đảm bảo database tồn tại…")
     ensure_database(dbc)
@@ -828,155 +1268,212 @@ def generate_and_load(cfg: Config, dbc: DbConfig):
     if export_only:
         # Do not touch schema or truncate; just export existing tables
         print("[2/2] Chế độ chỉ xuất CSV từ database hiện có…")
-        export_tables_to_csv(dbc, cfg.db_export_dir)
+        with rec.stage('export_tables_to_csv') as st:
+            st.rows = sum(export_tables_to_csv(dbc, cfg.db_export_dir, since=cfg.export_since,
+                                                   state_file=cfg.export_state_file, compress=cfg.compress,
+                                                   compress_threads=cfg.compress_threads, rec=rec).values())
         print("Xuất CSV hoàn tất.")
+        finish_metrics(rec, cfg)
         return
 
     with get_conn(dbc) as conn:
-        print("[2/6] Tạo schema…")
-        create_schema(conn)
-        print("[3/6] Làm sạch dữ liệu cũ…")
-        truncate_tables(conn)
+        if cfg.resume:
+            # Keep schema and committed rows; the RNGs replay the recorded seed (see checkpoint.py)
+            checkpoint = LoadCheckpoint.resume(conn, cfg)
+            print(f"[2/6] Tiếp tục lần nạp dở (seed {cfg.seed}, ngày {cfg.as_of}): {checkpoint.summary()}")
+            with rec.stage('discard_partial'):
+                checkpoint.discard_partial(conn, LOAD_ORDER)
+        else:
+            # State is reset before the schema is dropped, so a crash in between is never "resumed"
+            checkpoint = LoadCheckpoint.start(conn, cfg)
+            print("[2/6] Tạo schema…")
+            with rec.stage('create_schema'):
+                create_schema(conn, cfg.partition_by)
+            print("[3/6] Làm sạch dữ liệu cũ…")
+            with rec.stage('truncate_tables'):
+                truncate_tables(conn)
+        seed_everything(cfg.seed)
 
         print("[4/6] Tạo dữ liệu dimension…")
-        date_df = build_date_dim(cfg.years)
-        store_df = build_store_dim(cfg.stores)
-        offline_names = store_df.loc[store_df.get('store_type', 'Offline') == 'Offline', 'ten_cua_hang'].dropna().tolist()
-        emp_df = build_employee_dim(cfg.employees, offline_names)
-        cust_df = build_customer_dim(cfg.customers)
-        prod_df = build_product_dim(cfg.products)
-        promo_df = build_promotion_dim(cfg.promotions, date_df)
-        child_df = build_customer_children(cust_df)
-
-        print("Chèn dates…")
-        insert_dim(conn, 'dates', date_df[['date_id','full_date','day','week','month','month_name_vi','quarter','year','is_weekend']])
-        print("Chèn stores…")
-        df_store = store_df.rename(columns={'store_id':'id'})
-        # stores table doesn't have store_type column; insert supported columns including 'mien'
-        insert_dim(conn, 'stores', df_store[['id','ten_cua_hang','dia_chi','thanh_pho','tinh_thanh','mien']])
-        print("Chèn employees…")
-        df_emp = emp_df.rename(columns={'employee_id':'id'})
-        insert_dim(conn, 'employees', df_emp[['id','ho_ten','chuc_danh','cua_hang_mac_dinh']])
-        print("Chèn customers…")
-        df_cust = cust_df.rename(columns={'customer_id':'id'})
-        insert_dim(conn, 'customers', df_cust[['id','ho_ten','gioi_tinh','ngay_sinh','so_dien_thoai','email','dia_chi','thanh_pho','tinh_thanh','point','tier']])
-        if not child_df.empty:
-            print("Chèn customer_child…")
-            insert_dim(conn, 'customer_child', child_df[['customer_id','ho_ten','gioi_tinh','ngay_sinh']])
-        print("Chèn products…")
-        df_prod = prod_df.rename(columns={'product_id':'id'})
-        insert_dim(conn, 'products', df_prod[['id','ten_san_pham','danh_muc','thuong_hieu','don_vi','gia_niem_yet']])
-        # Build and insert product daily costs
-        print("Chèn product_daily_costs…")
-        pdc_df = build_product_daily_costs(date_df, prod_df)
-        if not pdc_df.empty:
-            insert_dim(conn, 'product_daily_costs', pdc_df[['product_id','date_id','cost']])
-        print("Chèn promotions…")
-        df_promo = promo_df.rename(columns={'promotion_id':'id'})
-        insert_dim(conn, 'promotions', df_promo[['id','ten_chuong_trinh','loai','gia_tri','start_date','end_date']])
-
-        print("[5/6] Tạo dữ liệu orders + order_items…")
-        orders_df, items_df = build_orders(
-            cfg.min_rows,
-            cfg.max_rows,
-            date_df,
-            cust_df,
-            prod_df,
-            emp_df,
-            store_df,
-            promo_df,
-            monthly_active_min=cfg.monthly_active_min,
-            monthly_active_max=cfg.monthly_active_max,
-        )
+        dims = build_dimensions(cfg, rec)
+        if budget is not None:
+            size_cost_blocks(dims.costs, budget)
+        partitions = None
+        if cfg.partition_by:
+            with rec.stage('create_partitions') as st:
+                partitions = create_fact_partitions(conn, dims.date_df, cfg.partition_by)
+                st.rows = len(partitions)
+            print(f"Tạo {len(partitions)} phân vùng theo {cfg.partition_by} cho orders, order_items, product_daily_costs")
+        if cfg.fast_load:
+            print("Bật chế độ nạp nhanh (synchronous_commit=off, bảng fact UNLOGGED)…")
+            begin_fast_load(conn, cfg)
+        order_args, order_kwargs = order_builder_args(cfg, dims)
+        if cfg.pipeline:
+            # Orders are generated while loading (see pipeline.py)
+            orders_df, items_df = pd.DataFrame(), pd.DataFrame()
+        else:
+            print("[5/6] Tạo dữ liệu orders + order_items…")
+            with rec.stage('build_orders') as st:
+                orders_df, items_df = build_orders(*order_args, **order_kwargs)
+                st.rows = len(orders_df) + len(items_df)
+
+        frames = dimension_frames(dims)
 
         # Optional CSV export
         if cfg.export_csv_dir:
-            os.makedirs(cfg.export_csv_dir, exist_ok=True)
-            date_df.to_csv(os.path.join(cfg.export_csv_dir, 'dates.csv'), index=False)
-            df_store.to_csv(os.path.join(cfg.export_csv_dir, 'stores.csv'), index=False)
-            df_emp.to_csv(os.path.join(cfg.export_csv_dir, 'employees.csv'), index=False)
-            df_cust.to_csv(os.path.join(cfg.export_csv_dir, 'customers.csv'), index=False)
-            if not child_df.empty:
-                child_df.to_csv(os.path.join(cfg.export_csv_dir, 'customer_child.csv'), index=False)
-            df_prod.to_csv(os.path.join(cfg.export_csv_dir, 'products.csv'), index=False)
-            if not pdc_df.empty:
-                pdc_df.to_csv(os.path.join(cfg.export_csv_dir, 'product_daily_costs.csv'), index=False)
-            df_promo.to_csv(os.path.join(cfg.export_csv_dir, 'promotions.csv'), index=False)
-            orders_df.to_csv(os.path.join(cfg.export_csv_dir, 'orders.csv'), index=False)
-            items_df.to_csv(os.path.join(cfg.export_csv_dir, 'order_items.csv'), index=False)
-
-        print("[6/6] Chèn orders…")
-        insert_orders(conn, orders_df[['order_id','date_id','customer_id','employee_id','store_id','channel']])
-        print("Chèn order_items…")
-        insert_order_items(conn, items_df[['order_id','product_id','promotion_id','so_luong','don_gia','khuyen_mai','chiet_khau','doanh_thu']])
+            with rec.stage('export_csv'):
+                os.makedirs(cfg.export_csv_dir, exist_ok=True)
+                exports = [('dates', dims.date_df)]
+                for table in ['stores', 'employees', 'customers', 'customer_child', 'products', 'product_daily_costs', 'promotions']:
+                    if not frames[table].empty:
+                        exports.append((table, frames[table]))
+                if not cfg.pipeline:
+                    exports += [('orders', orders_df), ('order_items', items_df)]
+                for table, df in exports:
+                    out = ExportFile(os.path.join(cfg.export_csv_dir, f'{table}.csv'), cfg.compress,
+                                     threads=cfg.compress_threads)
+                    with rec.stage(f'export_csv:{table}', rows=len(df)), out as f:
+                        blocks = df.iter_frames() if isinstance(df, CostMatrix) else [df]
+                        for i, block in enumerate(blocks):
+                            block.to_csv(f, index=False, header=i == 0)
+                    if cfg.compress:
+                        print('  ' + out.stats.report(f"{table} ({cfg.compress})"))
+
+        if not cfg.pipeline:
+            frames['orders'] = orders_df[TABLE_COLUMNS['orders']]
+            frames['order_items'] = items_df[insert_columns('order_items', partitions is not None)]
+        frames = checkpoint.pending_frames(frames)
+        if cfg.pipeline:
+            # Orders are generated after the dimensions are loaded, so the two steps swap places
+            print("[5/6] Chèn dữ liệu dimension vào Postgres…")
+        else:
+            print("[6/6] Chèn dữ liệu vào Postgres…")
+        if cfg.load_workers > 1:
+            from parallel_load import load_tables_parallel
+            with rec.stage('load_tables_parallel', rows=sum(len(df) for df in frames.values())):
+                load_tables_parallel(dbc, frames, cfg.load_workers, rec, fast_load=cfg.fast_load,
+                                     partitions=partitions, budget=budget, checkpoint=checkpoint)
+        else:
+            load_tables_sequential(conn, frames, rec, fast_load=cfg.fast_load, budget=budget,
+                                   checkpoint=checkpoint)
+        monthly_df = None
+        if cfg.pipeline:
+            from pipeline import run_order_pipeline
+            print("[6/6] Tạo và nạp orders + order_items song song (pipeline)…")
+            # Chunks alive at once: queued, one per loader and the one being generated
+            chunks = iter_order_chunks(*order_args, **order_kwargs, chunk_size=cfg.chunk_size, budget=budget,
+                                       chunk_copies=cfg.queue_size + max(1, cfg.load_workers) + 1)
+            monthly_df = run_order_pipeline(
+                dbc, chunks, rec,
+                workers=cfg.load_workers, queue_size=cfg.queue_size,
+                fast_load=cfg.fast_load, export_csv_dir=cfg.export_csv_dir,
+                compress=cfg.compress, compress_threads=cfg.compress_threads,
+                partitioned=partitions is not None, checkpoint=checkpoint,
+            )
         print("Hoàn tất!")
 
         # Build Monthly KPI targets per store (non-decreasing month over month)
-        # Join items with orders to get date_id and store_id
-        items_join = items_df.merge(orders_df[['order_id','date_id','store_id']], on='order_id', how='left')
-        items_join['year_month'] = items_join['date_id'].astype(str).str.slice(0, 6).astype(int)
-        monthly = items_join.groupby(['store_id','year_month']).agg(
-            doanh_thu=('doanh_thu','sum'),
-            so_luong_don_hang=('order_id','nunique'),
-            so_luong_san_pham=('so_luong','sum')
-        ).reset_index()
-        # Enforce non-decreasing targets month-over-month per store
-        monthly.sort_values(['store_id','year_month'], inplace=True)
-        def monotonic_targets(df_store: pd.DataFrame) -> pd.DataFrame:
-            max_rev = 0.0
-            max_orders = 0
-            max_qty = 0
-            rows = []
-            for _, r in df_store.iterrows():
-                max_rev = max(max_rev, float(r['doanh_thu']))
-                max_orders = max(max_orders, int(r['so_luong_don_hang']))
-                max_qty = max(max_qty, int(r['so_luong_san_pham']))
-                rows.append({
-                    'store_id': r['store_id'],
-                    'year_month': int(r['year_month']),
-                    'doanh_thu': round(max_rev, 2),
-                    'so_luong_don_hang': max_orders,
-                    'so_luong_san_pham': max_qty,
-                })
-            return pd.DataFrame(rows)
-        target_df = (
-            monthly.groupby('store_id', group_keys=False)
-            .apply(monotonic_targets)
-            .reset_index(drop=True)
-        )
+        with rec.stage('build_kpi_targets') as st:
+            if monthly_df is not None:
+                target_df = kpi_targets_from_monthly(monthly_df)
+            else:
+                target_df = build_kpi_targets(orders_df, items_df)
+            st.rows = len(target_df)
         # Clean and insert
         run_sql(conn, "TRUNCATE TABLE KPI_Target_Monthly RESTART IDENTITY CASCADE;")
-        insert_dim(conn, 'KPI_Target_Monthly', target_df[['store_id','year_month','doanh_thu','so_luong_don_hang','so_luong_san_pham']])
+        with rec.stage('insert_dim:KPI_Target_Monthly', rows=len(target_df)):
+            insert_dim(conn, 'KPI_Target_Monthly', target_df[TABLE_COLUMNS['KPI_Target_Monthly']],
+                       page_size=FAST_LOAD_PAGE_SIZE if cfg.fast_load else None, budget=budget)
+        if cfg.fast_load:
+            finish_fast_load(conn, cfg, rec)
+        checkpoint.finish(conn)
 
         # Optional: export DB tables to CSV with UTF-8 BOM (friendly for Vietnamese in Excel)
         if cfg.db_export_dir:
-            export_tables_to_csv(dbc, cfg.db_export_dir)
-
-
-def export_tables_to_csv(dbc: DbConfig, out_dir: str, tables: Optional[List[str]] = None):
-    """Export selected DB tables to CSV using PostgreSQL COPY.
-    Files are written with UTF-8 BOM (utf-8-sig) to support Vietnamese in Excel.
-    """
-    os.makedirs(out_dir, exist_ok=True)
-    if tables is None:
-        tables = [
-            'dates', 'customers', 'customer_child', 'products',
-            'employees', 'stores', 'promotions', 'product_daily_costs', 'orders',
-            'order_items', 'KPI_Target_Monthly'
-        ]
-    with get_conn(dbc) as conn:
-        with conn.cursor() as cur:
-            for t in tables:
-                target = os.path.join(out_dir, f"{t}.csv")
-                # Open with utf-8-sig to emit BOM; COPY writes text rows to this handle
-                with open(target, 'w', encoding='utf-8-sig', newline='') as f:
-                    sql = f"COPY {t} TO STDOUT WITH (FORMAT CSV, HEADER TRUE)"
-                    try:
-                        cur.copy_expert(sql, f)
-                        print(f"Đã xuất {t} -> {target}")
-                    except Exception as e:
-                        # Skip tables that might not exist or other copy errors
-                        print(f"Bỏ qua bảng {t}: {e}")
+            with rec.stage('export_tables_to_csv') as st:
+                st.rows = sum(export_tables_to_csv(dbc, cfg.db_export_dir, since=cfg.export_since,
+                                                   state_file=cfg.export_state_file, compress=cfg.compress,
+                                                   compress_threads=cfg.compress_threads, rec=rec).values())
+
+    if budget is not None:
+        budget.print_report()
+    finish_metrics(rec, cfg)
+    if cfg.fast_load and cfg.fast_load_baseline:
+        report_fast_load_savings(rec, cfg.fast_load_baseline)
+
+
+def submit_dimensions(writer, dims: Dimensions, budget: Optional[MemoryBudget] = None):
+    """Queue every dimension table on a sinks.BackgroundWriter (sliced to the budget)."""
+    if budget is not None:
+        size_cost_blocks(dims.costs, budget)
+    for table, df in dimension_frames(dims).items():
+        if isinstance(df, CostMatrix):
+            for block in df.iter_frames():
+                writer.submit(table, block)
+        elif not df.empty:
+            sizer = budget.sizer(f'write:{table}', frame_bytes(df) / len(df)) if budget is not None else None
+            for part in sized_slices(df, sizer):
+                writer.submit(table, part)
+
+
+def generate_to_files(cfg: Config, rec: Optional[StageRecorder] = None) -> bool:
+    """Generate the dataset without Postgres (--no-db): CSV/Parquet files or an embedded
+    SQLite/DuckDB database (--format). Facts are streamed chunk by chunk to a background
+    writer; files match the DB export layout. Returns False when a post-load check fails."""
+    from sinks import BackgroundWriter, DatabaseSink, open_sink
+    rec = rec if rec is not None else StageRecorder(profile_dir=cfg.profile_dir)
+    budget = MemoryBudget.parse(cfg.memory_budget)
+    if cfg.seed is not None:
+        seed_everything(cfg.seed)
+    out_dir = cfg.output_dir or cfg.export_csv_dir
+    if not out_dir:
+        raise ValueError("Cần --out-dir khi dùng --no-db")
+    sink = open_sink(cfg.output_format, out_dir, cfg.compress, cfg.compress_threads)
+    writer = BackgroundWriter(sink, max_pending=cfg.queue_size)
+    try:
+        print("[1/3] Tạo dữ liệu dimension…")
+        dims = build_dimensions(cfg, rec)
+        submit_dimensions(writer, dims, budget)
+
+        print("[2/3] Tạo dữ liệu orders + order_items…")
+        order_args, order_kwargs = order_builder_args(cfg, dims)
+        partials = []
+        with rec.stage('generate_orders') as st:
+            st.rows = 0
+            # Chunks alive at once: the writer queue holds orders and items separately
+            chunks = iter_order_chunks(*order_args, **order_kwargs, chunk_size=cfg.chunk_size, budget=budget,
+                                       chunk_copies=cfg.queue_size // 2 + 2)
+            for orders_df, items_df in chunks:
+                partials.append(monthly_store_aggregates(orders_df, items_df))
+                writer.submit('orders', orders_df[TABLE_COLUMNS['orders']])
+                writer.submit('order_items', items_df[TABLE_COLUMNS['order_items']])
+                st.rows += len(orders_df) + len(items_df)
+
+        print("[3/3] Tính KPI theo tháng…")
+        with rec.stage('build_kpi_targets') as st:
+            target_df = kpi_targets_from_monthly(combine_monthly_aggregates(partials))
+            st.rows = len(target_df)
+        writer.submit('KPI_Target_Monthly', target_df[TABLE_COLUMNS['KPI_Target_Monthly']])
+    finally:
+        with rec.stage('flush_files') as st:
+            st.rows = sum(writer.close().values())
+    problems = []
+    if isinstance(sink, DatabaseSink):
+        # SQLite/DuckDB have no PL/pgSQL: the schema.sql triggers and foreign keys are checked here
+        with rec.stage('post_load_checks'):
+            problems = sink.check()
+    print("Hoàn tất!" if not problems else f"Dữ liệu vi phạm {len(problems)} ràng buộc của schema.sql.")
+    if budget is not None:
+        budget.print_report()
+    finish_metrics(rec, cfg)
+    return not problems
+
+
+def finish_metrics(rec: StageRecorder, cfg: Config):
+    """Print the per-stage summary and optionally persist it as JSON."""
+    rec.print_summary()
+    if cfg.metrics_json:
+        rec.write_json(cfg.metrics_json, extra={'config': asdict(cfg)})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,279 @@
+"""Lightweight per-stage instrumentation for the generator pipeline.
+
+Each stage records wall time, CPU time (of its own thread and of the whole
+process), the growth of the process peak RSS while the stage ran and
+(optionally) the number of rows it produced or loaded. A summary table is
+printed at the end of a run and the metrics can be written as JSON to track
+regressions across releases.
+
+With a profile directory (--profile), each stage also runs under cProfile on
+the thread that entered it and writes <nn>-<stage>.pstats, while a sampling
+thread records the stage's call stacks every few milliseconds into
+stacks.collapsed ("stage;caller;...;leaf count" lines, the input format of
+flamegraph.pl, speedscope and inferno). A stage nested in another one on the
+same thread pauses the outer profile, so every profile covers its own stage
+only. cProfile cannot always start: another profiler may be active, and on
+Python 3.12+ only one cProfile runs per process, so stages running on other
+threads at the same time (--load-workers, --pipeline) are refused. Such a
+stage is reported and keeps its sampled stacks, without a .pstats file.
+"""
+import cProfile
+import itertools
+import json
+import os
+import platform
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource  # Unix only
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+try:
+    import psutil  # optional, used when `resource` is unavailable
+except ImportError:  # pragma: no cover
+    psutil = None
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Return the peak resident set size of this process in MB (None if unknown)."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS reports bytes
+        if sys.platform == 'darwin':
+            return peak / (1024 * 1024)
+        return peak / 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        peak = getattr(info, 'peak_wset', None) or info.rss
+        return peak / (1024 * 1024)
+    return None
+
+
+def current_rss_mb() -> Optional[float]:
+    """Return the current resident set size of this process in MB (peak RSS if unknown)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    return peak_rss_mb()
+
+
+PROFILE_INTERVAL_S = 0.005
+COLLAPSED_FILE = 'stacks.collapsed'
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StageProfiler:
+    """cProfile plus a stack sampler for one stage running on the current thread.
+    `profile` is None when cProfile could not be enabled; the sampler still runs."""
+
+    def __init__(self, name: str, root_frame, interval_s: float = PROFILE_INTERVAL_S):
+        self.name = name
+        self.root = root_frame  # outermost frame kept in sampled stacks (the stage's caller)
+        self.interval_s = interval_s
+        self.thread_id = threading.get_ident()
+        self.stacks: Counter = Counter()
+        self.profile = cProfile.Profile()
+        self.done = threading.Event()
+        self.paused = False
+        self.sampler = threading.Thread(target=self._sample, name='stage-sampler', daemon=True)
+
+    def _sample(self):
+        while not self.done.wait(self.interval_s):
+            if self.paused:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                if frame is self.root:
+                    break
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def _enable(self) -> bool:
+        try:
+            self.profile.enable()
+        except ValueError:  # another profiler is active (process-wide on Python 3.12+)
+            self.profile = None
+            return False
+        return True
+
+    def start(self) -> bool:
+        """Start sampling; returns False when cProfile could not be enabled."""
+        enabled = self._enable()
+        self.sampler.start()
+        return enabled
+
+    def pause(self):
+        if self.profile is not None:
+            self.profile.disable()
+        self.paused = True
+
+    def resume(self) -> bool:
+        """Resume sampling; returns False when cProfile was lost to another profiler meanwhile."""
+        self.paused = False
+        return self.profile is None or self._enable()
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+        self.done.set()
+        self.sampler.join()
+
+
+@dataclass
+class StageMetrics:
+    name: str
+    wall_s: float = 0.0
+    # CPU time of the thread that ran the stage (work it hands to other threads is not included)
+    cpu_s: float = 0.0
+    # CPU time of the whole process over the stage, including concurrent stages and worker threads
+    process_cpu_s: float = 0.0
+    peak_rss_delta_mb: Optional[float] = None
+    rows: Optional[int] = None
+    # Seconds since the recorder was created when the stage started
+    start_s: float = 0.0
+
+    @property
+    def rows_per_s(self) -> Optional[float]:
+        if self.rows is None or self.wall_s <= 0:
+            return None
+        return self.rows / self.wall_s
+
+
+@dataclass
+class StageRecorder:
+    """Collect StageMetrics for named stages.
+
+    Usage:
+        rec = StageRecorder()
+        with rec.stage('build_orders') as st:
+            orders_df, items_df = build_orders(...)
+            st.rows = len(orders_df)
+    """
+    stages: List[StageMetrics] = field(default_factory=list)
+    started_at: str = field(default_factory=lambda: datetime.now().isoformat(timespec='seconds'))
+    t0: float = field(default_factory=time.perf_counter, repr=False)
+    # Write per-stage .pstats and collapsed stacks here (None = no profiling)
+    profile_dir: Optional[str] = None
+    _profiled: threading.local = field(default_factory=threading.local, repr=False)
+    _profile_seq: Iterator[int] = field(default_factory=lambda: itertools.count(1), repr=False)
+    _profile_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def _start_profile(self, name: str, root_frame) -> StageProfiler:
+        stack = self._profiled.__dict__.setdefault('stack', [])
+        if stack:
+            stack[-1].pause()
+        prof = StageProfiler(name, root_frame)
+        if not prof.start():
+            print(f"Bước {name}: không bật được cProfile (đang có profiler khác, ví dụ bước chạy song song "
+                  f"trên Python 3.12+), chỉ ghi stacks.collapsed")
+        stack.append(prof)
+        return prof
+
+    def _finish_profile(self, name: str, prof: StageProfiler):
+        prof.stop()
+        stack = self._profiled.stack
+        stack.pop()
+        if stack:
+            if not stack[-1].resume():
+                print(f"Bước {stack[-1].name}: mất cProfile khi tiếp tục sau bước {name}, chỉ ghi stacks.collapsed")
+        with self._profile_lock:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            safe = re.sub(r'[^\w.-]+', '_', name).strip('_')
+            seq = next(self._profile_seq)
+            if prof.profile is not None:
+                prof.profile.dump_stats(os.path.join(self.profile_dir, f"{seq:03d}-{safe}.pstats"))
+            # The first profiled stage of a run starts a fresh collapsed-stack file
+            with open(os.path.join(self.profile_dir, COLLAPSED_FILE), 'w' if seq == 1 else 'a', encoding='utf-8') as f:
+                for stack, n in sorted(prof.stacks.items()):
+                    f.write(f"{name};{stack} {n}\n")
+
+    @contextmanager
+    def stage(self, name: str, rows: Optional[int] = None) -> Iterator[StageMetrics]:
+        m = StageMetrics(name=name, rows=rows)
+        # sys._getframe(2): this generator <- contextlib __enter__ <- the stage's caller
+        prof = self._start_profile(name, sys._getframe(2)) if self.profile_dir else None
+        rss0 = peak_rss_mb()
+        wall0 = time.perf_counter()
+        cpu0 = time.thread_time()
+        proc0 = time.process_time()
+        m.start_s = wall0 - self.t0
+        try:
+            yield m
+        finally:
+            m.wall_s = time.perf_counter() - wall0
+            m.cpu_s = time.thread_time() - cpu0
+            m.process_cpu_s = time.process_time() - proc0
+            rss1 = peak_rss_mb()
+            if rss0 is not None and rss1 is not None:
+                m.peak_rss_delta_mb = max(0.0, rss1 - rss0)
+            if prof is not None:
+                self._finish_profile(name, prof)
+            self.stages.append(m)
+
+    def total_wall_s(self) -> float:
+        """Elapsed time covered by the recorded stages (concurrent stages are not double counted)."""
+        if not self.stages:
+            return 0.0
+        return max(m.start_s + m.wall_s for m in self.stages) - min(m.start_s for m in self.stages)
+
+    def summary_lines(self) -> List[str]:
+        name_w = max([len('stage')] + [len(m.name) for m in self.stages])
+        header = f"{'stage':<{name_w}}  {'wall_s':>9}  {'cpu_s':>9}  {'proc_cpu_s':>10}  {'rss_mb':>8}  {'rows':>11}  {'rows/s':>11}"
+        lines = [header, '-' * len(header)]
+        for m in self.stages:
+            rss = f"{m.peak_rss_delta_mb:8.1f}" if m.peak_rss_delta_mb is not None else f"{'-':>8}"
+            rows = f"{m.rows:11d}" if m.rows is not None else f"{'-':>11}"
+            rps = f"{m.rows_per_s:11.0f}" if m.rows_per_s is not None else f"{'-':>11}"
+            lines.append(f"{m.name:<{name_w}}  {m.wall_s:9.3f}  {m.cpu_s:9.3f}  {m.process_cpu_s:10.3f}  {rss}  {rows}  {rps}")
+        lines.append('-' * len(header))
+        lines.append(f"{'total':<{name_w}}  {self.total_wall_s():9.3f}")
+        return lines
+
+    def print_summary(self):
+        print("Thống kê thời gian theo từng bước:")
+        for line in self.summary_lines():
+            print(line)
+        if self.profile_dir:
+            print(f"Đã ghi profile từng bước -> {self.profile_dir} (*.pstats: python -m pstats <tệp>; "
+                  f"{COLLAPSED_FILE}: flamegraph.pl / speedscope)")
+
+    def to_dict(self, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            'started_at': self.started_at,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'peak_rss_mb': peak_rss_mb(),
+            'total_wall_s': self.total_wall_s(),
+            'stages': [dict(asdict(m), rows_per_s=m.rows_per_s) for m in self.stages],
+        }
+        if extra:
+            data.update(extra)
+        return data
+
+    def write_json(self, path: str, extra: Optional[Dict[str, Any]] = None):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(extra), f, ensure_ascii=False, indent=2)
+        print(f"Đã ghi số liệu đo -> {path}")
@@ -0,0 +1,380 @@
+"""Concurrent BI query load test against the loaded warehouse (`main.py loadtest`).
+
+A catalog of star-schema queries, the kind a BI dashboard issues (revenue by
+region/store/month, category mix, promotion uplift, KPI attainment, monthly
+active customers and a store drill-down), runs on N client threads for a
+fixed duration. Every query borrows a connection from a psycopg2
+ThreadedConnectionPool, runs and fetches its whole result, and returns the
+connection. Slicer values (year, quarter, store, month) are drawn per query
+from what the warehouse holds, so repeated runs do not just hit one cached
+result.
+
+Latencies measured after the warm-up are reported per query as p50/p95/p99
+and QPS. The results JSON records the schema variant: the label, the index
+definitions, the partitions and table row estimates, plus a schema hash.
+`--compare` prints p95/QPS ratios against an earlier results file.
+"""
+import hashlib
+import json
+import os
+import platform
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from config import DbConfig
+from db_read import estimate_row_count
+
+FACT_JOIN = """
+    FROM order_items i
+    JOIN orders o ON o.order_id = i.order_id
+    JOIN dates d ON d.date_id = o.date_id
+"""
+
+
+@dataclass
+class BiQuery:
+    name: str
+    sql: str  # pyformat parameters from SliceDomain.sample()
+    weight: int = 1  # relative frequency in the client mix
+    description: str = ''
+
+
+CATALOG: List[BiQuery] = [
+    BiQuery('revenue_by_mien_month', f"""
+        SELECT s.mien, d.year, d.month, SUM(i.doanh_thu) AS doanh_thu, COUNT(DISTINCT o.order_id) AS so_don
+        {FACT_JOIN}
+        JOIN stores s ON s.id = o.store_id
+        GROUP BY s.mien, d.year, d.month
+        ORDER BY s.mien, d.year, d.month
+    """, weight=2, description='Doanh thu theo miền và tháng'),
+    BiQuery('revenue_by_store_month', f"""
+        SELECT s.id, s.ten_cua_hang, d.month, SUM(i.doanh_thu) AS doanh_thu, SUM(i.so_luong) AS so_luong
+        {FACT_JOIN}
+        JOIN stores s ON s.id = o.store_id
+        WHERE d.year = %(year)s
+        GROUP BY s.id, s.ten_cua_hang, d.month
+        ORDER BY s.id, d.month
+    """, weight=3, description='Doanh thu theo cửa hàng và tháng trong một năm'),
+    BiQuery('category_mix', f"""
+        SELECT p.danh_muc, SUM(i.doanh_thu) AS doanh_thu, SUM(i.so_luong) AS so_luong,
+               SUM(i.doanh_thu) / NULLIF(SUM(SUM(i.doanh_thu)) OVER (), 0) AS ty_trong
+        {FACT_JOIN}
+        JOIN products p ON p.id = i.product_id
+        WHERE d.year = %(year)s AND d.quarter = %(quarter)s
+        GROUP BY p.danh_muc
+        ORDER BY doanh_thu DESC
+    """, weight=2, description='Cơ cấu doanh thu theo danh mục trong một quý'),
+    BiQuery('promotion_uplift', f"""
+        WITH daily AS (
+            SELECT o.date_id, SUM(i.so_luong) AS so_luong
+            {FACT_JOIN}
+            GROUP BY o.date_id
+        ), promo_days AS (
+            SELECT pr.id, pr.loai, d.date_id
+            FROM promotions pr JOIN dates d ON d.full_date BETWEEN pr.start_date AND pr.end_date
+        )
+        SELECT pd.loai, COUNT(DISTINCT pd.id) AS so_chuong_trinh, AVG(daily.so_luong) AS sl_ngay_km,
+               (SELECT AVG(so_luong) FROM daily) AS sl_ngay_tb,
+               AVG(daily.so_luong) / NULLIF((SELECT AVG(so_luong) FROM daily), 0) - 1 AS uplift
+        FROM promo_days pd JOIN daily ON daily.date_id = pd.date_id
+        GROUP BY pd.loai
+        ORDER BY pd.loai
+    """, description='Sản lượng ngày có khuyến mãi so với trung bình, theo loại khuyến mãi'),
+    BiQuery('kpi_attainment', f"""
+        WITH actual AS (
+            SELECT o.store_id, d.year * 100 + d.month AS year_month, SUM(i.doanh_thu) AS doanh_thu
+            {FACT_JOIN}
+            WHERE d.year = %(year)s
+            GROUP BY o.store_id, d.year * 100 + d.month
+        )
+        SELECT k.store_id, k.year_month, k.doanh_thu AS muc_tieu, a.doanh_thu AS thuc_te,
+               a.doanh_thu / NULLIF(k.doanh_thu, 0) AS ty_le_dat
+        FROM KPI_Target_Monthly k
+        LEFT JOIN actual a ON a.store_id = k.store_id AND a.year_month = k.year_month
+        WHERE k.year_month / 100 = %(year)s
+        ORDER BY k.store_id, k.year_month
+    """, weight=2, description='Doanh thu thực tế so với KPI_Target_Monthly'),
+    BiQuery('monthly_active_customers', """
+        SELECT d.year, d.month, COUNT(DISTINCT o.customer_id) AS khach_hang
+        FROM orders o JOIN dates d ON d.date_id = o.date_id
+        WHERE o.customer_id IS NOT NULL
+        GROUP BY d.year, d.month
+        ORDER BY d.year, d.month
+    """, description='Số khách hàng mua hàng theo tháng'),
+    BiQuery('store_month_drilldown', f"""
+        SELECT d.full_date, COUNT(DISTINCT o.order_id) AS so_don, SUM(i.doanh_thu) AS doanh_thu
+        {FACT_JOIN}
+        WHERE o.store_id = %(store_id)s AND o.date_id BETWEEN %(month_first)s AND %(month_last)s
+        GROUP BY d.full_date
+        ORDER BY d.full_date
+    """, weight=4, description='Doanh thu từng ngày của một cửa hàng trong một tháng'),
+]
+QUERIES: Dict[str, BiQuery] = {q.name: q for q in CATALOG}
+
+
+@dataclass
+class SliceDomain:
+    """Values the dashboard slicers pick from, read once from the warehouse."""
+    years: List[int]
+    months: List[int]  # yyyymm
+    stores: List[str]
+
+    @classmethod
+    def load(cls, conn) -> 'SliceDomain':
+        with conn.cursor() as cur:
+            cur.execute("SELECT DISTINCT year, year * 100 + month FROM dates ORDER BY 2")
+            rows = cur.fetchall()
+            cur.execute("SELECT id FROM stores ORDER BY id")
+            stores = [r[0] for r in cur.fetchall()]
+        if not rows or not stores:
+            raise ValueError("Database chưa có dữ liệu (dates/stores trống): chạy generate trước khi loadtest")
+        return cls(sorted({r[0] for r in rows}), [r[1] for r in rows], stores)
+
+    def sample(self, rng: random.Random) -> Dict[str, Any]:
+        month = rng.choice(self.months)
+        return {
+            'year': rng.choice(self.years),
+            'quarter': rng.randint(1, 4),
+            'store_id': rng.choice(self.stores),
+            'month_first': month * 100 + 1,
+            'month_last': month * 100 + 31,
+        }
+
+
+@dataclass
+class QueryStats:
+    latencies: List[float] = field(default_factory=list)  # seconds, measured window only
+    errors: int = 0
+    rows: int = 0
+    last_error: Optional[str] = None
+
+    def merge(self, other: 'QueryStats'):
+        self.latencies += other.latencies
+        self.errors += other.errors
+        self.rows += other.rows
+        self.last_error = other.last_error or self.last_error
+
+    def summary(self, seconds: float) -> Dict[str, Any]:
+        lat = np.array(self.latencies) * 1000.0
+        out: Dict[str, Any] = {'runs': len(lat), 'errors': self.errors,
+                               'qps': len(lat) / seconds if seconds > 0 else 0.0,
+                               'rows_per_run': self.rows / len(lat) if len(lat) else 0.0}
+        if len(lat):
+            p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+            out.update(mean_ms=float(lat.mean()), p50_ms=float(p50), p95_ms=float(p95),
+                       p99_ms=float(p99), max_ms=float(lat.max()))
+        if self.last_error:
+            out['last_error'] = self.last_error
+        return out
+
+
+def select_queries(names: Optional[str]) -> List[BiQuery]:
+    """Catalog entries named in a comma-separated list (all when empty)."""
+    if not names:
+        return list(CATALOG)
+    wanted = [n.strip() for n in names.split(',') if n.strip()]
+    unknown = [n for n in wanted if n not in QUERIES]
+    if unknown:
+        raise ValueError(f"Truy vấn không có trong catalog: {', '.join(unknown)} (chọn {', '.join(QUERIES)})")
+    return [QUERIES[n] for n in wanted]
+
+
+def run_client(pool: ThreadedConnectionPool, queries: List[BiQuery], domain: SliceDomain,
+               rng: random.Random, measure_from: float, deadline: float) -> Dict[str, QueryStats]:
+    """One BI client: weighted-random queries until `deadline`; only queries started
+    after `measure_from` (the end of the warm-up) are timed."""
+    stats = {q.name: QueryStats() for q in queries}
+    weights = [q.weight for q in queries]
+    while time.perf_counter() < deadline:
+        query = rng.choices(queries, weights)[0]
+        params = domain.sample(rng)
+        conn = pool.getconn()
+        try:
+            t0 = time.perf_counter()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(query.sql, params)
+                    rows = len(cur.fetchall())
+            except psycopg2.Error as e:
+                conn.rollback()
+                if t0 >= measure_from:
+                    stats[query.name].errors += 1
+                    stats[query.name].last_error = str(e).strip().splitlines()[0]
+                continue
+            elapsed = time.perf_counter() - t0
+        finally:
+            pool.putconn(conn)
+        if t0 >= measure_from:
+            stats[query.name].latencies.append(elapsed)
+            stats[query.name].rows += rows
+    return stats
+
+
+def describe_database(conn) -> Dict[str, Any]:
+    """Server version, indexes, partitions and row estimates: what distinguishes one schema variant
+    from another in the results file."""
+    with conn.cursor() as cur:
+        cur.execute("SHOW server_version")
+        version = cur.fetchone()[0]
+        cur.execute("""
+            SELECT tablename, indexname, indexdef FROM pg_indexes
+            WHERE schemaname = current_schema() ORDER BY tablename, indexname
+        """)
+        indexes = [{'table': t, 'name': n, 'definition': d} for t, n, d in cur.fetchall()]
+        cur.execute("""
+            SELECT p.relname, COUNT(i.inhrelid) FROM pg_partitioned_table pt
+            JOIN pg_class p ON p.oid = pt.partrelid
+            LEFT JOIN pg_inherits i ON i.inhparent = p.oid
+            WHERE p.relnamespace = current_schema()::regnamespace
+            GROUP BY p.relname ORDER BY p.relname
+        """)
+        partitions = {t: n for t, n in cur.fetchall()}
+        cur.execute("""
+            SELECT table_name, string_agg(column_name || ' ' || data_type, ', ' ORDER BY ordinal_position)
+            FROM information_schema.columns WHERE table_schema = current_schema()
+            GROUP BY table_name ORDER BY table_name
+        """)
+        columns = cur.fetchall()
+    tables = ['dates', 'stores', 'employees', 'customers', 'products', 'promotions',
+              'orders', 'order_items', 'KPI_Target_Monthly']
+    fingerprint = json.dumps([columns, [i['definition'] for i in indexes], partitions], sort_keys=True)
+    return {
+        'server_version': version,
+        'schema_sha256': hashlib.sha256(fingerprint.encode()).hexdigest()[:16],
+        'indexes': indexes,
+        'partitions': partitions,
+        'row_estimates': {t: estimate_row_count(conn, t) for t in tables},
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    queries = report['queries']
+    name_w = max([len('query')] + [len(n) for n in queries])
+    header = (f"{'query':<{name_w}}  {'runs':>6}  {'err':>4}  {'qps':>7}  {'p50_ms':>9}  "
+              f"{'p95_ms':>9}  {'p99_ms':>9}  {'max_ms':>9}")
+    print(f"Kết quả loadtest ({report['clients']} client, {report['measured_s']:.0f} s đo"
+          f"{', ' + report['label'] if report.get('label') else ''}):")
+    print(header)
+    print('-' * len(header))
+    for name, q in queries.items():
+        if q['runs']:
+            lat = f"{q['p50_ms']:9.1f}  {q['p95_ms']:9.1f}  {q['p99_ms']:9.1f}  {q['max_ms']:9.1f}"
+        else:
+            lat = '  '.join(f"{'-':>9}" for _ in range(4))
+        print(f"{name:<{name_w}}  {q['runs']:6d}  {q['errors']:4d}  {q['qps']:7.2f}  {lat}")
+    print('-' * len(header))
+    total = report['total']
+    print(f"{'total':<{name_w}}  {total['runs']:6d}  {total['errors']:4d}  {total['qps']:7.2f}  "
+          f"{total.get('p50_ms', 0):9.1f}  {total.get('p95_ms', 0):9.1f}  {total.get('p99_ms', 0):9.1f}  "
+          f"{total.get('max_ms', 0):9.1f}")
+    for name, q in queries.items():
+        if q.get('last_error'):
+            print(f"  {name}: {q['errors']} lỗi, lỗi cuối: {q['last_error']}")
+
+
+def compare_reports(current: Dict[str, Any], baseline: Dict[str, Any]):
+    """Print p95 latency and QPS of each query against an earlier results file."""
+    print(f"So sánh với {baseline.get('label') or baseline.get('started_at')} "
+          f"(schema {baseline.get('database', {}).get('schema_sha256')} -> "
+          f"{current['database']['schema_sha256']}):")
+    if set(current['queries']) != set(baseline.get('queries', {})) or current['clients'] != baseline.get('clients'):
+        print("  Lưu ý: khác tập truy vấn hoặc số client, QPS không so sánh trực tiếp được (chỉ xem p95).")
+    name_w = max([len('query')] + [len(n) for n in current['queries']])
+    print(f"{'query':<{name_w}}  {'base_p95':>9}  {'now_p95':>9}  {'p95 x':>6}  {'base_qps':>8}  {'now_qps':>8}  {'qps x':>6}")
+    for name, cur in list(current['queries'].items()) + [('total', current['total'])]:
+        base = baseline['total'] if name == 'total' else baseline.get('queries', {}).get(name)
+        if not base or not base.get('runs') or not cur.get('runs'):
+            continue
+        print(f"{name:<{name_w}}  {base['p95_ms']:9.1f}  {cur['p95_ms']:9.1f}  {cur['p95_ms'] / base['p95_ms']:6.2f}  "
+              f"{base['qps']:8.2f}  {cur['qps']:8.2f}  {cur['qps'] / base['qps'] if base['qps'] else 0:6.2f}")
+
+
+def run_loadtest(dbc: DbConfig, clients: int = 4, duration: float = 60.0, warmup: float = 5.0,
+                 queries: Optional[str] = None, seed: Optional[int] = None, label: Optional[str] = None,
+                 json_path: Optional[str] = None, compare: Optional[str] = None) -> Dict[str, Any]:
+    """Run the catalog with `clients` concurrent clients for warmup + duration seconds and
+    return (and optionally write) the report."""
+    if clients < 1 or duration <= 0 or warmup < 0:
+        raise ValueError("Cần --clients >= 1, --duration > 0 và --warmup >= 0")
+    selected = select_queries(queries)
+    pool = ThreadedConnectionPool(clients, clients, host=dbc.host, port=dbc.port, dbname=dbc.db,
+                                  user=dbc.user, password=dbc.password)
+    try:
+        # Open every connection before the clock starts; BI clients only read
+        conns = [pool.getconn() for _ in range(clients)]
+        for conn in conns:
+            conn.set_session(readonly=True, autocommit=True)
+        domain = SliceDomain.load(conns[0])
+        database = describe_database(conns[0])
+        for conn in conns:
+            pool.putconn(conn)
+
+        names = ', '.join(q.name for q in selected)
+        print(f"Loadtest {len(selected)} truy vấn ({names}) với {clients} client: "
+              f"khởi động {warmup:.0f} s, đo {duration:.0f} s…")
+        base_rng = random.Random(seed)
+        rngs = [random.Random(base_rng.getrandbits(64)) for _ in range(clients)]
+        results: List[Optional[Dict[str, QueryStats]]] = [None] * clients
+        errors: List[BaseException] = []
+        started_at = datetime.now().isoformat(timespec='seconds')
+        start = time.perf_counter()
+        measure_from, deadline = start + warmup, start + warmup + duration
+
+        def client(i: int):
+            try:
+                results[i] = run_client(pool, selected, domain, rngs[i], measure_from, deadline)
+            except BaseException as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=client, args=(i,), name=f'bi-client-{i}') for i in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+        # The last queries may finish after the deadline: QPS is taken over the real measured window
+        measured_s = max(duration, time.perf_counter() - measure_from)
+    finally:
+        pool.closeall()
+
+    merged = {q.name: QueryStats() for q in selected}
+    total = QueryStats()
+    for per_client in results:
+        for name, st in per_client.items():
+            merged[name].merge(st)
+            total.merge(st)
+    report = {
+        'started_at': started_at,
+        'label': label,
+        'clients': clients,
+        'warmup_s': warmup,
+        'duration_s': duration,
+        'measured_s': measured_s,
+        'seed': seed,
+        'python': platform.python_version(),
+        'database': dict(host=dbc.host, port=dbc.port, db=dbc.db, **database),
+        'queries': {name: st.summary(measured_s) for name, st in merged.items()},
+        'total': total.summary(measured_s),
+        'sql': {q.name: ' '.join(q.sql.split()) for q in selected},
+    }
+    print_report(report)
+    if json_path:
+        folder = os.path.dirname(json_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Đã ghi kết quả loadtest -> {json_path}")
+    if compare:
+        with open(compare, encoding='utf-8') as f:
+            compare_reports(report, json.load(f))
+    return report
@@ -1,10 +1,124 @@
 import argparse
-import os
-from generate_data import load_config_from_env, generate_and_load, Config, DbConfig
+
+# Only the light config module is imported at startup; each command imports what it needs,
+# so `export` never loads pandas/Faker (check with: python benchmark.py --import-time)
+from config import load_config_from_env
+
+
+def cmd_generate(cfg, dbc, args):
+    if cfg.shard:
+        from shards import run_shard
+        run_shard(cfg, dbc, require_plan_dir(cfg), cfg.shard)
+        return
+    if cfg.no_db:
+        from generate_data import generate_to_files
+        if not generate_to_files(cfg):
+            raise SystemExit(1)
+        return
+    from generate_data import generate_and_load
+    generate_and_load(cfg, dbc)
+
+
+def cmd_export(cfg, dbc, args):
+    """Export existing DB tables only (no generation); COPY streams straight to files."""
+    from db import ensure_database, export_tables_to_csv
+    out_dir = args.export_db_csv or cfg.db_export_dir
+    if not out_dir:
+        print('Vui lòng cung cấp --export-db-csv <thư_mục_đích> khi dùng --export-only')
+        return
+    ensure_database(dbc)
+    export_tables_to_csv(dbc, out_dir, since=cfg.export_since, state_file=cfg.export_state_file,
+                         compress=cfg.compress, compress_threads=cfg.compress_threads)
+
+
+def cmd_partitions(cfg, dbc, args):
+    """List fact-table partitions, or detach/attach/drop one period (yyyymm or yyyy) in place."""
+    from db import get_conn
+    import partitions
+    actions = [
+        (args.detach_partition, partitions.detach_period, 'Đã tách (detach)'),
+        (args.attach_partition, partitions.attach_period, 'Đã gắn lại (attach)'),
+        (args.drop_partition, partitions.drop_period, 'Đã xoá'),
+    ]
+    with get_conn(dbc) as conn:
+        for key, action, done in actions:
+            if key is not None:
+                action(conn, key)
+                print(f"{done} phân vùng {key} của {', '.join(partitions.PARTITIONED_TABLES)}")
+        rows = partitions.list_partitions(conn)
+    if not rows:
+        print('Không có phân vùng nào (tạo bằng --partition-by month|year)')
+    for table, name, bound, n in rows:
+        print(f"{name:<32} {bound:<48} ~{n} dòng")
+
+
+def require_plan_dir(cfg) -> str:
+    if not cfg.plan_dir:
+        raise SystemExit('Vui lòng cung cấp --plan-dir <thư_mục> (thư mục plan dùng chung giữa các máy)')
+    return cfg.plan_dir
+
+
+def cmd_plan(cfg, dbc, args):
+    """Split the run into --shards N shards, build the shared dimensions and write the plan."""
+    from shards import make_plan
+    make_plan(cfg, dbc, args.shards or 1, require_plan_dir(cfg))
+
+
+def cmd_merge(cfg, dbc, args):
+    """Verify every shard manifest and build KPI_Target_Monthly from the partial aggregates."""
+    from shards import merge_shards
+    if not merge_shards(cfg, dbc, require_plan_dir(cfg)):
+        raise SystemExit(1)
+
+
+def cmd_loadtest(cfg, dbc, args):
+    """Run the BI query catalog with --clients concurrent clients and report latency percentiles/QPS."""
+    from loadtest import run_loadtest
+    run_loadtest(dbc, clients=args.clients or 4, duration=args.duration or 60.0,
+                 warmup=args.warmup if args.warmup is not None else 5.0, queries=args.queries,
+                 seed=cfg.seed, label=args.label, json_path=cfg.metrics_json, compare=args.compare)
+
+
+def refresh_command(table: str):
+    def run(cfg, dbc, args):
+        import generate_data
+        getattr(generate_data, f'refresh_{table}_only')(dbc)
+    return run
+
+
+COMMANDS = {
+    'generate': cmd_generate,
+    'export': cmd_export,
+    'partitions': cmd_partitions,
+    'plan': cmd_plan,
+    'merge': cmd_merge,
+    'loadtest': cmd_loadtest,
+    'refresh-products': refresh_command('products'),
+    'refresh-stores': refresh_command('stores'),
+    'refresh-customers': refresh_command('customers'),
+    'refresh-employees': refresh_command('employees'),
+}
+
+
+def resolve_command(args, cfg) -> str:
+    """Explicit subcommand, else the legacy --export-only / --refresh-*-only flags, else generate."""
+    if args.command:
+        return args.command
+    if cfg.no_db:
+        return 'generate'
+    if args.export_only:
+        return 'export'
+    for table in ('products', 'stores', 'customers', 'employees'):
+        if getattr(args, f'refresh_{table}_only'):
+            return f'refresh-{table}'
+    return 'generate'
 
 
 def parse_args():
     p = argparse.ArgumentParser(description='Generate Vietnamese Mother & Baby sales dataset and load to Postgres')
+    p.add_argument('command', nargs='?', choices=list(COMMANDS),
+                   help='generate (default), export (DB -> CSV), partitions, plan/merge (sharded runs), '
+                        'loadtest (concurrent BI queries) or refresh-<table>')
     p.add_argument('--customers', type=int, help='Exact number of customers')
     p.add_argument('--customers-min', type=int, help='Minimum customers (used when --customers not provided)')
     p.add_argument('--customers-max', type=int, help='Maximum customers (used when --customers not provided)')
@@ -23,8 +137,54 @@ def parse_args():
     p.add_argument('--export-csv', type=str, help='Folder to export CSVs in addition to DB insert')
     p.add_argument('--export-db-csv', type=str, help='Export tables from DB to CSV after load (UTF-8 BOM)')
     p.add_argument('--export-only', action='store_true', help='Only export tables from DB to CSV and exit (no generation)')
+    p.add_argument('--compress', type=str, choices=['gzip', 'zstd'], help='Compress CSV exports on the fly (--export-db-csv, --export-csv, --no-db)')
+    p.add_argument('--compress-threads', type=int, help='Compression threads (default: all CPUs)')
+    p.add_argument('--since', type=int, help='DB CSV export: only fact rows with date_id >= this (YYYYMMDD)')
+    p.add_argument('--state-file', type=str, help='DB CSV export: watermark JSON, export only rows/tables new since the last run')
     p.add_argument('--refresh-products-only', action='store_true', help='Only regenerate Product_Dim attributes (update in place)')
     p.add_argument('--refresh-stores-only', action='store_true', help='Only regenerate Stores attributes (update in place)')
+    p.add_argument('--refresh-customers-only', action='store_true', help='Only regenerate Customers attributes (update in place)')
+    p.add_argument('--refresh-employees-only', action='store_true', help='Only regenerate Employees attributes (update in place)')
+    p.add_argument('--fast-load', action='store_true', help='Bulk-load profile: synchronous_commit=off, UNLOGGED fact tables, larger batches, ANALYZE')
+    p.add_argument('--keep-unlogged', action='store_true', help='With --fast-load, leave fact tables UNLOGGED after loading')
+    p.add_argument('--maintenance-work-mem', type=str, help="maintenance_work_mem for the load session (default '512MB')")
+    p.add_argument('--fast-load-baseline', type=str, help='Metrics JSON of a normal run to report time saved per table')
+    p.add_argument('--partition-by', type=str, choices=['month', 'year'],
+                   help='Range-partition orders, order_items, product_daily_costs by date_id (Postgres 13+)')
+    p.add_argument('--detach-partition', type=int, metavar='PERIOD', help='partitions: detach period yyyymm/yyyy from the fact tables')
+    p.add_argument('--attach-partition', type=int, metavar='PERIOD', help='partitions: attach a detached period back')
+    p.add_argument('--drop-partition', type=int, metavar='PERIOD', help='partitions: detach and drop a period')
+    p.add_argument('--load-workers', type=int, help='Load independent tables concurrently with N pooled connections (COPY)')
+    p.add_argument('--pipeline', action='store_true', help='Generate and load orders concurrently via a bounded queue')
+    p.add_argument('--chunk-size', type=int, help='Orders per generated chunk (default 50000)')
+    p.add_argument('--queue-size', type=int, help='Max chunks waiting in memory for the loaders (default 4)')
+    p.add_argument('--memory-budget', type=str,
+                   help="Memory budget such as '2GB': chunk/batch sizes are derived from it and adapted at runtime")
+    p.add_argument('--shards', type=int, help='plan: number of shards (month ranges) to split the run into')
+    p.add_argument('--shard', type=str, metavar='I/N', help='generate: produce only shard I of an N-shard plan (--plan-dir)')
+    p.add_argument('--plan-dir', type=str, help='plan/generate --shard/merge: folder with plan.json, dimensions and manifests')
+    p.add_argument('--clients', type=int, help='loadtest: concurrent BI clients (pooled connections, default 4)')
+    p.add_argument('--duration', type=float, help='loadtest: measured seconds (default 60)')
+    p.add_argument('--warmup', type=float, help='loadtest: seconds run before measuring (default 5)')
+    p.add_argument('--queries', type=str, help='loadtest: comma-separated catalog queries (default all)')
+    p.add_argument('--label', type=str, help='loadtest: name of the schema/index variant, stored in the results JSON')
+    p.add_argument('--compare', type=str, metavar='JSON', help='loadtest: print p95/QPS ratios against an earlier results JSON')
+    p.add_argument('--no-db', action='store_true', help='Write generated tables to files or an embedded database, without Postgres')
+    p.add_argument('--out-dir', type=str, help='Output folder for --no-db')
+    p.add_argument('--format', type=str, choices=['csv', 'parquet', 'sqlite', 'duckdb'],
+                   help='Output of --no-db: csv (default, UTF-8 BOM), parquet, or one sqlite/duckdb database file')
+    p.add_argument('--demand-model', type=str, help="Order demand: 'uniform' (default), 'seasonal' or a JSON file of DemandModel overrides")
+    p.add_argument('--cogs', action='store_true', help='Fill order_items.gia_von with the product cost on the order date')
+    p.add_argument('--customer-behaviour', action='store_true', help='Stateful customers: retention, home store, channel/basket/category preferences')
+    p.add_argument('--cost-matrix', type=str, help='Memory-map the products x days cost matrix to this .npy file (long histories)')
+    p.add_argument('--cost-dtype', type=str, choices=['float64', 'float32'], help='Cost matrix precision (default float64)')
+    p.add_argument('--seed', type=int, help='Fixed random seed for a reproducible dataset')
+    p.add_argument('--as-of', type=str, metavar='YYYY-MM-DD', help='Last day of the date dimension (default today)')
+    p.add_argument('--resume', action='store_true',
+                   help='Continue an interrupted DB load: skip committed tables/chunks, regenerate the rest')
+    p.add_argument('--metrics-json', type=str, help='Write per-stage timing/memory metrics (loadtest: its results) to this JSON file')
+    p.add_argument('--profile', type=str, metavar='DIR',
+                   help='Profile each stage: DIR/<nn>-<stage>.pstats (cProfile) and DIR/stacks.collapsed (flamegraph)')
 
     p.add_argument('--pg-host', type=str)
     p.add_argument('--pg-port', type=int)
@@ -63,6 +223,35 @@ def main():
         cfg.monthly_active_max = args.monthly_active_customers
     if args.export_csv is not None: cfg.export_csv_dir = args.export_csv
     if args.export_db_csv is not None: cfg.db_export_dir = args.export_db_csv
+    if args.compress is not None: cfg.compress = args.compress
+    if args.compress_threads is not None: cfg.compress_threads = args.compress_threads
+    if args.since is not None: cfg.export_since = args.since
+    if args.state_file is not None: cfg.export_state_file = args.state_file
+    if args.metrics_json is not None: cfg.metrics_json = args.metrics_json
+    if args.profile is not None: cfg.profile_dir = args.profile
+    if args.seed is not None: cfg.seed = args.seed
+    if args.as_of is not None: cfg.as_of = args.as_of
+    if args.resume: cfg.resume = True
+    if args.demand_model is not None: cfg.demand_model = args.demand_model
+    if args.cogs: cfg.cogs = True
+    if args.customer_behaviour: cfg.customer_behaviour = True
+    if args.cost_matrix is not None: cfg.cost_matrix_path = args.cost_matrix
+    if args.cost_dtype is not None: cfg.cost_dtype = args.cost_dtype
+    if args.fast_load: cfg.fast_load = True
+    if args.partition_by is not None: cfg.partition_by = args.partition_by
+    if args.load_workers is not None: cfg.load_workers = args.load_workers
+    if args.pipeline: cfg.pipeline = True
+    if args.chunk_size is not None: cfg.chunk_size = args.chunk_size
+    if args.no_db: cfg.no_db = True
+    if args.shard is not None: cfg.shard = args.shard
+    if args.plan_dir is not None: cfg.plan_dir = args.plan_dir
+    if args.out_dir is not None: cfg.output_dir = args.out_dir
+    if args.format is not None: cfg.output_format = args.format
+    if args.queue_size is not None: cfg.queue_size = args.queue_size
+    if args.memory_budget is not None: cfg.memory_budget = args.memory_budget
+    if args.keep_unlogged: cfg.keep_unlogged = True
+    if args.maintenance_work_mem is not None: cfg.maintenance_work_mem = args.maintenance_work_mem
+    if args.fast_load_baseline is not None: cfg.fast_load_baseline = args.fast_load_baseline
 
     if args.pg_host is not None: dbc.host = args.pg_host
     if args.pg_port is not None: dbc.port = args.pg_port
@@ -70,30 +259,7 @@ def main():
     if args.pg_user is not None: dbc.user = args.pg_user
     if args.pg_password is not None: dbc.password = args.pg_password
 
-    if args.export_only:
-        # Export existing DB tables only (no generation)
-        from generate_data import export_tables_to_csv, ensure_database
-        # Determine output directory
-        out_dir = args.export_db_csv or cfg.db_export_dir
-        if not out_dir:
-            print('Vui lòng cung cấp --export-db-csv <thư_mục_đích> khi dùng --export-only')
-            return
-        ensure_database(dbc)
-        export_tables_to_csv(dbc, out_dir)
-        return
-
-    if args.refresh_products_only:
-        from generate_data import refresh_products_only
-        refresh_products_only(dbc)
-    elif args.refresh_stores_only:
-        from generate_data import refresh_stores_only
-        refresh_stores_only(dbc)
-    elif getattr(args, 'refresh_orders_only', False):
-        from generate_data import get_conn, build_date_dim, build_orders, insert_orders, insert_order_items
-        # Not wired via arg yet; leaving placeholder for future use
-        generate_and_load(cfg, dbc)
-    else:
-        generate_and_load(cfg, dbc)
+    COMMANDS[resolve_command(args, cfg)](cfg, dbc, args)
 
 
 if __name__ == '__main__':
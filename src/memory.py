@@ -0,0 +1,202 @@
+"""Memory-budget-driven chunk sizing (--memory-budget).
+
+Instead of fixed batch sizes, every chunked step gets a ChunkSizer from the
+run's MemoryBudget:
+- bytes per row are estimated from a sample of the table in the form the step
+  holds in memory (DataFrame columns, Python row tuples for INSERT, CSV text
+  for COPY),
+- the initial chunk takes a share of the headroom left under the budget
+  (budget - current RSS), divided by the number of chunks alive at once
+  (queued + being loaded),
+- after each chunk the sizer looks at the process RSS and the chunk
+  throughput: above the high-water mark it halves the chunk; well below the
+  budget it grows the chunk while rows/s keeps improving, and steps back to
+  the previous size once a larger chunk stops paying off.
+Chunk boundaries never change the generated data (the RNG is consumed per
+order), so a given --seed gives the same dataset under any budget.
+"""
+import io
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from instrumentation import current_rss_mb
+
+# Share of the headroom given to one step's chunks (the rest covers pandas temporaries)
+CHUNK_SHARE = 0.5
+# RSS above HIGH_WATER x budget halves chunks; below LOW_WATER x budget they may grow
+HIGH_WATER = 0.9
+LOW_WATER = 0.6
+GROWTH = 1.5
+SAMPLE_ROWS = 1000
+MIN_CHUNK_ROWS = 500
+MAX_CHUNK_ROWS = 2_000_000
+# Upper bound on one multi-row INSERT statement (execute_values page)
+STATEMENT_BYTES = 16 << 20
+
+SIZE_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', re.I)
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(text: str) -> int:
+    """'512MB', '2G', '1.5GiB' or plain bytes -> bytes."""
+    m = SIZE_RE.match(str(text))
+    if not m:
+        raise ValueError(f"Dung lượng không hợp lệ: {text} (ví dụ 512MB, 2GB)")
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2).upper()])
+
+
+def frame_bytes(df: pd.DataFrame) -> int:
+    """Bytes of a DataFrame as held in memory (object/string columns included)."""
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+
+def list_bytes(lists: Iterable[list]) -> int:
+    """Bytes of Python lists including their (boxed) elements."""
+    return sum(sys.getsizeof(v) + sum(sys.getsizeof(x) for x in v) for v in lists)
+
+
+def tuple_row_bytes(df: pd.DataFrame, sample: int = SAMPLE_ROWS) -> float:
+    """Bytes per row once rows are Python tuples of Python values (execute_values input)."""
+    head = df.head(sample)
+    if head.empty:
+        return 1.0
+    total = 0
+    for row in head.itertuples(index=False, name=None):
+        total += sys.getsizeof(row) + sum(sys.getsizeof(x) for x in row)
+    return total / len(head)
+
+
+def csv_row_bytes(df: pd.DataFrame, sample: int = SAMPLE_ROWS) -> float:
+    """Bytes per row of the CSV text buffered for COPY."""
+    head = df.head(sample)
+    if head.empty:
+        return 1.0
+    buf = io.StringIO()
+    head.to_csv(buf, index=False, header=False)
+    return max(1.0, sys.getsizeof(buf.getvalue()) / len(head))
+
+
+def page_rows(row_bytes: float, rows: int) -> int:
+    """execute_values page size for a slice of `rows` rows, bounded by STATEMENT_BYTES."""
+    return max(1, min(rows, int(STATEMENT_BYTES / max(row_bytes, 1.0))))
+
+
+@dataclass
+class ChunkSizer:
+    """Rows per chunk for one step, sized from the budget and adapted after every chunk."""
+    name: str
+    budget: 'MemoryBudget'
+    row_bytes: float
+    copies: int = 1  # chunks of this step alive at the same time
+    rows: int = 0
+    chunks: int = 0
+    shrinks: int = 0
+    grows: int = 0
+    best_rate: float = 0.0
+    best_rows: int = 0
+    settled: bool = False  # growth stopped paying off
+
+    def __post_init__(self):
+        if not self.rows:
+            self.rows = self.clamp(self.budget.headroom_bytes() * CHUNK_SHARE / (self.row_bytes * max(1, self.copies)))
+        self.initial_rows = self.rows
+
+    @staticmethod
+    def clamp(rows: float) -> int:
+        return int(min(MAX_CHUNK_ROWS, max(MIN_CHUNK_ROWS, rows)))
+
+    def observe(self, rows: int, seconds: float):
+        """Adjust the chunk size after a chunk of `rows` rows took `seconds` end to end."""
+        self.chunks += 1
+        rss = self.budget.rss_bytes()
+        rate = rows / seconds if seconds > 0 else 0.0
+        if rss > self.budget.limit_bytes * HIGH_WATER:
+            self.rows = self.clamp(self.rows / 2)
+            self.shrinks += 1
+            self.settled = True
+        elif rows < self.rows:
+            return  # last, partial chunk: nothing to learn
+        elif rate > self.best_rate:
+            self.best_rate, self.best_rows = rate, rows
+            if not self.settled and rss < self.budget.limit_bytes * LOW_WATER:
+                self.rows = self.clamp(self.rows * GROWTH)
+                if self.rows > rows:
+                    self.grows += 1
+        elif not self.settled and self.best_rows:
+            # The larger chunk was not faster: go back to the best size and stay there
+            self.rows, self.settled = self.best_rows, True
+
+    def report(self) -> str:
+        return (f"{self.name:<28} {self.row_bytes:9.0f} {self.copies:6d} {self.initial_rows:10d} "
+                f"{self.rows:10d} {self.chunks:7d} {self.grows:5d} {self.shrinks:6d}")
+
+
+@dataclass
+class MemoryBudget:
+    """Process-wide memory budget shared by all chunked steps of a run."""
+    limit_bytes: int
+    sizers: Dict[str, ChunkSizer] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, text: Optional[str]) -> Optional['MemoryBudget']:
+        return cls(parse_size(text)) if text else None
+
+    @staticmethod
+    def rss_bytes() -> int:
+        rss = current_rss_mb()
+        return int(rss * (1 << 20)) if rss is not None else 0
+
+    def headroom_bytes(self) -> int:
+        # Never size below a tenth of the budget, even when RSS is already over it
+        return max(self.limit_bytes // 10, self.limit_bytes - self.rss_bytes())
+
+    def sizer(self, name: str, row_bytes: float, copies: int = 1) -> ChunkSizer:
+        """A new ChunkSizer for `name` (kept for the end-of-run report)."""
+        s = ChunkSizer(name, self, row_bytes, copies=copies)
+        self.sizers[name] = s
+        return s
+
+    def report_lines(self) -> List[str]:
+        header = (f"{'step':<28} {'B/row':>9} {'copies':>6} {'first':>10} {'last':>10} "
+                  f"{'chunks':>7} {'grow':>5} {'shrink':>6}")
+        return [header, '-' * len(header)] + [s.report() for s in self.sizers.values()]
+
+    def print_report(self):
+        print(f"Kích thước chunk theo --memory-budget {self.limit_bytes / (1 << 20):.0f} MB "
+              f"(RSS hiện tại {self.rss_bytes() / (1 << 20):.0f} MB):")
+        for line in self.report_lines():
+            print(line)
+
+
+def sized_slices(df: pd.DataFrame, sizer: Optional[ChunkSizer]) -> Iterator[pd.DataFrame]:
+    """Slices of df of sizer.rows rows (the whole frame without a sizer). The time
+    until the consumer asks for the next slice is fed back to the sizer."""
+    if sizer is None:
+        yield df
+        return
+    start = 0
+    while start < len(df):
+        part = df.iloc[start:start + sizer.rows]
+        t0 = time.perf_counter()
+        yield part
+        sizer.observe(len(part), time.perf_counter() - t0)
+        start += len(part)
+
+
+def insert_batches(df: pd.DataFrame, name: str, budget: Optional[MemoryBudget],
+                   page_size: Optional[int]) -> Iterator[Tuple[pd.DataFrame, Optional[int]]]:
+    """(rows, execute_values page size) pairs for an INSERT: the whole frame with `page_size`,
+    or with a budget, slices sized from the Python-tuple footprint of the rows and pages
+    bounded by STATEMENT_BYTES."""
+    if budget is None or df.empty:
+        yield df, page_size
+        return
+    sizer = budget.sizer(name, tuple_row_bytes(df))
+    statement_row_bytes = csv_row_bytes(df)
+    for part in sized_slices(df, sizer):
+        yield part, page_rows(statement_row_bytes, len(part))
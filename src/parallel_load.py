@@ -0,0 +1,201 @@
+"""Concurrent table loading over a psycopg2 connection pool.
+
+The load order is derived from the FK graph in schema.sql: a table is loaded
+as soon as every table it references has been committed, so independent
+dimensions load at the same time. Large tables are split into several COPY
+streams that run on separate pooled connections:
+- order_items by contiguous order_id ranges,
+- product_daily_costs by product (its smoothness trigger only looks at rows of
+  the same product, so per-product streams never race each other). It arrives
+  as a CostMatrix; each stream COPYs its product range block by block and
+  commits once.
+With a partitioned schema (--partition-by), orders and order_items are split
+by partition instead and each stream COPYs straight into its partition
+(orders_p202401, ...), skipping tuple routing; partitions never share a lock
+or index, so the streams do not contend.
+
+With a LoadCheckpoint (--resume support), orders and order_items are split by
+contiguous order_id ranges instead, and each stream commits its range in
+order_slices() recorded as checkpoint chunks. A partition holds scattered
+order_ids, so it cannot be checkpointed as a range; in a partitioned schema the
+rows of each slice are still COPYed straight into their partitions.
+"""
+import re
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from psycopg2.pool import ThreadedConnectionPool
+
+from checkpoint import FACT_TABLES, LoadCheckpoint, order_slices
+from costs import CostMatrix
+from generate_data import DbConfig, copy_frame
+from instrumentation import StageRecorder
+from memory import ChunkSizer, MemoryBudget, csv_row_bytes, sized_slices
+from partitions import PartitionRange
+
+CREATE_TABLE_RE = re.compile(r'CREATE TABLE IF NOT EXISTS\s+(\w+)\s*\((.*?)\n\);', re.S | re.I)
+REFERENCES_RE = re.compile(r'REFERENCES\s+(\w+)\s*\(', re.I)
+
+# Column used to split a table into parallel COPY streams
+SPLIT_KEYS = {
+    'order_items': 'order_id',
+    'product_daily_costs': 'product_id',
+}
+# Split per partition in a partitioned schema. product_daily_costs keeps its
+# per-product split: the smoothness trigger reads neighbouring days, which may
+# sit in the previous partition.
+PARTITION_SPLIT_TABLES = {'orders', 'order_items'}
+
+
+def parse_fk_graph(schema_sql: Optional[str] = None) -> Dict[str, Set[str]]:
+    """Return {table: {referenced tables}} from the CREATE TABLE statements (names lower-cased)."""
+    if schema_sql is None:
+        schema_sql = Path(__file__).with_name('schema.sql').read_text(encoding='utf-8')
+    graph: Dict[str, Set[str]] = {}
+    for name, body in CREATE_TABLE_RE.findall(schema_sql):
+        table = name.lower()
+        graph[table] = {ref.lower() for ref in REFERENCES_RE.findall(body) if ref.lower() != table}
+    return graph
+
+
+def dependency_levels(tables: List[str], graph: Dict[str, Set[str]]) -> List[List[str]]:
+    """Group tables into levels; every table only depends on tables of earlier levels."""
+    wanted = {t.lower(): t for t in tables}
+    remaining = set(wanted)
+    levels: List[List[str]] = []
+    while remaining:
+        ready = sorted(t for t in remaining if not (graph.get(t, set()) & remaining))
+        if not ready:
+            raise ValueError(f"Vòng phụ thuộc khoá ngoại giữa các bảng: {sorted(remaining)}")
+        levels.append([wanted[t] for t in ready])
+        remaining -= set(ready)
+    return levels
+
+
+def split_frame(df: pd.DataFrame, key: str, parts: int) -> List[pd.DataFrame]:
+    """Split df into at most `parts` chunks with disjoint, contiguous ranges of `key`."""
+    if parts <= 1 or df.empty:
+        return [df]
+    codes, uniques = pd.factorize(df[key], sort=True)
+    bounds = np.linspace(0, len(uniques), parts + 1).astype(int)
+    chunks = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if hi > lo:
+            chunks.append(df[(codes >= lo) & (codes < hi)])
+    return chunks
+
+
+def split_by_partition(df: pd.DataFrame, table: str, partitions: List[PartitionRange]) -> List[Tuple[str, pd.DataFrame]]:
+    """(partition name, rows) for every partition of `table` that receives rows of df (by date_id)."""
+    keys = np.searchsorted([r.hi for r in partitions], df['date_id'].to_numpy(), side='right')
+    return [(partitions[k].name(table), part) for k, part in df.groupby(keys, sort=True)]
+
+
+def make_pool(dbc: DbConfig, workers: int, fast_load: bool = False) -> ThreadedConnectionPool:
+    options = '-c synchronous_commit=off' if fast_load else None
+    return ThreadedConnectionPool(1, workers, host=dbc.host, port=dbc.port, dbname=dbc.db,
+                                  user=dbc.user, password=dbc.password, options=options)
+
+
+def load_tables_parallel(dbc: DbConfig, frames: Dict[str, Any], workers: int,
+                         rec: StageRecorder, fast_load: bool = False,
+                         partitions: Optional[List[PartitionRange]] = None,
+                         budget: Optional[MemoryBudget] = None, checkpoint: Optional[LoadCheckpoint] = None):
+    """Load `frames` ({table: DataFrame with DB columns, or a CostMatrix}) concurrently, respecting FK dependencies.
+    `partitions` (partitioned schema) routes orders/order_items streams to their partitions.
+    With a budget, each stream COPYs its part in slices sized on the CSV text buffered per
+    slice (one slice per worker in memory at once) and commits once.
+    With a checkpoint, facts commit in order_id slices recorded as chunks, and each table is
+    recorded once all its streams have committed."""
+    graph = parse_fk_graph()
+    tables = [t for t, df in frames.items() if df is not None and not df.empty]
+    # Validate the DAG up front (raises on cycles) and report the schedule
+    for i, level in enumerate(dependency_levels(tables, graph), start=1):
+        print(f"  Nhóm {i}: {', '.join(level)}")
+
+    # One spare connection records checkpoints while every worker is busy
+    pool = make_pool(dbc, workers + (checkpoint is not None), fast_load=fast_load)
+
+    def copy_routed(conn, table: str, block: pd.DataFrame):
+        if not partitions:
+            copy_frame(conn, table, block, commit=False)
+            return
+        for target, rows in split_by_partition(block, table, partitions):
+            copy_frame(conn, target, rows, commit=False)
+
+    def load_part(table: str, part: Any, label: str, sizer: Optional[ChunkSizer]):
+        conn = pool.getconn()
+        try:
+            with rec.stage(f'copy:{label}', rows=len(part)):
+                if checkpoint is not None and table in FACT_TABLES:
+                    for piece in order_slices(part):
+                        for block in sized_slices(piece, sizer):
+                            copy_routed(conn, table, block)
+                        checkpoint.chunk_done(conn, table, int(piece['order_id'].iloc[0]),
+                                              int(piece['order_id'].iloc[-1]), len(piece))
+                        conn.commit()
+                else:
+                    blocks = part.iter_frames() if isinstance(part, CostMatrix) else sized_slices(part, sizer)
+                    for block in blocks:
+                        copy_frame(conn, table, block, commit=False)
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn)
+
+    pending = {t.lower(): t for t in tables}
+    frames_key = dict(pending)
+    committed: Set[str] = set()
+    running: Dict[Future, str] = {}
+    remaining_parts: Dict[str, int] = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            while pending or running:
+                # Submit every table whose referenced tables are all committed
+                for key in sorted(pending):
+                    deps = graph.get(key, set()) & {t.lower() for t in tables}
+                    if deps <= committed:
+                        table = pending.pop(key)
+                        df = frames[table]
+                        split_key = SPLIT_KEYS.get(key)
+                        if isinstance(df, CostMatrix):
+                            parts = [(table, p) for p in df.split(workers)]
+                        elif checkpoint is not None and table in FACT_TABLES:
+                            parts = [(table, p) for p in split_frame(df, 'order_id', workers)]
+                        elif partitions and key in PARTITION_SPLIT_TABLES:
+                            parts = split_by_partition(df, table, partitions)
+                        else:
+                            parts = [(table, p) for p in (split_frame(df, split_key, workers) if split_key else [df])]
+                        remaining_parts[key] = len(parts)
+                        sizer = None
+                        if budget is not None and not isinstance(df, CostMatrix):
+                            sizer = budget.sizer(f'copy:{table}', csv_row_bytes(df), copies=workers)
+                        for i, (target, part) in enumerate(parts, start=1):
+                            if target != table:
+                                label = target
+                            else:
+                                label = table if len(parts) == 1 else f'{table}[{i}/{len(parts)}]'
+                            running[ex.submit(load_part, target, part, label, sizer)] = key
+                if not running:
+                    raise ValueError(f"Không thể xếp lịch nạp cho các bảng: {sorted(pending)}")
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    key = running.pop(fut)
+                    fut.result()  # re-raise loader errors
+                    remaining_parts[key] -= 1
+                    if remaining_parts[key] == 0:
+                        committed.add(key)
+                        print(f"Đã nạp {key}")
+                        if checkpoint is not None:
+                            conn = pool.getconn()
+                            try:
+                                checkpoint.table_done(conn, frames_key[key], len(frames[frames_key[key]]))
+                            finally:
+                                pool.putconn(conn)
+    finally:
+        pool.closeall()
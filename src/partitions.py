@@ -0,0 +1,158 @@
+"""Monthly / yearly range partitions of the fact tables (see schema_partitioned.sql).
+
+Partitions are named <table>_p<key>, key = yyyymm (month) or yyyy (year), and
+cover date_id in [key start, next key start). Every partition also carries an
+explicit CHECK constraint with its range, so a detached partition can be
+attached again without Postgres scanning it to validate the bound.
+
+Incremental refresh of a period:
+- detach_period(): detaches the period from all fact tables (order_items first,
+  because of the FK to orders); the tables stay as standalone tables,
+- attach_period(): attaches them back (orders first), instantly,
+- drop_period(): detaches and drops them.
+Detaching an orders partition runs one FK check against order_items (cheap:
+the matching items were detached first); everything else is catalog-only.
+
+Only psycopg2 is needed here (no pandas), so `main.py partitions` starts fast.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+PARTITION_GRANULARITIES = ('month', 'year')
+
+# Referenced table first: create/attach in this order, detach/drop in reverse
+PARTITIONED_TABLES = ['orders', 'product_daily_costs', 'order_items']
+
+
+@dataclass
+class PartitionRange:
+    key: int  # yyyymm or yyyy
+    lo: int   # lowest date_id (inclusive)
+    hi: int   # upper date_id bound (exclusive)
+
+    def name(self, table: str) -> str:
+        return f"{table}_p{self.key}"
+
+
+def period_range(key: int) -> PartitionRange:
+    """Range of a partition key: 6 digits = month (yyyymm), 4 digits = year (yyyy)."""
+    if len(str(key)) == 6:
+        y, m = divmod(key, 100)
+        nxt = (y + 1) * 100 + 1 if m == 12 else key + 1
+        return PartitionRange(key, key * 100, nxt * 100)
+    if len(str(key)) == 4:
+        return PartitionRange(key, key * 10000, (key + 1) * 10000)
+    raise ValueError(f"Khoá phân vùng không hợp lệ: {key} (yyyymm hoặc yyyy)")
+
+
+def partition_ranges(date_ids: Iterable[int], granularity: str) -> List[PartitionRange]:
+    """One range per month/year present in `date_ids` (yyyymmdd)."""
+    if granularity not in PARTITION_GRANULARITIES:
+        raise ValueError(f"Kiểu phân vùng không hỗ trợ: {granularity} (chọn {', '.join(PARTITION_GRANULARITIES)})")
+    div = 100 if granularity == 'month' else 10000
+    return [period_range(k) for k in sorted({int(d) // div for d in date_ids})]
+
+
+def create_partitioned_tables(conn):
+    """Replace the fact tables from schema.sql with partitioned parents (no partitions yet)."""
+    sql = Path(__file__).with_name('schema_partitioned.sql').read_text(encoding='utf-8')
+    with conn.cursor() as cur:
+        cur.execute(sql)
+    conn.commit()
+
+
+def create_partitions(conn, ranges: List[PartitionRange]):
+    """Create missing partitions of every fact table for `ranges`."""
+    with conn.cursor() as cur:
+        for table in PARTITIONED_TABLES:
+            for r in ranges:
+                name = r.name(table)
+                cur.execute(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                    f"(CONSTRAINT ck_{name}_range CHECK (date_id >= {r.lo} AND date_id < {r.hi})) "
+                    f"FOR VALUES FROM ({r.lo}) TO ({r.hi})"
+                )
+    conn.commit()
+
+
+def is_partitioned(conn, table: str) -> bool:
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+        row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def leaf_partitions(conn, table: str) -> List[str]:
+    """Attached partitions of `table` in range order ([table] itself when not partitioned)."""
+    if not is_partitioned(conn, table):
+        return [table]
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname
+            """,
+            (table,),
+        )
+        return [r[0] for r in cur.fetchall()]
+
+
+def list_partitions(conn) -> List[Tuple[str, str, str, int]]:
+    """(table, partition, bound or 'detached', estimated rows) for every <table>_p* relation."""
+    out = []
+    with conn.cursor() as cur:
+        for table in reversed(PARTITIONED_TABLES):
+            cur.execute(
+                """
+                SELECT c.relname, COALESCE(pg_get_expr(c.relpartbound, c.oid), 'detached'),
+                       GREATEST(c.reltuples, 0)::bigint
+                FROM pg_class c
+                WHERE c.relkind = 'r' AND c.relname ~ %s
+                ORDER BY c.relname
+                """,
+                (f'^{table}_p[0-9]+$',),
+            )
+            out += [(table, name, bound, rows) for name, bound, rows in cur.fetchall()]
+    return out
+
+
+def drop_detached(conn) -> List[str]:
+    """Drop leftover detached partitions (their FKs would block schema.sql dropping the parents)."""
+    names = [name for _, name, bound, _ in list_partitions(conn) if bound == 'detached']
+    with conn.cursor() as cur:
+        for name in names:
+            cur.execute(f"DROP TABLE {name}")
+    conn.commit()
+    return names
+
+
+def detach_period(conn, key: int):
+    r = period_range(key)
+    with conn.cursor() as cur:
+        for table in reversed(PARTITIONED_TABLES):
+            cur.execute(f"ALTER TABLE {table} DETACH PARTITION {r.name(table)}")
+    conn.commit()
+
+
+def attach_period(conn, key: int):
+    r = period_range(key)
+    with conn.cursor() as cur:
+        for table in PARTITIONED_TABLES:
+            cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {r.name(table)} FOR VALUES FROM ({r.lo}) TO ({r.hi})")
+    conn.commit()
+
+
+def drop_period(conn, key: int, detached: Optional[bool] = None):
+    """Drop a period's partitions (detaching them first unless they already are)."""
+    r = period_range(key)
+    with conn.cursor() as cur:
+        if detached is None:
+            cur.execute("SELECT relispartition FROM pg_class WHERE oid = to_regclass(%s)", (r.name('orders'),))
+            row = cur.fetchone()
+            detached = not (row and row[0])
+        for table in reversed(PARTITIONED_TABLES):
+            if not detached:
+                cur.execute(f"ALTER TABLE {table} DETACH PARTITION {r.name(table)}")
+            cur.execute(f"DROP TABLE {r.name(table)}")
+    conn.commit()
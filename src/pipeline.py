@@ -0,0 +1,160 @@
+"""Producer/consumer pipeline that overlaps order generation with loading.
+
+The producer (calling thread) pulls order/item chunks from iter_order_chunks()
+and puts them on a bounded queue; loader threads COPY each chunk into Postgres
+(orders then order_items, one transaction per chunk) on pooled connections.
+The queue bound provides back-pressure: at most `queue_size` chunks wait in
+memory, and full DataFrames for the whole run are never materialised. Since
+psycopg2 releases the GIL while waiting on the server, end-to-end time tends
+towards max(generation, load) instead of their sum.
+
+Generation stays in a single producer so the global RNG sequence (and thus the
+dataset for a given --seed) is identical to the non-pipelined path.
+
+With a LoadCheckpoint, each chunk's order_id range is recorded in the chunk's
+own transaction, and on --resume the rows of committed chunks are dropped
+before they reach the queue (they are still generated, for the RNGs and the
+KPI aggregates).
+"""
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from checkpoint import LoadCheckpoint
+from compress import ExportFile
+from generate_data import (DbConfig, TABLE_COLUMNS, combine_monthly_aggregates, copy_frame, insert_columns,
+                           monthly_store_aggregates)
+from instrumentation import StageRecorder
+from parallel_load import make_pool
+
+_STOP = None
+
+
+@dataclass
+class PipelineStats:
+    chunks: int = 0
+    orders: int = 0
+    items: int = 0
+    generate_s: float = 0.0
+    load_s: float = 0.0  # summed over loader threads
+    producer_wait_s: float = 0.0  # time the producer was blocked by back-pressure
+    skipped: int = 0  # chunks already committed by an interrupted run (--resume)
+
+
+def append_csv(df: pd.DataFrame, path: str, first: bool, compress: Optional[str] = None,
+               compress_threads: Optional[int] = None):
+    # Compressed appends add one gzip member / zstd frame per chunk
+    with ExportFile(path, compress, append=not first, threads=compress_threads) as f:
+        df.to_csv(f, index=False, header=first)
+
+
+def run_order_pipeline(dbc: DbConfig, chunks: Iterator[Tuple[pd.DataFrame, pd.DataFrame]], rec: StageRecorder,
+                       workers: int = 2, queue_size: int = 4, fast_load: bool = False,
+                       export_csv_dir: Optional[str] = None, compress: Optional[str] = None,
+                       compress_threads: Optional[int] = None, partitioned: bool = False,
+                       checkpoint: Optional[LoadCheckpoint] = None) -> pd.DataFrame:
+    """Generate and load orders concurrently. Returns the combined monthly store aggregates for KPI targets.
+    With `partitioned`, chunks are COPYed into the partitioned parents and Postgres routes rows by date_id."""
+    item_columns = insert_columns('order_items', partitioned)
+    workers = max(1, workers)
+    q: "queue.Queue[Optional[Tuple[pd.DataFrame, pd.DataFrame]]]" = queue.Queue(maxsize=max(1, queue_size))
+    stats = PipelineStats()
+    lock = threading.Lock()
+    errors: List[BaseException] = []
+    pool = make_pool(dbc, workers, fast_load=fast_load)
+
+    def consumer():
+        conn = pool.getconn()
+        try:
+            while True:
+                item = q.get()
+                if item is _STOP:
+                    return
+                if errors:
+                    continue  # drain so the producer never blocks forever
+                orders_df, items_df, (first, last) = item
+                t0 = time.perf_counter()
+                try:
+                    copy_frame(conn, 'orders', orders_df[TABLE_COLUMNS['orders']], commit=False)
+                    copy_frame(conn, 'order_items', items_df[item_columns], commit=False)
+                    if checkpoint is not None:
+                        checkpoint.chunk_done(conn, 'orders', first, last, len(orders_df))
+                        checkpoint.chunk_done(conn, 'order_items', first, last, len(items_df))
+                    conn.commit()
+                except BaseException as e:
+                    conn.rollback()
+                    errors.append(e)
+                    continue
+                with lock:
+                    stats.load_s += time.perf_counter() - t0
+        finally:
+            pool.putconn(conn)
+
+    threads = [threading.Thread(target=consumer, name=f'loader-{i+1}', daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+
+    def stop_loaders():
+        # One _STOP per loader; loaders keep draining the queue, so the puts never block for good
+        for _ in threads:
+            q.put(_STOP)
+        for t in threads:
+            t.join()
+        threads.clear()
+
+    partials: List[pd.DataFrame] = []
+    if export_csv_dir:
+        os.makedirs(export_csv_dir, exist_ok=True)
+    try:
+        with rec.stage('pipeline_orders') as st:
+            while not errors:
+                t0 = time.perf_counter()
+                try:
+                    orders_df, items_df = next(chunks)
+                except StopIteration:
+                    break
+                partials.append(monthly_store_aggregates(orders_df, items_df))
+                if export_csv_dir:
+                    first = len(partials) == 1
+                    for table, df in (('orders', orders_df), ('order_items', items_df)):
+                        append_csv(df, os.path.join(export_csv_dir, f'{table}.csv'), first, compress, compress_threads)
+                bounds = (int(orders_df['order_id'].iloc[0]), int(orders_df['order_id'].iloc[-1])) if len(orders_df) else (0, 0)
+                if checkpoint is not None:
+                    orders_df = checkpoint.pending_rows('orders', orders_df)
+                    items_df = checkpoint.pending_rows('order_items', items_df)
+                stats.generate_s += time.perf_counter() - t0
+                if orders_df.empty and items_df.empty:
+                    stats.skipped += 1
+                    continue
+                stats.chunks += 1
+                stats.orders += len(orders_df)
+                stats.items += len(items_df)
+                t1 = time.perf_counter()
+                q.put((orders_df, items_df, bounds))  # blocks when loaders fall behind
+                stats.producer_wait_s += time.perf_counter() - t1
+            stop_loaders()
+            st.rows = stats.orders + stats.items
+        if checkpoint is not None and not errors:
+            conn = pool.getconn()
+            try:
+                checkpoint.table_done(conn, 'orders', stats.orders)
+                checkpoint.table_done(conn, 'order_items', stats.items)
+            finally:
+                pool.putconn(conn)
+    finally:
+        stop_loaders()  # the producer may have failed: loaders must be gone before the pool is closed
+        pool.closeall()
+    if errors:
+        raise errors[0]
+    if stats.skipped:
+        print(f"Bỏ qua {stats.skipped} chunk đã nạp ở lần chạy trước (--resume)")
+
+    print(f"Pipeline: {stats.chunks} chunk, {stats.orders} orders, {stats.items} order_items; "
+          f"sinh dữ liệu {stats.generate_s:.2f}s, nạp {stats.load_s:.2f}s (tổng các luồng), "
+          f"chờ back-pressure {stats.producer_wait_s:.2f}s")
+    return combine_monthly_aggregates(partials)
@@ -58,13 +58,6 @@ CREATE TABLE IF NOT EXISTS products (
     gia_niem_yet NUMERIC(12,2) NOT NULL
 );
 
-CREATE TABLE IF NOT EXISTS employees (
-    id VARCHAR(50) PRIMARY KEY,
-    ho_ten VARCHAR(100) NOT NULL,
-    chuc_danh VARCHAR(100),
-    cua_hang_mac_dinh VARCHAR(100)
-);
-
 CREATE TABLE IF NOT EXISTS stores (
     id VARCHAR(50) PRIMARY KEY,
     ten_cua_hang VARCHAR(120) NOT NULL,
@@ -74,6 +67,13 @@ CREATE TABLE IF NOT EXISTS stores (
     mien VARCHAR(20)
 );
 
+CREATE TABLE IF NOT EXISTS employees (
+    id VARCHAR(50) PRIMARY KEY,
+    ho_ten VARCHAR(100) NOT NULL,
+    chuc_danh VARCHAR(100),
+    cua_hang_mac_dinh VARCHAR(50) REFERENCES stores(id) -- home store; offline orders use its staff
+);
+
 CREATE TABLE IF NOT EXISTS promotions (
     id VARCHAR(50) PRIMARY KEY,
     ten_chuong_trinh VARCHAR(200) NOT NULL,
@@ -102,6 +102,7 @@ CREATE TABLE IF NOT EXISTS order_items (
     khuyen_mai NUMERIC(12,2) NOT NULL DEFAULT 0, -- per-unit promotion amount
     chiet_khau NUMERIC(12,2) NOT NULL DEFAULT 0, -- per-unit discount amount
     doanh_thu NUMERIC(14,2) NOT NULL, -- line revenue = (unit price - promo - discount) * qty
+    gia_von NUMERIC(12,2), -- per-unit cost (COGS) on the order date, from product_daily_costs; NULL unless --cogs
     id VARCHAR(120) GENERATED ALWAYS AS (order_id::text || '-' || product_id) STORED,
     CONSTRAINT pk_order_items PRIMARY KEY (id),
     CONSTRAINT ck_item_discount CHECK ((khuyen_mai + chiet_khau) < don_gia)
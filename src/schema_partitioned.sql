@@ -0,0 +1,58 @@
+-- Partitioned fact tables (--partition-by month|year), applied after schema.sql.
+-- orders, order_items and product_daily_costs are recreated as tables partitioned
+-- by date_id range; the partitions themselves are created by partitions.py from the
+-- date dimension. Requires Postgres 13+ (row triggers on partitioned tables).
+--
+-- Differences from schema.sql:
+-- - primary keys include date_id (the partition key must be part of every unique key),
+-- - order_items carries its order's date_id, so an order and its items live in
+--   partitions of the same period and the FK is (order_id, date_id).
+
+DROP TABLE IF EXISTS product_daily_costs;
+DROP TABLE IF EXISTS order_items;
+DROP TABLE IF EXISTS orders;
+
+CREATE TABLE IF NOT EXISTS orders (
+    order_id BIGSERIAL,
+    date_id INT NOT NULL REFERENCES dates(date_id),
+    customer_id VARCHAR(50) REFERENCES customers(id),
+    employee_id VARCHAR(50) REFERENCES employees(id),
+    store_id VARCHAR(50) REFERENCES stores(id),
+    channel VARCHAR(10) NOT NULL DEFAULT 'Offline', -- Online | Offline
+    CONSTRAINT pk_orders PRIMARY KEY (order_id, date_id)
+) PARTITION BY RANGE (date_id);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    order_id BIGINT NOT NULL,
+    date_id INT NOT NULL, -- date of the order (partition alignment)
+    product_id VARCHAR(50) NOT NULL REFERENCES products(id),
+    promotion_id VARCHAR(50) REFERENCES promotions(id),
+    so_luong INT NOT NULL,
+    don_gia NUMERIC(12,2) NOT NULL,
+    khuyen_mai NUMERIC(12,2) NOT NULL DEFAULT 0,
+    chiet_khau NUMERIC(12,2) NOT NULL DEFAULT 0,
+    doanh_thu NUMERIC(14,2) NOT NULL,
+    gia_von NUMERIC(12,2),
+    id VARCHAR(120) GENERATED ALWAYS AS (order_id::text || '-' || product_id) STORED,
+    CONSTRAINT pk_order_items PRIMARY KEY (id, date_id),
+    CONSTRAINT fk_order_items_order FOREIGN KEY (order_id, date_id) REFERENCES orders(order_id, date_id) ON DELETE CASCADE,
+    CONSTRAINT ck_item_discount CHECK ((khuyen_mai + chiet_khau) < don_gia)
+) PARTITION BY RANGE (date_id);
+CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id);
+
+CREATE TRIGGER trg_order_items_discount_vs_list
+BEFORE INSERT OR UPDATE ON order_items
+FOR EACH ROW EXECUTE FUNCTION enforce_item_discount_vs_list_price();
+
+CREATE TABLE IF NOT EXISTS product_daily_costs (
+    product_id VARCHAR(50) NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    date_id INT NOT NULL REFERENCES dates(date_id) ON DELETE CASCADE,
+    cost NUMERIC(12,2) NOT NULL,
+    CONSTRAINT pk_product_daily_costs PRIMARY KEY (product_id, date_id)
+) PARTITION BY RANGE (date_id);
+CREATE INDEX IF NOT EXISTS idx_pdc_product ON product_daily_costs(product_id);
+CREATE INDEX IF NOT EXISTS idx_pdc_date ON product_daily_costs(date_id);
+
+CREATE TRIGGER trg_product_cost_smoothness
+BEFORE INSERT OR UPDATE ON product_daily_costs
+FOR EACH ROW EXECUTE FUNCTION enforce_product_cost_smoothness();
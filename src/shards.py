@@ -0,0 +1,485 @@
+"""Sharded generation across machines: plan -> generate --shard i/N -> merge.
+
+`main.py plan --shards N --plan-dir DIR` builds the dimensions once and splits
+the orders of the run into N shards of consecutive months, balanced by
+expected order volume (days per month, or the demand model's date weights).
+Each shard gets a disjoint order_id range, its order count and its own seed.
+DIR then holds:
+- plan.json: the generation config, seeds and shard specs,
+- dimensions.pkl: the dimension tables every node reuses (sha256 in plan.json).
+With a database the plan step also creates the schema (and partitions) and
+loads the dimensions once; with --no-db it writes the dimension files.
+
+`main.py generate --shard i/N --plan-dir DIR` (on any node, any order) draws
+only shard i: facts go to <out-dir>/shard-i-of-N/ or are COPYed into Postgres
+(rows land in the shard's own partitions with --partition-by). The node writes
+manifests/shard-i-of-N.json with row counts, an order-independent checksum of
+the rows, sha256 of the files and the shard's partial monthly aggregates.
+
+`main.py merge --plan-dir DIR` checks every manifest against the plan, reads
+the shard's rows back (its files, or its order_id range in Postgres) to
+recompute the row counts and checksums, and builds KPI_Target_Monthly from the
+partial aggregates; each order belongs to exactly one shard, so sums and
+distinct order counts add up.
+
+A shard is reproducible: re-running it gives the same rows. Shard boundaries
+do change the RNG streams, so a sharded dataset differs from a single-node
+run with the same seed.
+"""
+import hashlib
+import json
+import os
+import socket
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import Config, DbConfig
+from db_read import DEFAULT_ITERSIZE, iter_query_batches
+from demand import date_weights, load_demand_model
+from generate_data import (TABLE_COLUMNS, Dimensions, build_dimensions, combine_monthly_aggregates,
+                           create_fact_partitions, create_schema, dimension_frames, ensure_database,
+                           finish_metrics, get_conn, insert_columns, insert_dim, iter_order_chunks,
+                           kpi_targets_from_monthly, load_tables_sequential, monthly_store_aggregates,
+                           order_builder_args, run_sql, seed_everything, submit_dimensions, truncate_tables)
+from instrumentation import StageRecorder
+
+PLAN_FILE = 'plan.json'
+DIMS_FILE = 'dimensions.pkl'
+MANIFEST_DIR = 'manifests'
+PLAN_VERSION = 1
+FACT_TABLES = ['orders', 'order_items']
+# Fact columns checksummed as text; every other checksummed column is a number
+CHECKSUM_TEXT_COLUMNS = {'customer_id', 'employee_id', 'store_id', 'channel', 'product_id', 'promotion_id'}
+
+# Node-level settings a shard keeps from its own command line; everything else comes from the plan
+EXECUTION_FIELDS = {
+    'output_dir', 'compress', 'compress_threads', 'load_workers', 'chunk_size', 'queue_size',
+    'memory_budget', 'metrics_json', 'profile_dir',
+}
+
+
+@dataclass
+class ShardSpec:
+    index: int  # 1-based
+    count: int
+    month_lo: int  # first month (yyyymm)
+    month_hi: int  # last month (yyyymm), inclusive
+    first_order_id: int
+    orders: int
+    seed: int
+
+    @property
+    def name(self) -> str:
+        return f"shard-{self.index}-of-{self.count}"
+
+    @property
+    def last_order_id(self) -> int:
+        return self.first_order_id + self.orders - 1
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """'2/8' -> (2, 8)."""
+    try:
+        i, n = (int(x) for x in text.split('/'))
+    except ValueError:
+        raise ValueError(f"--shard phải có dạng i/N, ví dụ 2/8 (nhận: {text})")
+    if not 1 <= i <= n:
+        raise ValueError(f"--shard {text}: cần 1 <= i <= N")
+    return i, n
+
+
+def month_weights(date_df: pd.DataFrame, demand_model: Optional[str]) -> pd.Series:
+    """Expected relative order volume per month (yyyymm), as the generator draws dates."""
+    demand = load_demand_model(demand_model)
+    w = date_weights(date_df, demand) if demand is not None else np.ones(len(date_df))
+    months = date_df['date_id'].to_numpy() // 100
+    return pd.Series(w, index=months).groupby(level=0).sum()
+
+
+def split_months(weights: pd.Series, shards: int) -> List[Tuple[int, int]]:
+    """Cut the months into `shards` contiguous ranges of roughly equal weight."""
+    months = weights.index.tolist()
+    if shards > len(months):
+        raise ValueError(f"Không thể chia {len(months)} tháng thành {shards} shard")
+    cum = weights.cumsum().to_numpy() / weights.sum()
+    cuts, start = [], 0
+    for k in range(1, shards):
+        # Last month of range k: closest cumulative share to k/shards, leaving a month for every later shard
+        end = int(np.argmin(np.abs(cum - k / shards)))
+        end = min(max(end, start), len(months) - 1 - (shards - k))
+        cuts.append((months[start], months[end]))
+        start = end + 1
+    cuts.append((months[start], months[-1]))
+    return cuts
+
+
+def allocate(total: int, weights: List[float]) -> List[int]:
+    """Split `total` proportionally to weights (largest remainder, sums exactly to total)."""
+    w = np.asarray(weights, dtype=float)
+    exact = total * w / w.sum()
+    counts = np.floor(exact).astype(int)
+    for i in np.argsort(-(exact - counts))[:total - counts.sum()]:
+        counts[i] += 1
+    return counts.tolist()
+
+
+def checksum_layout(df: pd.DataFrame) -> pd.DataFrame:
+    """Rows in a form that does not depend on where they were read from: text as str/None,
+    numbers (ints, floats, NUMERIC Decimals, CSV text) as float64 in hundredths."""
+    out = {}
+    for c in df.columns:
+        if c in CHECKSUM_TEXT_COLUMNS:
+            col = df[c].astype(object)
+            out[c] = col.where(col.notna(), None)
+        else:
+            out[c] = np.rint(pd.to_numeric(df[c]).to_numpy(dtype=np.float64) * 100)
+    return pd.DataFrame(out, index=df.index)
+
+
+def frame_checksum(df: pd.DataFrame) -> int:
+    """Order-independent checksum of the rows: sum (mod 2^64) of pandas' per-row hashes."""
+    if df.empty:
+        return 0
+    hashes = pd.util.hash_pandas_object(checksum_layout(df), index=False).to_numpy()
+    return int(np.add.reduce(hashes, dtype=np.uint64))
+
+
+def batches_checksum(batches: Iterator[pd.DataFrame]) -> Tuple[int, int]:
+    """(rows, checksum) over a stream of frames; equal to a single frame_checksum of all rows."""
+    rows, checksum = 0, 0
+    for df in batches:
+        rows += len(df)
+        checksum = (checksum + frame_checksum(df)) % (1 << 64)
+    return rows, checksum
+
+
+def iter_file_rows(path: str, columns: List[str], itersize: int = DEFAULT_ITERSIZE) -> Iterator[pd.DataFrame]:
+    """Read `columns` of a shard file (CSV, possibly .gz/.zst, or Parquet) in batches."""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=itersize, columns=columns):
+            yield batch.to_pandas()
+        return
+    text = {c: str for c in columns if c in CHECKSUM_TEXT_COLUMNS}
+    with pd.read_csv(path, usecols=columns, dtype=text, encoding='utf-8-sig', chunksize=itersize) as reader:
+        for df in reader:
+            yield df[columns]
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+@dataclass
+class ShardTally:
+    """Rows, checksums, id/date bounds and monthly aggregates of the facts a shard produced."""
+    rows: Dict[str, int] = field(default_factory=lambda: {t: 0 for t in FACT_TABLES})
+    checksums: Dict[str, int] = field(default_factory=lambda: {t: 0 for t in FACT_TABLES})
+    order_ids: List[int] = field(default_factory=list)  # [min, max]
+    date_ids: List[int] = field(default_factory=list)
+    partials: List[pd.DataFrame] = field(default_factory=list)
+
+    def add(self, orders_df: pd.DataFrame, items_df: pd.DataFrame, item_columns: List[str]):
+        for table, df in (('orders', orders_df), ('order_items', items_df)):
+            self.rows[table] += len(df)
+            # Over the columns every output has (files add order_items.id, partitions add date_id)
+            self.checksums[table] = (self.checksums[table] + frame_checksum(df[TABLE_COLUMNS[table]])) % (1 << 64)
+        if len(orders_df):
+            for bounds, col in ((self.order_ids, 'order_id'), (self.date_ids, 'date_id')):
+                lo, hi = int(orders_df[col].min()), int(orders_df[col].max())
+                bounds[:] = [min(lo, bounds[0]), max(hi, bounds[1])] if bounds else [lo, hi]
+        self.partials.append(monthly_store_aggregates(orders_df, items_df))
+
+
+def plan_path(plan_dir: str, name: str = PLAN_FILE) -> str:
+    return os.path.join(plan_dir, name)
+
+
+def manifest_path(plan_dir: str, spec: ShardSpec) -> str:
+    return os.path.join(plan_dir, MANIFEST_DIR, f"{spec.name}.json")
+
+
+def write_json(path: str, data: Dict[str, Any]):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def load_plan(plan_dir: str) -> Tuple[Dict[str, Any], List[ShardSpec]]:
+    with open(plan_path(plan_dir), encoding='utf-8') as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f"Phiên bản plan không hỗ trợ: {plan.get('version')}")
+    return plan, [ShardSpec(**s) for s in plan['shards']]
+
+
+def plan_config(plan: Dict[str, Any], cfg: Config) -> Config:
+    """The plan's generation config, keeping the node's execution settings (EXECUTION_FIELDS)."""
+    merged = Config(**{k: v for k, v in plan['config'].items() if k in {f.name for f in fields(Config)}})
+    for name in EXECUTION_FIELDS:
+        value = getattr(cfg, name)
+        if value is not None and value != getattr(Config, name, None):
+            setattr(merged, name, value)
+    return merged
+
+
+def make_plan(cfg: Config, dbc: DbConfig, shards: int, plan_dir: str, rec: Optional[StageRecorder] = None):
+    """Build the dimensions once, split the run into shards and write plan.json + dimensions.pkl."""
+    rec = rec if rec is not None else StageRecorder(profile_dir=cfg.profile_dir)
+    if shards < 1:
+        raise ValueError("--shards phải >= 1")
+    if cfg.no_db and cfg.output_format not in ('csv', 'parquet'):
+        # Manifests checksum one file per table; sqlite/duckdb keep every table in one database
+        raise ValueError(f"Shard với --no-db chỉ hỗ trợ --format csv hoặc parquet (không phải {cfg.output_format})")
+    if cfg.seed is None:
+        cfg.seed = int(np.random.SeedSequence().generate_state(1)[0])  # recorded so the plan is reproducible
+    seeds = np.random.SeedSequence(cfg.seed).spawn(shards + 2)
+    setup_seed = int(seeds[0].generate_state(1)[0])
+    total = int(np.random.default_rng(seeds[1]).integers(cfg.min_rows, cfg.max_rows, endpoint=True))
+
+    print(f"[1/3] Tạo dữ liệu dimension (seed {cfg.seed})…")
+    seed_everything(cfg.seed)
+    dims = build_dimensions(cfg, rec)
+    os.makedirs(plan_dir, exist_ok=True)
+    dims_path = plan_path(plan_dir, DIMS_FILE)
+    with rec.stage('write_dimensions_pickle'):
+        pd.to_pickle(dims, dims_path)
+
+    weights = month_weights(dims.date_df, cfg.demand_model)
+    ranges = split_months(weights, shards)
+    counts = allocate(total, [weights.loc[lo:hi].sum() for lo, hi in ranges])
+    specs, first = [], 1
+    for i, ((lo, hi), n) in enumerate(zip(ranges, counts), start=1):
+        specs.append(ShardSpec(i, shards, lo, hi, first, n, int(seeds[i + 1].generate_state(1)[0])))
+        first += n
+    plan = {
+        'version': PLAN_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'setup_seed': setup_seed,
+        'total_orders': total,
+        'dimensions_sha256': file_sha256(dims_path),
+        'config': asdict(cfg),
+        'shards': [asdict(s) for s in specs],
+    }
+    plan['plan_id'] = hashlib.sha256(json.dumps(plan, sort_keys=True).encode()).hexdigest()[:16]
+    write_json(plan_path(plan_dir), plan)
+    print(f"Đã lập plan {plan['plan_id']}: {total} orders, {shards} shard -> {plan_path(plan_dir)}")
+    for s in specs:
+        print(f"  {s.name}: tháng {s.month_lo}-{s.month_hi}, order_id {s.first_order_id}-{s.last_order_id} "
+              f"({s.orders} orders)")
+
+    print("[2/3] Ghi các bảng dimension dùng chung…")
+    if cfg.no_db:
+        from sinks import BackgroundWriter, open_file_sink
+        out_dir = cfg.output_dir or cfg.export_csv_dir
+        if not out_dir:
+            raise ValueError("Cần --out-dir khi dùng --no-db")
+        writer = BackgroundWriter(open_file_sink(cfg.output_format, out_dir, cfg.compress, cfg.compress_threads),
+                                  max_pending=cfg.queue_size)
+        try:
+            submit_dimensions(writer, dims)
+        finally:
+            with rec.stage('flush_files') as st:
+                st.rows = sum(writer.close().values())
+    else:
+        ensure_database(dbc)
+        with get_conn(dbc) as conn:
+            with rec.stage('create_schema'):
+                create_schema(conn, cfg.partition_by)
+            with rec.stage('truncate_tables'):
+                truncate_tables(conn)
+            if cfg.partition_by:
+                with rec.stage('create_partitions') as st:
+                    st.rows = len(create_fact_partitions(conn, dims.date_df, cfg.partition_by))
+            load_tables_sequential(conn, dimension_frames(dims), rec)
+    print("[3/3] Chạy trên từng máy: python main.py generate --shard i/N --plan-dir <thư_mục>, "
+          "sau đó: python main.py merge --plan-dir <thư_mục>")
+    finish_metrics(rec, cfg)
+
+
+def run_shard(cfg: Config, dbc: DbConfig, plan_dir: str, shard: str, rec: Optional[StageRecorder] = None):
+    """Generate one shard of a plan to files or Postgres and write its manifest."""
+    plan, specs = load_plan(plan_dir)
+    index, count = parse_shard(shard)
+    if count != len(specs):
+        raise ValueError(f"Plan có {len(specs)} shard, không phải {count}")
+    spec = specs[index - 1]
+    cfg = plan_config(plan, cfg)
+    rec = rec if rec is not None else StageRecorder(profile_dir=cfg.profile_dir)
+
+    dims_path = plan_path(plan_dir, DIMS_FILE)
+    with rec.stage('read_dimensions_pickle'):
+        if file_sha256(dims_path) != plan['dimensions_sha256']:
+            raise ValueError(f"{dims_path} không khớp checksum trong plan")
+        dims: Dimensions = pd.read_pickle(dims_path)
+    print(f"{spec.name}: tháng {spec.month_lo}-{spec.month_hi}, {spec.orders} orders "
+          f"(order_id {spec.first_order_id}-{spec.last_order_id})")
+
+    # Same setup RNG stream on every node, then the shard's own seed (see iter_order_chunks)
+    seed_everything(plan['setup_seed'])
+    order_args, order_kwargs = order_builder_args(cfg, dims)
+    item_columns = insert_columns('order_items', cfg.partition_by is not None)
+    tally = ShardTally()
+
+    def tallied(chunks):
+        for orders_df, items_df in chunks:
+            tally.add(orders_df, items_df, item_columns)
+            yield orders_df, items_df
+
+    chunks = tallied(iter_order_chunks(*order_args, **order_kwargs, chunk_size=cfg.chunk_size, shard=spec))
+    files: Dict[str, Dict[str, Any]] = {}
+    if cfg.no_db:
+        from sinks import BackgroundWriter, open_file_sink
+        out_root = cfg.output_dir or cfg.export_csv_dir
+        if not out_root:
+            raise ValueError("Cần --out-dir khi dùng --no-db")
+        sink = open_file_sink(cfg.output_format, os.path.join(out_root, spec.name), cfg.compress, cfg.compress_threads)
+        writer = BackgroundWriter(sink, max_pending=cfg.queue_size)
+        try:
+            with rec.stage('generate_orders') as st:
+                for orders_df, items_df in chunks:
+                    writer.submit('orders', orders_df[TABLE_COLUMNS['orders']])
+                    writer.submit('order_items', items_df[TABLE_COLUMNS['order_items']])
+                st.rows = sum(tally.rows.values())
+        finally:
+            with rec.stage('flush_files'):
+                writer.close()
+        with rec.stage('checksum_files'):
+            for table in FACT_TABLES:
+                path = sink.path(table)
+                if os.path.exists(path):
+                    files[table] = {'path': os.path.relpath(path, out_root), 'bytes': os.path.getsize(path),
+                                    'sha256': file_sha256(path)}
+    else:
+        from pipeline import run_order_pipeline
+        run_order_pipeline(dbc, chunks, rec, workers=max(1, cfg.load_workers), queue_size=cfg.queue_size,
+                           partitioned=cfg.partition_by is not None)
+
+    monthly = combine_monthly_aggregates(tally.partials)
+    manifest = {
+        'plan_id': plan['plan_id'],
+        'shard': asdict(spec),
+        'mode': 'files' if cfg.no_db else 'db',
+        'host': socket.gethostname(),
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+        'rows': tally.rows,
+        'checksums': {t: f"{c:016x}" for t, c in tally.checksums.items()},
+        'order_ids': tally.order_ids,
+        'date_ids': tally.date_ids,
+        'files': files,
+        'monthly_aggregates': json.loads(monthly.to_json(orient='records')),
+    }
+    write_json(manifest_path(plan_dir, spec), manifest)
+    print(f"Đã ghi manifest -> {manifest_path(plan_dir, spec)} "
+          f"({tally.rows['orders']} orders, {tally.rows['order_items']} order_items)")
+    finish_metrics(rec, cfg)
+
+
+def verify_manifest(plan: Dict[str, Any], spec: ShardSpec, manifest: Optional[Dict[str, Any]],
+                    out_root: Optional[str], conn=None) -> List[str]:
+    """Problems found for one shard (empty list = OK)."""
+    if manifest is None:
+        return ['thiếu manifest']
+    errors = []
+    if manifest['plan_id'] != plan['plan_id']:
+        errors.append(f"plan_id {manifest['plan_id']} khác plan {plan['plan_id']}")
+    if manifest['shard'] != asdict(spec):
+        errors.append('thông số shard khác plan')
+    if manifest['rows']['orders'] != spec.orders:
+        errors.append(f"{manifest['rows']['orders']} orders, plan là {spec.orders}")
+    if spec.orders and manifest['order_ids'] and not (
+            spec.first_order_id <= manifest['order_ids'][0] and manifest['order_ids'][1] <= spec.last_order_id):
+        errors.append(f"order_id {manifest['order_ids']} ngoài khoảng của shard")
+    if spec.orders and manifest['date_ids'] and not (
+            spec.month_lo <= manifest['date_ids'][0] // 100 and manifest['date_ids'][1] // 100 <= spec.month_hi):
+        errors.append(f"date_id {manifest['date_ids']} ngoài các tháng của shard")
+    found: Dict[str, Tuple[int, int]] = {}  # table -> (rows, checksum) read back
+    if manifest['mode'] == 'files':
+        for table, info in manifest['files'].items():
+            path = os.path.join(out_root or '', info['path'])
+            if not os.path.exists(path):
+                errors.append(f"thiếu file {path}")
+            elif os.path.getsize(path) != info['bytes'] or file_sha256(path) != info['sha256']:
+                errors.append(f"{path} sai checksum")
+            else:
+                found[table] = batches_checksum(iter_file_rows(path, TABLE_COLUMNS[table]))
+        where = 'file'
+    elif conn is not None:
+        for table in FACT_TABLES:
+            sql = (f"SELECT {', '.join(TABLE_COLUMNS[table])} FROM {table} "
+                   f"WHERE order_id BETWEEN %s AND %s")
+            found[table] = batches_checksum(iter_query_batches(conn, sql, (spec.first_order_id, spec.last_order_id)))
+        where = 'DB'
+    for table, (n, checksum) in found.items():
+        if n != manifest['rows'][table]:
+            errors.append(f"{table}: {n} dòng trong {where}, manifest ghi {manifest['rows'][table]}")
+        elif f"{checksum:016x}" != manifest['checksums'][table]:
+            errors.append(f"{table}: checksum dòng trong {where} là {checksum:016x}, "
+                          f"manifest ghi {manifest['checksums'][table]}")
+    return errors
+
+
+def merge_shards(cfg: Config, dbc: DbConfig, plan_dir: str, rec: Optional[StageRecorder] = None) -> bool:
+    """Verify every shard manifest and write KPI_Target_Monthly from the partial aggregates."""
+    plan, specs = load_plan(plan_dir)
+    cfg = plan_config(plan, cfg)
+    rec = rec if rec is not None else StageRecorder(profile_dir=cfg.profile_dir)
+    out_root = cfg.output_dir or cfg.export_csv_dir
+    manifests: Dict[int, Optional[Dict[str, Any]]] = {}
+    for spec in specs:
+        path = manifest_path(plan_dir, spec)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                manifests[spec.index] = json.load(f)
+        else:
+            manifests[spec.index] = None
+
+    conn = None if cfg.no_db else get_conn(dbc)
+    try:
+        with rec.stage('verify_manifests'):
+            problems = {s.index: verify_manifest(plan, s, manifests[s.index], out_root, conn) for s in specs}
+        ok = not any(problems.values())
+        print(f"Kiểm tra {len(specs)} shard của plan {plan['plan_id']}:")
+        for spec in specs:
+            m = manifests[spec.index]
+            rows = f"{m['rows']['orders']} orders, {m['rows']['order_items']} order_items" if m else '-'
+            print(f"  {spec.name:<16} {'OK' if not problems[spec.index] else 'LỖI':<4} {rows}")
+            for p in problems[spec.index]:
+                print(f"      - {p}")
+        if not ok:
+            print("Merge dừng lại: cần chạy lại các shard bị lỗi.")
+            return False
+
+        with rec.stage('build_kpi_targets') as st:
+            parts = [pd.DataFrame.from_records(m['monthly_aggregates']) for m in manifests.values() if m]
+            target_df = kpi_targets_from_monthly(combine_monthly_aggregates([p for p in parts if not p.empty]))
+            st.rows = len(target_df)
+        target_df = target_df[TABLE_COLUMNS['KPI_Target_Monthly']]
+        if cfg.no_db:
+            from sinks import open_file_sink
+            sink = open_file_sink(cfg.output_format, out_root, cfg.compress, cfg.compress_threads)
+            sink.write('KPI_Target_Monthly', target_df)
+            sink.close()
+            print(f"Đã ghi KPI_Target_Monthly ({len(target_df)} dòng) -> {sink.path('KPI_Target_Monthly')}")
+        else:
+            run_sql(conn, "TRUNCATE TABLE KPI_Target_Monthly RESTART IDENTITY CASCADE;")
+            with rec.stage('insert_dim:KPI_Target_Monthly', rows=len(target_df)):
+                insert_dim(conn, 'KPI_Target_Monthly', target_df)
+            print(f"Đã nạp KPI_Target_Monthly ({len(target_df)} dòng)")
+    finally:
+        if conn is not None:
+            conn.close()
+    total = sum(m['rows']['orders'] for m in manifests.values())
+    print(f"Merge hoàn tất: {total} orders từ {len(specs)} shard.")
+    finish_metrics(rec, cfg)
+    return True
@@ -0,0 +1,461 @@
+"""File sinks for writing generated tables without a database.
+
+Tables arrive as chunks of DataFrames in DB insert layout (TABLE_COLUMNS) and
+are written in the same layout `export_tables_to_csv` produces from Postgres:
+serial ids (customer_child.id, KPI_Target_Monthly.kpi_target_id) and the
+generated order_items.id are computed client-side, NUMERIC columns use two
+decimals and booleans are written as t/f. CSV files are UTF-8 with BOM.
+With compression, CSV is streamed through compress.ExportFile (.csv.gz/.csv.zst)
+and Parquet uses the same codec for its column chunks.
+
+The embedded databases (SQLite, DuckDB) get one file <out_dir>/bi_sales.<ext>
+with the tables of schema.sql (translate_schema): SERIAL becomes a plain
+integer, the generated order_items.id is filled client-side, and the
+PL/pgSQL triggers and foreign keys become post-load checks (DatabaseSink.check).
+
+Writes run on a background thread (BackgroundWriter) fed by a bounded queue,
+so generation continues while the previous chunk is formatted and flushed.
+"""
+import os
+import queue
+import re
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from compress import ExportFile, compressed_path
+from generate_data import TABLE_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, only needed for --format parquet
+    pa = None
+    pq = None
+
+try:
+    import duckdb
+except ImportError:  # optional dependency, only needed for --format duckdb
+    duckdb = None
+
+# Columns in the order COPY ... TO STDOUT returns them (see schema.sql)
+DB_COLUMNS: Dict[str, List[str]] = dict(TABLE_COLUMNS)
+DB_COLUMNS['customer_child'] = ['id'] + TABLE_COLUMNS['customer_child']
+DB_COLUMNS['order_items'] = TABLE_COLUMNS['order_items'] + ['id']
+DB_COLUMNS['KPI_Target_Monthly'] = ['kpi_target_id'] + TABLE_COLUMNS['KPI_Target_Monthly']
+
+# SERIAL / BIGSERIAL primary keys assigned by Postgres on insert
+SERIAL_COLUMNS = {
+    'customer_child': 'id',
+    'KPI_Target_Monthly': 'kpi_target_id',
+}
+
+# NUMERIC(p,2) columns, rendered with two decimals like Postgres does
+NUMERIC_COLUMNS = {
+    'products': ['gia_niem_yet'],
+    'promotions': ['gia_tri'],
+    'product_daily_costs': ['cost'],
+    'order_items': ['don_gia', 'khuyen_mai', 'chiet_khau', 'doanh_thu', 'gia_von'],
+    'KPI_Target_Monthly': ['doanh_thu'],
+}
+
+BOOLEAN_COLUMNS = {
+    'dates': ['is_weekend'],
+}
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+DATABASE_FILE = 'bi_sales'  # <out_dir>/bi_sales.sqlite | .duckdb
+COST_CHECK_PRODUCTS = 200  # products per batch of the 365-day cost range check
+
+
+def order_item_ids(df: pd.DataFrame) -> pd.Series:
+    """Client-side equivalent of order_items.id GENERATED AS (order_id::text || '-' || product_id)."""
+    return df['order_id'].astype(str) + '-' + df['product_id'].astype(str)
+
+
+class FileSink(ABC):
+    """Base class: converts chunks to DB layout and hands them to write_frame()."""
+    extension = ''
+
+    def __init__(self, out_dir: str, compress: Optional[str] = None, compress_threads: Optional[int] = None):
+        self.out_dir = out_dir
+        self.compress = compress
+        self.compress_threads = compress_threads
+        os.makedirs(out_dir, exist_ok=True)
+        self.rows: Dict[str, int] = {}
+
+    def path(self, table: str) -> str:
+        return os.path.join(self.out_dir, f"{table}{self.extension}")
+
+    def to_db_layout(self, table: str, df: pd.DataFrame) -> pd.DataFrame:
+        out = df.copy()
+        serial = SERIAL_COLUMNS.get(table)
+        if serial:
+            start = self.rows.get(table, 0) + 1
+            out[serial] = range(start, start + len(out))
+        if table == 'order_items':
+            out['id'] = order_item_ids(out)
+        return out[DB_COLUMNS.get(table, list(out.columns))]
+
+    def write(self, table: str, df: pd.DataFrame):
+        first = table not in self.rows
+        self.write_frame(table, self.to_db_layout(table, df), first)
+        self.rows[table] = self.rows.get(table, 0) + len(df)
+
+    @abstractmethod
+    def write_frame(self, table: str, df: pd.DataFrame, first: bool):
+        ...
+
+    def close(self):
+        pass
+
+
+class CsvSink(FileSink):
+    extension = '.csv'
+
+    def __init__(self, out_dir: str, compress: Optional[str] = None, compress_threads: Optional[int] = None):
+        super().__init__(out_dir, compress, compress_threads)
+        self.files: Dict[str, ExportFile] = {}
+        self.handles: Dict[str, Any] = {}
+        self.write_s: Dict[str, float] = {}  # formatting + compression time, for the throughput report
+
+    def path(self, table: str) -> str:
+        return compressed_path(super().path(table), self.compress)
+
+    def write_frame(self, table: str, df: pd.DataFrame, first: bool):
+        t0 = time.perf_counter()
+        if first:
+            # utf-8-sig writes the BOM once at the start of the file
+            self.files[table] = ExportFile(super().path(table), self.compress, encoding='utf-8-sig',
+                                           threads=self.compress_threads)
+            self.handles[table] = self.files[table].open()
+        for c in NUMERIC_COLUMNS.get(table, []):
+            df[c] = df[c].astype(float)
+        for c in BOOLEAN_COLUMNS.get(table, []):
+            df[c] = df[c].map({True: 't', False: 'f'})
+        df.to_csv(self.handles[table], index=False, header=first, float_format='%.2f')
+        self.write_s[table] = self.write_s.get(table, 0.0) + time.perf_counter() - t0
+
+    def close(self):
+        for table, f in self.files.items():
+            t0 = time.perf_counter()
+            f.close()
+            if self.compress:
+                f.stats.seconds = self.write_s.get(table, 0.0) + time.perf_counter() - t0
+                print('  ' + f.stats.report(f"{table} ({self.compress})"))
+        self.files.clear()
+        self.handles.clear()
+
+
+class ParquetSink(FileSink):
+    extension = '.parquet'
+
+    def __init__(self, out_dir: str, compress: Optional[str] = None, compress_threads: Optional[int] = None):
+        if pa is None:
+            raise ImportError("Cần cài pyarrow để ghi Parquet: pip install pyarrow")
+        super().__init__(out_dir, compress, compress_threads)
+        self.writers: Dict[str, Any] = {}
+
+    def write_frame(self, table: str, df: pd.DataFrame, first: bool):
+        # Pin text columns to string so chunks whose values are all NULL keep the same schema
+        for c in df.columns:
+            if df[c].dtype == object and pd.api.types.infer_dtype(df[c], skipna=True) in ('string', 'empty'):
+                df[c] = df[c].astype('string')
+        if first:
+            arrow = pa.Table.from_pandas(df, preserve_index=False)
+            # Parquet compresses column chunks itself (snappy unless --compress is given)
+            self.writers[table] = pq.ParquetWriter(self.path(table), arrow.schema,
+                                                   compression=self.compress or 'snappy')
+        else:
+            arrow = pa.Table.from_pandas(df, schema=self.writers[table].schema, preserve_index=False)
+        self.writers[table].write_table(arrow)
+
+    def close(self):
+        for w in self.writers.values():
+            w.close()
+        self.writers.clear()
+
+
+@dataclass
+class TranslatedSchema:
+    """schema.sql for a backend without PL/pgSQL (see translate_schema)."""
+    tables: List[str] = field(default_factory=list)  # CREATE TABLE, run before the load
+    indexes: List[str] = field(default_factory=list)  # CREATE INDEX, run after the load
+    foreign_keys: List[Tuple[str, str, str, str]] = field(default_factory=list)  # table, column, parent, parent column
+    triggers: List[str] = field(default_factory=list)  # dropped triggers, replaced by post-load checks
+
+
+FUNCTION_RE = re.compile(r'CREATE OR REPLACE FUNCTION.*?\$\$ LANGUAGE plpgsql;', re.S | re.I)
+TRIGGER_RE = re.compile(r'CREATE TRIGGER (\w+)', re.I)
+TABLE_RE = re.compile(r'CREATE TABLE IF NOT EXISTS (\w+)', re.I)
+REFERENCES_RE = re.compile(r'\s+REFERENCES\s+(\w+)\s*\((\w+)\)(?:\s+ON\s+DELETE\s+\w+)?', re.I)
+GENERATED_RE = re.compile(r'\s+GENERATED ALWAYS AS \(.*\) STORED', re.I)
+
+
+def translate_schema(sql: str) -> TranslatedSchema:
+    """Translate schema.sql for SQLite/DuckDB: functions and triggers are dropped, SERIAL/BIGSERIAL
+    become INTEGER/BIGINT (ids are assigned client-side), the generated order_items.id becomes a
+    plain column and REFERENCES clauses are moved to TranslatedSchema.foreign_keys, checked after
+    the load instead of on every appended row."""
+    schema = TranslatedSchema()
+    sql = FUNCTION_RE.sub('', sql)
+    schema.triggers = TRIGGER_RE.findall(sql)
+    sql = re.sub(r'--[^\n]*', '', sql)
+    for stmt in (s.strip() for s in sql.split(';')):
+        if stmt.upper().startswith('CREATE INDEX'):
+            schema.indexes.append(stmt)
+        elif stmt.upper().startswith('CREATE TABLE'):
+            table = TABLE_RE.match(stmt).group(1)
+            lines = []
+            for line in stmt.splitlines():
+                m = REFERENCES_RE.search(line)
+                if m:
+                    schema.foreign_keys.append((table, line.split()[0], m.group(1), m.group(2)))
+                    line = REFERENCES_RE.sub('', line)
+                line = re.sub(r'\bBIGSERIAL\b', 'BIGINT', line, flags=re.I)
+                line = re.sub(r'\bSERIAL\b', 'INTEGER', line, flags=re.I)
+                lines.append(GENERATED_RE.sub('', line))
+            schema.tables.append('\n'.join(lines))
+    return schema
+
+
+def post_load_checks(schema: TranslatedSchema, day_number: str) -> List[Tuple[str, str]]:
+    """(name, SELECT COUNT(*) of violating rows) for the foreign keys and the rules of the
+    schema.sql triggers. `day_number` formats a SQL day count from a DATE expression."""
+    checks = []
+    for table, column, parent, parent_column in schema.foreign_keys:
+        checks.append((f"{table}.{column} -> {parent}.{parent_column}", f"""
+            SELECT COUNT(*) FROM {table} c WHERE c.{column} IS NOT NULL
+               AND NOT EXISTS (SELECT 1 FROM {parent} p WHERE p.{parent_column} = c.{column})"""))
+    if 'trg_order_items_discount_vs_list' in schema.triggers:
+        checks.append(("order_items: khuyen_mai + chiet_khau < products.gia_niem_yet", """
+            SELECT COUNT(*) FROM order_items i JOIN products p ON p.id = i.product_id
+             WHERE COALESCE(i.khuyen_mai, 0) + COALESCE(i.chiet_khau, 0) >= p.gia_niem_yet"""))
+    if 'trg_product_cost_smoothness' in schema.triggers:
+        day = day_number.format('d.full_date')
+        # Costs are compared at NUMERIC(12,2) precision like the trigger; the epsilon absorbs REAL rounding
+        checks.append(("product_daily_costs: thay đổi theo ngày <= 3%", f"""
+            SELECT COUNT(*) FROM (
+                SELECT ROUND(c.cost, 2) AS cost, LAG(ROUND(c.cost, 2)) OVER w AS prev_cost,
+                       {day} - LAG({day}) OVER w AS gap
+                  FROM product_daily_costs c JOIN dates d ON d.date_id = c.date_id
+                WINDOW w AS (PARTITION BY c.product_id ORDER BY d.full_date)
+            ) x WHERE gap = 1 AND (cost > prev_cost * 1.03 + 1e-6 OR cost < prev_cost * 0.97 - 1e-6)"""))
+    # The 365-day range rule is checked in pandas (cost_range_violations)
+    return checks
+
+
+def cost_range_violations(df: pd.DataFrame) -> int:
+    """Rows of (product_id, full_date, cost), sorted by product and date, whose backward 365-day
+    window has max > 1.2 x min (the rolling rule of trg_product_cost_smoothness). Done in pandas
+    because SQLite (3.40) can return wrong min()/max() over a bounded window frame."""
+    if df.empty:
+        return 0
+    df = df.assign(full_date=pd.to_datetime(df['full_date']), cost=df['cost'].astype(float))
+    windows = df.set_index('full_date').groupby('product_id', observed=True, sort=False)['cost'].rolling('366D')
+    lo, hi = windows.min().to_numpy(), windows.max().to_numpy()
+    return int(((lo > 0) & (hi > lo * 1.2 + 1e-6)).sum())
+
+
+class DatabaseSink(FileSink):
+    """Embedded database file holding every table; subclasses implement connect(), append()
+    and query_frame()."""
+    day_number = '{}'  # SQL day count of a DATE expression, for the daily cost change check
+
+    def __init__(self, out_dir: str, compress: Optional[str] = None, compress_threads: Optional[int] = None):
+        super().__init__(out_dir, compress, compress_threads)
+        self.db_path = os.path.join(out_dir, DATABASE_FILE + self.extension)
+        if os.path.exists(self.db_path):
+            os.remove(self.db_path)  # a run replaces the previous output, like the file sinks
+        with open(SCHEMA_PATH, encoding='utf-8') as f:
+            self.schema = translate_schema(f.read())
+        self.conn = self.connect()
+        for stmt in self.schema.tables:
+            self.conn.execute(stmt)
+
+    def path(self, table: str) -> str:
+        return self.db_path
+
+    @abstractmethod
+    def connect(self):
+        ...
+
+    @abstractmethod
+    def append(self, table: str, df: pd.DataFrame):
+        ...
+
+    @abstractmethod
+    def query_frame(self, sql: str) -> pd.DataFrame:
+        ...
+
+    def write_frame(self, table: str, df: pd.DataFrame, first: bool):
+        for c in NUMERIC_COLUMNS.get(table, []):
+            df[c] = df[c].astype(float).round(2)
+        self.append(table, df)
+
+    def close(self):
+        # Indexes are built once over the loaded rows instead of maintained on every append
+        for stmt in self.schema.indexes:
+            self.conn.execute(stmt)
+        self.conn.commit()
+
+    def check(self) -> List[str]:
+        """Run the post-load checks, close the database and return the failed checks."""
+        problems = []
+        print(f"Kiểm tra sau khi nạp ({self.db_path}):")
+        for name, bad in self.run_checks():
+            print(f"  {'OK' if not bad else 'LỖI':<4} {name}" + (f": {bad} dòng vi phạm" if bad else ''))
+            if bad:
+                problems.append(f"{name}: {bad} dòng vi phạm")
+        self.conn.close()
+        return problems
+
+    def run_checks(self) -> Iterator[Tuple[str, int]]:
+        """(check, violating rows) for every post-load check."""
+        for name, sql in post_load_checks(self.schema, self.day_number):
+            yield name, self.conn.execute(sql).fetchone()[0]
+        if 'trg_product_cost_smoothness' in self.schema.triggers:
+            products = [r[0] for r in self.conn.execute("SELECT id FROM products ORDER BY id").fetchall()]
+            bad = 0
+            # A batch of products at a time keeps long cost histories out of memory
+            for i in range(0, len(products), COST_CHECK_PRODUCTS):
+                ids = ', '.join("'" + p.replace("'", "''") + "'" for p in products[i:i + COST_CHECK_PRODUCTS])
+                bad += cost_range_violations(self.query_frame(f"""
+                    SELECT c.product_id, d.full_date, ROUND(c.cost, 2) AS cost
+                      FROM product_daily_costs c JOIN dates d ON d.date_id = c.date_id
+                     WHERE c.product_id IN ({ids}) ORDER BY c.product_id, d.full_date"""))
+            yield "product_daily_costs: biên độ 365 ngày <= 20%", bad
+
+
+def sqlite_rows(df: pd.DataFrame):
+    """Rows of Python values sqlite3 binds natively: None for NaN, dates as ISO text."""
+    out = df.astype(object).where(df.notna(), None)
+    for c in out.columns:
+        values = out[c].dropna()
+        if len(values) and isinstance(values.iloc[0], date):
+            out[c] = out[c].map(lambda v: v.isoformat() if v is not None else None)
+    return out.itertuples(index=False, name=None)
+
+
+class SqliteSink(DatabaseSink):
+    extension = '.sqlite'
+    day_number = 'julianday({})'
+
+    def connect(self):
+        # Written from the BackgroundWriter thread; the file is rebuilt on every run, so no journal
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        return conn
+
+    def append(self, table: str, df: pd.DataFrame):
+        sql = f"INSERT INTO {table} ({', '.join(df.columns)}) VALUES ({', '.join('?' * len(df.columns))})"
+        self.conn.executemany(sql, sqlite_rows(df))
+        self.conn.commit()
+
+    def query_frame(self, sql: str) -> pd.DataFrame:
+        return pd.read_sql(sql, self.conn)
+
+    def close(self):
+        super().close()
+        self.conn.execute('ANALYZE')
+
+
+class DuckDbSink(DatabaseSink):
+    extension = '.duckdb'
+    day_number = "date_diff('day', DATE '1970-01-01', {})"
+
+    def __init__(self, out_dir: str, compress: Optional[str] = None, compress_threads: Optional[int] = None):
+        if duckdb is None:
+            raise ImportError("Cần cài duckdb để ghi DuckDB: pip install duckdb")
+        super().__init__(out_dir, compress, compress_threads)
+
+    def connect(self):
+        return duckdb.connect(self.db_path)
+
+    def append(self, table: str, df: pd.DataFrame):
+        # DuckDB scans the DataFrame in place (vectorized), no per-row conversion
+        cols = ', '.join(df.columns)
+        self.conn.register('chunk', df)
+        try:
+            self.conn.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM chunk")
+        finally:
+            self.conn.unregister('chunk')
+
+    def query_frame(self, sql: str) -> pd.DataFrame:
+        return self.conn.execute(sql).df()
+
+
+FILE_SINKS = {
+    'csv': CsvSink,
+    'parquet': ParquetSink,
+}
+
+DATABASE_SINKS = {
+    'sqlite': SqliteSink,
+    'duckdb': DuckDbSink,
+}
+
+SINKS = {**FILE_SINKS, **DATABASE_SINKS}
+
+
+def open_file_sink(fmt: str, out_dir: str, compress: Optional[str] = None,
+                   compress_threads: Optional[int] = None) -> FileSink:
+    """A CSV/Parquet sink: one file per table (what sharded runs and their manifests need)."""
+    if fmt not in FILE_SINKS:
+        raise ValueError(f"Định dạng không hỗ trợ: {fmt} (chọn {', '.join(FILE_SINKS)})")
+    return FILE_SINKS[fmt](out_dir, compress, compress_threads)
+
+
+def open_sink(fmt: str, out_dir: str, compress: Optional[str] = None,
+              compress_threads: Optional[int] = None) -> FileSink:
+    """Any --format of --no-db: CSV/Parquet files or an embedded SQLite/DuckDB database."""
+    if fmt not in SINKS:
+        raise ValueError(f"Định dạng không hỗ trợ: {fmt} (chọn {', '.join(SINKS)})")
+    return SINKS[fmt](out_dir, compress, compress_threads)
+
+
+class BackgroundWriter:
+    """Feed a sink from a bounded queue on a dedicated thread."""
+
+    def __init__(self, sink: FileSink, max_pending: int = 4):
+        self.sink = sink
+        self.q: "queue.Queue[Optional[Tuple[str, pd.DataFrame]]]" = queue.Queue(maxsize=max(1, max_pending))
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._run, name='file-writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.q.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+            table, df = item
+            try:
+                self.sink.write(table, df)
+            except BaseException as e:
+                self.error = e
+
+    def submit(self, table: str, df: pd.DataFrame):
+        if self.error is not None:
+            raise self.error
+        self.q.put((table, df))  # blocks while the writer is behind
+
+    def close(self) -> Dict[str, int]:
+        """Flush pending chunks, close files and return rows written per table."""
+        self.q.put(None)
+        self.thread.join()
+        self.sink.close()
+        if self.error is not None:
+            raise self.error
+        for table, n in self.sink.rows.items():
+            print(f"Đã ghi {table} ({n} dòng) -> {self.sink.path(table)}")
+        return dict(self.sink.rows)
@@ -1,19 +1,56 @@
-import pandas as pd
-from pathlib import Path
+import argparse
 import sys
+from pathlib import Path
+
+import pandas as pd
+
+DEFAULT_CSV = Path(__file__).resolve().parents[1] / 'exports' / 'csv' / 'orders.csv'
+
+
+def monthly_active_from_csv(path: Path) -> pd.Series:
+    if not path.exists():
+        print('orders.csv not found at', path)
+        sys.exit(1)
+    df = pd.read_csv(path)
+    if df.empty:
+        print('orders.csv is empty')
+        sys.exit(0)
+    df['ym'] = df['date_id'].astype(str).str[:6]
+    return df.groupby('ym')['customer_id'].nunique().sort_index()
+
+
+def monthly_active_from_db(itersize: int) -> pd.Series:
+    """Stream (month, customer) pairs from the orders table; only distinct pairs are kept in memory."""
+    from db_read import estimate_row_count, iter_query_batches
+    from export_to_excel import get_conn, load_db_from_env
+    with get_conn(load_db_from_env()) as conn:
+        total = estimate_row_count(conn, 'orders')
+        seen = []
+        done = 0
+        sql = "SELECT date_id / 100 AS ym, customer_id FROM orders WHERE customer_id IS NOT NULL"
+        for batch in iter_query_batches(conn, sql, itersize=itersize):
+            seen.append(batch.drop_duplicates())
+            done += len(batch)
+            print(f'read {done}/~{max(total, done)} orders', file=sys.stderr)
+    pairs = pd.concat(seen, ignore_index=True).drop_duplicates()
+    if pairs.empty:
+        print('orders is empty')
+        sys.exit(0)
+    return pairs.groupby(pairs['ym'].astype(str))['customer_id'].nunique().sort_index()
+
+
+def main():
+    p = argparse.ArgumentParser(description='Distinct buying customers per month')
+    p.add_argument('--csv', type=Path, default=DEFAULT_CSV, help='orders.csv to check (default exports/csv/orders.csv)')
+    p.add_argument('--db', action='store_true', help='Read orders from Postgres (PG_* env) instead of CSV')
+    p.add_argument('--itersize', type=int, default=50_000, help='Rows per server-side cursor batch with --db')
+    args = p.parse_args()
+
+    s = monthly_active_from_db(args.itersize) if args.db else monthly_active_from_csv(args.csv)
+    print('months:', len(s))
+    print('min:', int(s.min()), 'max:', int(s.max()))
+    print(s.to_string())
+
 
-path = Path(__file__).resolve().parents[1] / 'exports' / 'csv' / 'orders.csv'
-if not path.exists():
-    print('orders.csv not found at', path)
-    sys.exit(1)
-
-df = pd.read_csv(path)
-if df.empty:
-    print('orders.csv is empty')
-    sys.exit(0)
-
-df['ym'] = df['date_id'].astype(str).str[:6]
-s = df.groupby('ym')['customer_id'].nunique().sort_index()
-print('months:', len(s))
-print('min:', int(s.min()), 'max:', int(s.max()))
-print(s.to_string())
+if __name__ == '__main__':
+    main()